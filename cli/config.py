@@ -15,3 +15,19 @@ class Config(object):
 
     # the log verbosity level
     LOG_LEVEL = "info"
+
+    # the directory where parsed stages are cached
+    CACHE_DIR = "/var/cache/deepsea-cli"
+
+    # the maximum number of concurrent state rendering jobs (1 disables concurrency)
+    RENDER_WORKERS = 8
+
+    # the minimum time, in seconds, between two redraws of the running step
+    FRAME_BUDGET = 0.5
+
+    # the number of targets above which a step minion list is collapsed into counters
+    # (0 never collapses)
+    COLLAPSE_THRESHOLD = 20
+
+    # the Unix socket path of the monitor daemon
+    MONITORD_SOCKET = "/var/run/deepsea-monitord.sock"
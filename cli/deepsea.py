@@ -11,22 +11,36 @@ import logging
 import os
 import signal
 import sys
+import threading
 import time
 
-import pkg_resources
 import click
 
 from .config import Config
 from .common import PrettyPrinter as PP, PrettyFormat as PF
 from .common import requires_root_privileges, clean_pyc_files
 from .monitor import Monitor
+from .monitord import MonitorDaemon, attach as monitord_attach
+from .monitors.json_outputter import JSONLinesPrinter, open_json_output
 from .monitors.terminal_outputter import StepListPrinter, SimplePrinter
+from .salt_event import EventRecorder, EventReplayProcessor
 from .stage_executor import run_stage
 from .stage_parser import SLSParser, SaltRunner, SaltState, SaltStateFunction, \
                           SaltExecutionFunction, StageRenderingException, \
                           StateRenderingException
 
 
+def _print_version(ctx, param, value):  # pylint: disable=unused-argument
+    """
+    Prints the DeepSea version, pkg_resources is slow to import and is only needed here
+    """
+    if not value or ctx.resilient_parsing:
+        return
+    import pkg_resources
+    click.echo(str(pkg_resources.get_distribution('deepsea')))
+    ctx.exit()
+
+
 def _setup_logging():
     """
     Logging configuration
@@ -60,13 +74,30 @@ def _setup_logging():
     })
 
 
-def _run_monitor(show_state_steps, show_dynamic_steps, simple_output):
+def _add_listeners(mon, simple_output, json_stream, clear_screen=True):
+    """
+    Adds the terminal outputter and the JSON-lines outputter to the monitor. The terminal
+    outputter follows one orchestration at a time, while the JSON-lines output streams every
+    orchestration, and the terminal outputter is left out when it goes to the standard output.
+    Returns:
+        bool: whether the terminal outputter was added
+    """
+    terminal_output = json_stream is None or json_stream is not sys.stdout
+    if terminal_output:
+        mon.add_listener(SimplePrinter() if simple_output else StepListPrinter(clear_screen))
+    if json_stream:
+        lock = threading.Lock()
+        mon.add_listener_factory(lambda stage_name: JSONLinesPrinter(json_stream, lock))
+    return terminal_output
+
+
+def _run_monitor(show_state_steps, show_dynamic_steps, simple_output, recorder=None,
+                 json_stream=None):
     """
     Run the DeepSea stage monitor and progress visualizer
     """
-    mon = Monitor(show_state_steps, show_dynamic_steps)
-    listener = SimplePrinter() if simple_output else StepListPrinter()
-    mon.add_listener(listener)
+    mon = Monitor(show_state_steps, show_dynamic_steps, recorder=recorder)
+    terminal_output = _add_listeners(mon, simple_output, json_stream)
 
     logger = logging.getLogger(__name__)
 
@@ -76,30 +107,32 @@ def _run_monitor(show_state_steps, show_dynamic_steps, simple_output):
         SIGINT signal handler
         """
         logger.debug("SIGINT, calling monitor.stop()")
-        if not simple_output:
-            PP.pl_bold("\x1b[2K\rShutting down...")
-        else:
-            PP.println("Shutting down...")
-        PP.println()
+        if terminal_output:
+            if not simple_output:
+                PP.pl_bold("\x1b[2K\rShutting down...")
+            else:
+                PP.println("Shutting down...")
+            PP.println()
         mon.stop()
 
     signal.signal(signal.SIGINT, sigint_handler)
 
-    if not simple_output:
-        os.system('clear')
-        PP.println("Use Ctrl+C to stop the monitor")
-        PP.p_bold("Initializing DeepSea progess monitor...")
-    else:
-        PP.println("Use Ctrl+C to stop the monitor")
-        PP.print("Initializing DeepSea progess monitor...")
+    if terminal_output:
+        if not simple_output:
+            os.system('clear')
+            PP.println("Use Ctrl+C to stop the monitor")
+            PP.p_bold("Initializing DeepSea progess monitor...")
+        else:
+            PP.println("Use Ctrl+C to stop the monitor")
+            PP.print("Initializing DeepSea progess monitor...")
 
     mon.start()
-    if not simple_output:
-        PP.pl_bold(" done.")
-    else:
-        PP.println(" done")
-
-    PP.println()
+    if terminal_output:
+        if not simple_output:
+            PP.pl_bold(" done.")
+        else:
+            PP.println(" done")
+        PP.println()
     if sys.version_info > (3, 0):
         logger.debug("Python 3: blocking main thread on join()")
         mon.wait_to_finish()
@@ -110,6 +143,69 @@ def _run_monitor(show_state_steps, show_dynamic_steps, simple_output):
         mon.wait_to_finish()
 
 
+def _run_monitord(socket_path, show_state_steps, show_dynamic_steps):
+    """
+    Runs the DeepSea monitor daemon until SIGINT or SIGTERM is received
+    """
+    mon = Monitor(show_state_steps, show_dynamic_steps)
+    daemon = MonitorDaemon(mon, socket_path)
+
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=W0613
+    def signal_handler(*args):
+        """
+        SIGINT/SIGTERM signal handler
+        """
+        logger.debug("signal received, stopping the monitor daemon")
+        mon.stop()
+
+    signal.signal(signal.SIGINT, signal_handler)
+    signal.signal(signal.SIGTERM, signal_handler)
+
+    daemon.start()
+    try:
+        mon.start()
+        while mon.is_running():
+            time.sleep(1)
+        mon.wait_to_finish()
+    finally:
+        daemon.stop()
+
+
+def _run_replay(record_file, speed, show_state_steps, show_dynamic_steps, simple_output,
+                json_stream=None):
+    """
+    Replays a recorded Salt event stream into the DeepSea stage monitor and progress visualizer
+    """
+    processor = EventReplayProcessor(record_file, speed)
+    mon = Monitor(show_state_steps, show_dynamic_steps, processor)
+    for stage_name, (parsed_steps, out) in processor.recorded_stages().items():
+        mon.set_stage_steps(stage_name, parsed_steps, out)
+    _add_listeners(mon, simple_output, json_stream)
+
+    logger = logging.getLogger(__name__)
+
+    # pylint: disable=W0613
+    def sigint_handler(*args):
+        """
+        SIGINT signal handler
+        """
+        logger.debug("SIGINT, calling monitor.stop()")
+        mon.stop()
+
+    signal.signal(signal.SIGINT, sigint_handler)
+
+    t0 = time.time()
+    mon.start()
+    while mon.is_running():
+        time.sleep(0.2)
+    mon.wait_until_idle()
+    mon.stop(True)
+    logger.info("Replay took %ss, event stats: %s", round(time.time() - t0, 3),
+                mon.event_stats())
+
+
 def _validate_stage_file_exists(stage_name):
     """
     Verifies if the stage file corresponding to the stage_name arg really exists
@@ -249,8 +345,17 @@ def _run_show_stage_steps(stage_name, hide_state_steps, only_visible_steps):
 @click.option('--log-file', default='/var/log/deepsea.log',
               type=click.Path(dir_okay=False),
               help="the file path for the log to be stored (default: /var/log/deepsea.log)")
-@click.version_option(pkg_resources.get_distribution('deepsea'), message="%(version)s")
-def cli(log_level, log_file):
+@click.option('--render-workers', default=8, type=click.IntRange(min=1),
+              help="maximum number of concurrent state rendering jobs (default: 8)")
+@click.option('--frame-budget', default=0.5, type=float,
+              help="minimum time in seconds between two redraws of the running step "
+                   "(default: 0.5)")
+@click.option('--collapse-threshold', default=20, type=click.IntRange(min=0),
+              help="number of minions above which the minion list of a step is collapsed "
+                   "into counters, 0 never collapses (default: 20)")
+@click.option('--version', is_flag=True, callback=_print_version, expose_value=False,
+              is_eager=True, help="Show the version and exit.")
+def cli(log_level, log_file, render_workers, frame_budget, collapse_threshold):
     """
     DeepSea CLI tool.
 
@@ -260,22 +365,115 @@ def cli(log_level, log_file):
     """
     Config.LOG_LEVEL = log_level
     Config.LOG_FILE_PATH = log_file
+    Config.RENDER_WORKERS = render_workers
+    if frame_budget <= 0:
+        raise click.BadParameter("must be greater than 0", param_hint="--frame-budget")
+    Config.FRAME_BUDGET = frame_budget
+    Config.COLLAPSE_THRESHOLD = collapse_threshold
 
 
 @click.command(name='monitor')
 @click.option('--show-state-steps', is_flag=True, help="shows state visible steps progress")
 @click.option('--show-dynamic-steps', is_flag=True, help="shows runtime generated steps")
 @click.option('--simple-output', is_flag=True, help="minimalistic b&w output")
+@click.option('--record', 'record_file', type=click.Path(dir_okay=False),
+              help="record the Salt events into this file")
+@click.option('--record-steps', is_flag=True, help="also record the parsed stage steps")
+@click.option('--json-output', type=click.Path(dir_okay=False, allow_dash=True),
+              help="stream progress as JSON lines into this file, \"-\" replaces the "
+                   "terminal output")
 @requires_root_privileges
-def monitor(show_state_steps, show_dynamic_steps, simple_output):
+def monitor(show_state_steps, show_dynamic_steps, simple_output, record_file, record_steps,
+            json_output):
     """
     Starts DeepSea progress monitor.
 
     This allows to visualize DeepSea execution progress when running DS stages
     using salt-run commands in other terminal sessions.
+
+    The terminal output follows one orchestration at a time, while the
+    --json-output stream includes every concurrent orchestration.
     """
     _setup_logging()
-    _run_monitor(show_state_steps, show_dynamic_steps, simple_output)
+    recorder = EventRecorder(record_file, record_steps) if record_file else None
+    json_stream = open_json_output(json_output) if json_output else None
+    try:
+        _run_monitor(show_state_steps, show_dynamic_steps, simple_output, recorder,
+                     json_stream)
+    finally:
+        if recorder:
+            recorder.close()
+        if json_stream and json_stream is not sys.stdout:
+            json_stream.close()
+
+
+@click.command(name='monitord', short_help='runs the monitor daemon')
+@click.option('--socket', 'socket_path', default=Config.MONITORD_SOCKET,
+              type=click.Path(dir_okay=False),
+              help="the Unix socket path (default: {})".format(Config.MONITORD_SOCKET))
+@click.option('--hide-state-steps', is_flag=True, help="don't track state visible steps")
+@click.option('--hide-dynamic-steps', is_flag=True, help="don't track runtime generated steps")
+@requires_root_privileges
+def monitord(socket_path, hide_state_steps, hide_dynamic_steps):
+    """
+    Starts DeepSea progress monitor daemon.
+
+    The daemon subscribes once to the Salt event bus, tracks every DeepSea
+    orchestration, and serves snapshots and updates as JSON lines to the
+    clients connected to its Unix socket, e.g., using the "attach" command.
+    """
+    _setup_logging()
+    _run_monitord(socket_path, not hide_state_steps, not hide_dynamic_steps)
+
+
+@click.command(name='attach', short_help='attaches to the monitor daemon')
+@click.option('--socket', 'socket_path', default=Config.MONITORD_SOCKET,
+              type=click.Path(dir_okay=False),
+              help="the Unix socket path (default: {})".format(Config.MONITORD_SOCKET))
+@click.option('--snapshot', is_flag=True,
+              help="only print the current state of the orchestrations")
+def attach(socket_path, snapshot):
+    """
+    Attaches to the DeepSea monitor daemon and prints, as JSON lines, the
+    current state of the orchestrations followed by their progress updates.
+    """
+    try:
+        monitord_attach(socket_path, snapshot)
+    except KeyboardInterrupt:
+        pass
+    except (IOError, OSError) as ex:
+        raise click.ClickException("failed to connect to the monitor daemon at {}: {}"
+                                   .format(socket_path, ex))
+
+
+@click.command(name='replay', short_help='replays recorded Salt events')
+@click.argument('record_file', type=click.Path(exists=True, dir_okay=False))
+@click.option('--speed', default=1.0, type=float,
+              help="replay speed factor, 0 replays at maximum speed (default: 1.0)")
+@click.option('--show-state-steps', is_flag=True, help="shows state visible steps progress")
+@click.option('--show-dynamic-steps', is_flag=True, help="shows runtime generated steps")
+@click.option('--simple-output', is_flag=True, help="minimalistic b&w output")
+@click.option('--json-output', type=click.Path(dir_okay=False, allow_dash=True),
+              help="stream progress as JSON lines into this file, \"-\" replaces the "
+                   "terminal output")
+def replay(record_file, speed, show_state_steps, show_dynamic_steps, simple_output,
+           json_output):
+    """
+    Replays a Salt event stream recorded with the --record option of the
+    "monitor" or "stage run" commands.
+
+    No Salt master is needed to replay a recording.
+    """
+    if speed < 0:
+        raise click.BadParameter("must be >= 0", param_hint="--speed")
+    _setup_logging()
+    json_stream = open_json_output(json_output) if json_output else None
+    try:
+        _run_replay(record_file, speed, show_state_steps, show_dynamic_steps, simple_output,
+                    json_stream)
+    finally:
+        if json_stream and json_stream is not sys.stdout:
+            json_stream.close()
 
 
 @click.group(short_help='stage related commands')
@@ -310,8 +508,18 @@ def stage_dryrun(stage_name, hide_state_steps, only_visible_steps, clear_cache):
 @click.option('--hide-state-steps', is_flag=True, help="shows state visible steps progress")
 @click.option('--hide-dynamic-steps', is_flag=True, help="shows runtime generated steps")
 @click.option('--simple-output', is_flag=True, help="minimalistic b&w output")
+@click.option('--record', 'record_file', type=click.Path(dir_okay=False),
+              help="record the Salt events into this file")
+@click.option('--record-steps', is_flag=True, help="also record the parsed stage steps")
+@click.option('--json-output', type=click.Path(dir_okay=False, allow_dash=True),
+              help="stream progress as JSON lines into this file, \"-\" replaces the "
+                   "terminal output")
+@click.option('--profile', is_flag=True, help="print a timing report when the stage finishes")
+@click.option('--profile-file', type=click.Path(dir_okay=False),
+              help="save the timing report as JSON into this file")
 @requires_root_privileges
-def stage_run(stage_name, hide_state_steps, hide_dynamic_steps, simple_output):
+def stage_run(stage_name, hide_state_steps, hide_dynamic_steps, simple_output, record_file,
+              record_steps, json_output, profile, profile_file):
     """
     Runs a DeepSea stage
 
@@ -323,7 +531,8 @@ def stage_run(stage_name, hide_state_steps, hide_dynamic_steps, simple_output):
     _setup_logging()
     _validate_stage_file_exists(stage_name)
 
-    ret = run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output)
+    ret = run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output,
+                    record_file, record_steps, json_output, profile, profile_file)
     PP.flush()
     sys.exit(ret)
 
@@ -341,8 +550,18 @@ def salt_run():
 @click.option('--hide-state-steps', is_flag=True, help="shows state visible steps progress")
 @click.option('--hide-dynamic-steps', is_flag=True, help="shows runtime generated steps")
 @click.option('--simple-output', is_flag=True, help="minimalistic b&w output")
+@click.option('--record', 'record_file', type=click.Path(dir_okay=False),
+              help="record the Salt events into this file")
+@click.option('--record-steps', is_flag=True, help="also record the parsed stage steps")
+@click.option('--json-output', type=click.Path(dir_okay=False, allow_dash=True),
+              help="stream progress as JSON lines into this file, \"-\" replaces the "
+                   "terminal output")
+@click.option('--profile', is_flag=True, help="print a timing report when the stage finishes")
+@click.option('--profile-file', type=click.Path(dir_okay=False),
+              help="save the timing report as JSON into this file")
 @requires_root_privileges
-def state_orch(stage_name, hide_state_steps, hide_dynamic_steps, simple_output):
+def state_orch(stage_name, hide_state_steps, hide_dynamic_steps, simple_output, record_file,
+               record_steps, json_output, profile, profile_file):
     """
     Runs a DeepSea stage
 
@@ -353,7 +572,8 @@ def state_orch(stage_name, hide_state_steps, hide_dynamic_steps, simple_output):
     _setup_logging()
     _validate_stage_file_exists(stage_name)
 
-    ret = run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output)
+    ret = run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output,
+                    record_file, record_steps, json_output, profile, profile_file)
     sys.exit(ret)
 
 
@@ -362,6 +582,9 @@ def main():
     CLI main function
     """
     cli.add_command(monitor)
+    cli.add_command(monitord)
+    cli.add_command(attach)
+    cli.add_command(replay)
     cli.add_command(stage)
     cli.add_command(salt_run)
     stage.add_command(stage_dryrun)
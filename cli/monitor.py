@@ -6,17 +6,20 @@ DeepSea stage's progress monitor
 from __future__ import absolute_import
 from __future__ import print_function
 
+import datetime
 import logging
-import operator
+import pickle
+import tempfile
 import threading
-from functools import reduce
+from collections import deque, OrderedDict
 
 from six.moves import range
 
 from .common import PrettyPrinter as PP
 from .salt_event import SaltEventProcessor
 from .salt_event import EventListener
-from .salt_event import NewJobEvent, NewRunnerEvent, RetJobEvent, RetRunnerEvent
+from .salt_event import NewJobEvent, NewRunnerEvent, RetJobEvent, RetRunnerEvent, \
+                        StateResultEvent
 from .stage_parser import SLSParser, SaltRunner, SaltState, SaltStateFunction, \
                           SaltExecutionFunction, RenderingException
 
@@ -26,6 +29,102 @@ from .stage_parser import SLSParser, SaltRunner, SaltState, SaltStateFunction, \
 logger = logging.getLogger(__name__)
 
 
+class ReturnStore(object):
+    """
+    Store of the full Salt events that finished steps and states. The events are kept
+    pickled, and only loaded again when needed, e.g., to output a failure summary. Events
+    bigger than SPILL_THRESHOLD are spilled to a temporary file.
+    """
+    SPILL_THRESHOLD = 64 * 1024
+
+    def __init__(self):
+        self._file = None
+        self._lock = threading.Lock()
+        # key -> pickled event, for the events kept in memory
+        self._events = {}
+        # key -> (offset, length), for the events spilled to the temporary file
+        self._index = {}
+
+    def put(self, key, raw_event):
+        data = pickle.dumps(raw_event, pickle.HIGHEST_PROTOCOL)
+        with self._lock:
+            if len(data) < self.SPILL_THRESHOLD:
+                self._index.pop(key, None)
+                self._events[key] = data
+                return
+            self._events.pop(key, None)
+            if self._file is None:
+                self._file = tempfile.TemporaryFile(prefix="deepsea-cli-")
+            self._file.seek(0, 2)
+            self._index[key] = (self._file.tell(), len(data))
+            self._file.write(data)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._events:
+                data = self._events[key]
+            else:
+                offset, length = self._index[key]
+                self._file.seek(offset)
+                data = self._file.read(length)
+        return pickle.loads(data)
+
+    def spilled(self):
+        """
+        Returns:
+            int: the number of events spilled to the temporary file
+        """
+        return len(self._index)
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            self._events = {}
+            self._index = {}
+
+
+class StepEvent(object):
+    """
+    Compact summary of the Salt event that finished a step, or a state in a minion. The full
+    event is kept in a ReturnStore and loaded on access to raw_event.
+    """
+    __slots__ = ['jid', 'stamp', 'minion', 'success', 'retcode', 'failed_states', '_store',
+                 '_key']
+
+    def __init__(self, event, store):
+        """
+        Args:
+            event (salt_event.SaltEvent): the Salt event
+            store (ReturnStore): the store where to spill the full event
+        """
+        self.jid = event.jid
+        self.stamp = event.stamp
+        self.minion = getattr(event, 'minion', None)
+        self.retcode = getattr(event, 'retcode', None)
+        if isinstance(event, StateResultEvent):
+            self.success = event.result
+            self.failed_states = [] if event.result else [event.state_id]
+        else:
+            self.success = event.success
+            self.failed_states = StepEvent._failed_states(getattr(event, 'ret', None))
+        self._store = store
+        self._key = (event.tag, self.minion)
+        store.put(self._key, event.raw_event)
+
+    @staticmethod
+    def _failed_states(ret):
+        if not isinstance(ret, dict):
+            return []
+        return [state.get('__id__', key) for key, state in ret.items()
+                if isinstance(state, dict) and state.get('result') is False]
+
+    @property
+    def raw_event(self):
+        return self._store.get(self._key)
+
+
 class Stage(object):
     """
     Class that models the execution of a DeepSea stage
@@ -35,6 +134,9 @@ class Stage(object):
         """
         Class that models the execution of a single step
         """
+        __slots__ = ['step', 'name', 'order', 'jid', 'finished', 'success', 'start_event',
+                     'end_event', 'skipped', 'args_str']
+
         def __init__(self, step, name, order):
             """
             Args:
@@ -61,7 +163,8 @@ class Stage(object):
             for arg in event.args:
                 if isinstance(arg, dict):
                     for key, val in arg.items():
-                        if key in ['concurrent', 'saltenv', '__kwarg__', 'queue']:
+                        if key in ['concurrent', 'saltenv', '__kwarg__', 'queue',
+                                   'orchestration_jid', '__orchestration_jid__']:
                             continue
                         if first:
                             self.args_str += "{}={}".format(key, val)
@@ -84,15 +187,29 @@ class Stage(object):
             self.end_event = event
 
     class TargetedStep(Step):
+        __slots__ = ['targets', 'sub_steps', 'finished_targets', 'failed_targets',
+                     '_states_index']
+
         def __init__(self, step, name, order):
             super(Stage.TargetedStep, self).__init__(step, name, order)
             self.targets = None
             self.sub_steps = []
+            self.finished_targets = 0
+            self.failed_targets = 0
+            # (minion, state name) -> list of sub-steps
+            self._states_index = {}
+
+        @property
+        def total_targets(self):
+            return len(self.targets) if self.targets else 0
 
         # pylint: disable=W0221
         def start(self, event):
             super(Stage.TargetedStep, self).start(event)
             self.targets = {}
+            self.finished_targets = 0
+            self.failed_targets = 0
+            self._states_index = {}
             for target in event.targets:
                 self.targets[target] = {
                     'finished': False,
@@ -100,24 +217,46 @@ class Stage(object):
                     'states': [Stage.Step(s.step, s.name, s.order) for s in self.sub_steps
                                if s.step.target == target]
                 }
+                for sstep in self.targets[target]['states']:
+                    if isinstance(sstep.step, (SaltStateFunction, SaltExecutionFunction)):
+                        self._states_index.setdefault((target, sstep.name), []).append(sstep)
 
         def finish(self, event):
-            self.targets[event.minion]['finished'] = True
-            self.targets[event.minion]['success'] = event.success and event.retcode == 0
-            self.targets[event.minion]['event'] = event
+            target = self.targets[event.minion]
+            success = event.success and event.retcode == 0
+            if target['finished']:
+                # repeated return from the same minion, only the latest result counts
+                if not target['success']:
+                    self.failed_targets -= 1
+            else:
+                self.finished_targets += 1
+            if not success:
+                self.failed_targets += 1
 
-            if reduce(operator.__and__, [t['finished'] for t in self.targets.values()]):
-                self.success = reduce(
-                    operator.__and__, [t['success'] for t in self.targets.values()])
+            target['finished'] = True
+            target['success'] = success
+            target['event'] = event
+
+            if self.finished_targets == len(self.targets):
+                self.success = self.failed_targets == 0
                 self.finished = True
 
-        def state_result(self, event):
-            for sstep in self.targets[event.minion]['states']:
-                if isinstance(sstep.step, (SaltStateFunction, SaltExecutionFunction)):
-                    if sstep.name == event.name or sstep.name == event.state_id:
-                        sstep.success = event.result
-                        sstep.finished = True
-                        sstep.end_event = event
+        def state_result(self, event, store):
+            """
+            Args:
+                event (salt_event.StateResultEvent): the state result event
+                store (ReturnStore): the store where to spill the full event
+            """
+            ssteps = self._states_index.get((event.minion, event.name), [])
+            if event.state_id != event.name:
+                ssteps = ssteps + self._states_index.get((event.minion, event.state_id), [])
+            if not ssteps:
+                return
+            summary = StepEvent(event, store)
+            for sstep in ssteps:
+                sstep.success = event.result
+                sstep.finished = True
+                sstep.end_event = summary
 
     def __init__(self, name, steps, enable_dynamic):
         self.name = name
@@ -130,6 +269,14 @@ class Stage(object):
         self.end_event = None
         self._enable_dynamic = enable_dynamic
         self._dynamic_steps = {}
+        # (name, args) -> list of dynamic steps
+        self._dynamic_index = {}
+        # jid -> started step (parsed or dynamic)
+        self._jid_index = {}
+        # step description -> list of parsed steps
+        self._desc_index = {}
+        # full events of finished steps and states
+        self._returns = ReturnStore()
 
         self._steps = []
         for step in self._parsed_steps:
@@ -147,10 +294,31 @@ class Stage(object):
 
             assert wrapper
             self._steps.append(wrapper)
+            self._desc_index.setdefault(step.desc, []).append(wrapper)
 
     def total_steps(self):
         return len(self._steps)
 
+    def close(self):
+        """
+        Releases the full events of the finished steps
+        """
+        self._returns.close()
+
+    def steps(self):
+        """
+        Returns:
+            list: the parsed steps wrappers, in execution order
+        """
+        return list(self._steps)
+
+    def dynamic_steps(self):
+        """
+        Returns:
+            list: the runtime generated steps wrappers
+        """
+        return list(self._dynamic_steps.values())
+
     def start(self, event):
         """
         Flags this stage as executing, and stores its salt job id
@@ -169,7 +337,15 @@ class Stage(object):
         self.success = event.success
         self.end_event = event
 
-    def start_step(self, event):
+    def start_step(self, event, allow_dynamic=True):
+        """
+        Starts the parsed step matching the event, or adds a runtime generated step
+        Args:
+            event (NewJobEvent | NewRunnerEvent): the salt start event
+            allow_dynamic (bool): whether the event can be a runtime generated step
+        Returns:
+            tuple: (step, next step, dynamic step)
+        """
         assert self._executing
 
         if self.current_step >= len(self._steps):
@@ -187,6 +363,7 @@ class Stage(object):
                 if isinstance(curr_step.step, SaltRunner):
                     if not curr_step.jid and curr_step.name == event.fun[7:]:
                         curr_step.start(event)
+                        self._jid_index[event.jid] = curr_step
                         self.current_step += i
                         if i == 0:
                             return curr_step, None, None
@@ -200,6 +377,7 @@ class Stage(object):
                                 set(curr_step.step.target) != set(event.targets):
                             continue
                         curr_step.start(event)
+                        self._jid_index[event.jid] = curr_step
                         self.current_step += i
                         if i == 0:
                             return curr_step, None, None
@@ -208,7 +386,7 @@ class Stage(object):
             else:
                 assert False
 
-        if not self._enable_dynamic:
+        if not self._enable_dynamic or not allow_dynamic:
             return None, None, None
 
         curr_step = self._steps[self.current_step]
@@ -222,13 +400,11 @@ class Stage(object):
             step.start(event)
             if self.current_step == 0 and curr_step.start_event is None:
                 # check for duplicates before starting step 1
-                for ex_step in self._dynamic_steps.values():
-                    if (ex_step.name == step.name and
-                            ex_step.args_str == step.args_str):
-                        logger.info("FOUND DUPLICATE: %s(%s)", ex_step.name, ex_step.args_str)
-                        # possible parsing generated duplicate
-                        return None, None, None
-            self._dynamic_steps[event.jid] = step
+                for ex_step in self._dynamic_index.get((step.name, step.args_str), []):
+                    logger.info("FOUND DUPLICATE: %s(%s)", ex_step.name, ex_step.args_str)
+                    # possible parsing generated duplicate
+                    return None, None, None
+            self._add_dynamic_step(event.jid, step)
             return None, None, step
         elif isinstance(event, NewJobEvent):
             step_name = event.args[0] if event.fun == 'state.sls' else event.fun
@@ -236,18 +412,21 @@ class Stage(object):
             step.start(event)
             if self.current_step == 0 and curr_step.start_event is None:
                 # check for duplicates before starting step 1
-                for ex_step in self._dynamic_steps.values():
-                    if (ex_step.name == step.name and
-                            ex_step.args_str == step.args_str):
-                        if (hasattr(ex_step, 'targets') and
-                                list(ex_step.targets.keys()) == event.targets):
-                            # possible parsing generated duplicate
-                            return None, None, None
-            self._dynamic_steps[event.jid] = step
+                for ex_step in self._dynamic_index.get((step.name, step.args_str), []):
+                    if (hasattr(ex_step, 'targets') and
+                            list(ex_step.targets.keys()) == event.targets):
+                        # possible parsing generated duplicate
+                        return None, None, None
+            self._add_dynamic_step(event.jid, step)
             return None, None, step
 
         return None, None, None
 
+    def _add_dynamic_step(self, jid, step):
+        self._dynamic_steps[jid] = step
+        self._dynamic_index.setdefault((step.name, step.args_str), []).append(step)
+        self._jid_index[jid] = step
+
     def finish_step(self, event):
         """
         Consumes the current step
@@ -255,44 +434,26 @@ class Stage(object):
             event (saltevent.SaltEvent): the step object
         """
         assert self._executing
+        assert isinstance(event, (RetRunnerEvent, RetJobEvent))
 
         if self.current_step >= len(self._steps):
             return None
 
-        if isinstance(event, RetRunnerEvent):
-            curr_step = self._steps[self.current_step]
-            if curr_step.jid and curr_step.jid == event.jid:
-                curr_step.finish(event)
-                self.current_step += 1
-                return self._steps[self.current_step-1]
-
-        elif isinstance(event, RetJobEvent):
-            curr_step = self._steps[self.current_step]
-            if curr_step.jid and curr_step.jid == event.jid:
-                curr_step.finish(event)
-                if curr_step.finished:
-                    self.current_step += 1
-                return curr_step
-
-        else:
-            assert False
-
-        if not self._enable_dynamic:
+        step = self._jid_index.get(event.jid)
+        if step is None:
             return None
 
-        # this step is not part of stage parsed steps
-        if isinstance(event, RetRunnerEvent):
-            if event.jid in self._dynamic_steps:
-                step = self._dynamic_steps[event.jid]
-                step.finish(event)
-                return step
-        elif isinstance(event, RetJobEvent):
-            if event.jid in self._dynamic_steps:
-                step = self._dynamic_steps[event.jid]
-                step.finish(event)
-                return step
+        if step.order > 0:
+            if step is not self._steps[self.current_step]:
+                return None
+            step.finish(StepEvent(event, self._returns))
+            if step.finished:
+                self.current_step += 1
+            return step
 
-        return None
+        # this step is not part of stage parsed steps
+        step.finish(StepEvent(event, self._returns))
+        return step
 
     def state_result_step(self, event):
         """
@@ -308,8 +469,8 @@ class Stage(object):
         curr_step = self._steps[self.current_step]
         assert not curr_step.finished
 
-        if event.jid == curr_step.jid:
-            curr_step.state_result(event)
+        if self._jid_index.get(event.jid) is curr_step:
+            curr_step.state_result(event, self._returns)
             return curr_step
 
         return None
@@ -322,21 +483,17 @@ class Stage(object):
 
         curr_step = self._steps[self.current_step]
         for dep in curr_step.step.on_success_deps:
-            for i in range(1, self.current_step+1):
-                dep_step = self._steps[self.current_step-i]
-                if dep_step.step.desc == dep.desc:
-                    if not dep_step.success:
-                        curr_step.skipped = True
-                        self.current_step += 1
-                        return curr_step
+            for dep_step in self._desc_index.get(dep.desc, []):
+                if dep_step.order <= self.current_step and not dep_step.success:
+                    curr_step.skipped = True
+                    self.current_step += 1
+                    return curr_step
         for dep in curr_step.step.on_fail_deps:
-            for i in range(1, self.current_step+1):
-                dep_step = self._steps[self.current_step-i]
-                if dep_step.step.desc == dep.desc:
-                    if dep_step.success:
-                        curr_step.skipped = True
-                        self.current_step += 1
-                        return curr_step
+            for dep_step in self._desc_index.get(dep.desc, []):
+                if dep_step.order <= self.current_step and dep_step.success:
+                    curr_step.skipped = True
+                    self.current_step += 1
+                    return curr_step
 
         return None
 
@@ -458,6 +615,9 @@ class Monitor(threading.Thread):
     Stage monitoring class
     """
 
+    # maximum number of buffered events before the event processor is blocked
+    EVENT_BUFFER_SIZE = 10000
+
     class Event(object):
         def __init__(self, monitor, func, event):
             self.monitor = monitor
@@ -468,16 +628,65 @@ class Monitor(threading.Thread):
             logger.debug("handle: %s", self.event)
             getattr(self.monitor, self.func)(self.event)
 
+    class EventStats(object):
+        """
+        Event pipeline backpressure counters
+        """
+        def __init__(self):
+            self.received = 0
+            self.handled = 0
+            self.blocked = 0
+            self.queue_depth = 0
+            self.max_queue_depth = 0
+            self.last_lag = 0.0
+            self.max_lag = 0.0
+
+        def handled_event(self, event):
+            """
+            Updates the counters after an event was handled
+            Args:
+                event (saltevent.SaltEvent): the handled event
+            """
+            self.handled += 1
+            try:
+                stamp = datetime.datetime.strptime(event.stamp, "%Y-%m-%dT%H:%M:%S.%f")
+            except (TypeError, ValueError):
+                return
+            self.last_lag = (datetime.datetime.utcnow() - stamp).total_seconds()
+            if self.last_lag > self.max_lag:
+                self.max_lag = self.last_lag
+
+        def to_dict(self):
+            return {
+                'received': self.received,
+                'handled': self.handled,
+                'blocked': self.blocked,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'last_lag': self.last_lag,
+                'max_lag': self.max_lag,
+            }
+
     class DeepSeaEventListener(EventListener):
         """
         Salt event listener for DeepSea
         """
+        RUNNER_IGNORED_FUNS = ['pillar', 'saltutil.find_job']
+        JOB_IGNORED_FUNS = ['pillar', 'saltutil.find_job', 'grains', 'deepsea.render_sls']
+
         def __init__(self, monitor):
             self.monitor = monitor
 
+        def subscription(self):
+            return {
+                'new_runner': self.RUNNER_IGNORED_FUNS,
+                'ret_runner': self.RUNNER_IGNORED_FUNS,
+                'new_job': self.JOB_IGNORED_FUNS,
+                'ret_job': self.JOB_IGNORED_FUNS,
+                'state_result': [],
+            }
+
         def handle_new_runner_event(self, event):
-            if 'pillar' in event.fun or 'saltutil.find_job' in event.fun:
-                return
             logger.debug("buffer: %s", event)
             if event.fun == 'runner.state.orch':
                 self.monitor.append_event(Monitor.Event(self.monitor, 'start_stage', event))
@@ -485,8 +694,6 @@ class Monitor(threading.Thread):
                 self.monitor.append_event(Monitor.Event(self.monitor, 'start_step', event))
 
         def handle_ret_runner_event(self, event):
-            if 'pillar' in event.fun or 'saltutil.find_job' in event.fun:
-                return
             logger.debug("buffer: %s", event)
             if event.fun == 'runner.state.orch':
                 self.monitor.append_event(Monitor.Event(self.monitor, 'end_stage', event))
@@ -494,18 +701,10 @@ class Monitor(threading.Thread):
                 self.monitor.append_event(Monitor.Event(self.monitor, 'end_step', event))
 
         def handle_new_job_event(self, event):
-            if 'pillar' in event.fun or 'saltutil.find_job' in event.fun or 'grains' in event.fun:
-                return
-            if event.fun == 'deepsea.render_sls':
-                return
             logger.debug("buffer: %s", event)
             self.monitor.append_event(Monitor.Event(self.monitor, 'start_step', event))
 
         def handle_ret_job_event(self, event):
-            if 'pillar' in event.fun or 'saltutil.find_job' in event.fun or 'grains' in event.fun:
-                return
-            if event.fun == 'deepsea.render_sls':
-                return
             logger.debug("buffer: %s", event)
             self.monitor.append_event(Monitor.Event(self.monitor, 'end_step', event))
 
@@ -513,19 +712,41 @@ class Monitor(threading.Thread):
             logger.debug("buffer: %s", event)
             self.monitor.append_event(Monitor.Event(self.monitor, 'state_result_step', event))
 
-    def __init__(self, show_state_steps, show_dynamic_steps):
+    def __init__(self, show_state_steps, show_dynamic_steps, processor=None, recorder=None):
+        """
+        Args:
+            show_state_steps (bool): whether to track the state steps
+            show_dynamic_steps (bool): whether to track the runtime generated steps
+            processor (SaltEventProcessor): the event processor, defaults to a processor
+                                            listening to the Salt event BUS
+            recorder (EventRecorder): records the received events and parsed stage steps
+        """
         super(Monitor, self).__init__()
-        self._processor = SaltEventProcessor()
+        self._recorder = recorder
+        if processor is None:
+            processor = SaltEventProcessor(recorder)
+        self._processor = processor
         self._processor.add_listener(Monitor.DeepSeaEventListener(self))
         self._show_state_steps = show_state_steps
         self._show_dynamic_steps = show_dynamic_steps
-        self._running_stage = None
+        # orchestration jid -> running stage, in the order they started
+        self._running_stages = OrderedDict()
+        # step jid -> running stage
+        self._job_stages = {}
+        # the orchestration followed by the monitor listeners
+        self._followed_jid = None
         self._monitor_listeners = []
+        self._listener_factories = []
+        # orchestration jid -> listeners created by the listener factories
+        self._stage_listener_objs = {}
         self._event_lock = threading.Lock()
         self._event_cond = threading.Condition(self._event_lock)
-        self._event_buffer = []
+        self._event_buffer = deque()
+        self._event_stats = Monitor.EventStats()
         self._running = False
+        self._handling = False
         self._stage_steps = {}
+        self._known_steps = {}
 
     def parse_stage(self, stage_name):
         self._fire_event('stage_started', stage_name)
@@ -538,17 +759,50 @@ class Monitor(threading.Thread):
             self._fire_event('stage_parsing_finished', None, None, ex)
             raise ex
         self._stage_steps[stage_name] = (parsed_steps, out)
+        if self._recorder:
+            self._recorder.record_stage(stage_name, parsed_steps, out)
+
+    def set_stage_steps(self, stage_name, parsed_steps, out):
+        """
+        Sets the parsed steps of a stage, which will be used instead of parsing the stage
+        when it starts, e.g., when replaying a recording
+        Args:
+            stage_name (str): the stage name
+            parsed_steps (list): the list of stage_parser.SaltStep objects
+            out (str): the stage parsing output
+        """
+        self._known_steps[stage_name] = (parsed_steps, out)
 
     def append_event(self, event):
         with self._event_cond:
+            if len(self._event_buffer) >= self.EVENT_BUFFER_SIZE and self._running:
+                # the monitor is not keeping up, block the event processor
+                self._event_stats.blocked += 1
+                while len(self._event_buffer) >= self.EVENT_BUFFER_SIZE and self._running:
+                    self._event_cond.wait(0.2)
             self._event_buffer.append(event)
-            self._event_cond.notify()
+            self._event_stats.received += 1
+            self._event_stats.queue_depth = len(self._event_buffer)
+            if self._event_stats.queue_depth > self._event_stats.max_queue_depth:
+                self._event_stats.max_queue_depth = self._event_stats.queue_depth
+            self._event_cond.notify_all()
+
+    def event_stats(self):
+        """
+        Returns the event pipeline backpressure counters
+        Returns:
+            dict: received/handled/blocked events, current and max queue depth, and the
+                  last and max lag (in seconds) between the event stamp and its handling
+        """
+        with self._event_cond:
+            return self._event_stats.to_dict()
 
     def start(self):
         """
         Start the monitoring thread
         """
         logger.info("Starting the DeepSea event monitoring")
+        self._running = True
         self._processor.start()
         super(Monitor, self).start()
 
@@ -570,6 +824,14 @@ class Monitor(threading.Thread):
         self._processor.join()
         self.join()
 
+    def wait_until_idle(self):
+        """
+        Blocks until all buffered events have been handled
+        """
+        with self._event_cond:
+            while (self._event_buffer or self._handling) and self._running:
+                self._event_cond.wait(0.2)
+
     def is_running(self):
         """
         Checks wheather the Salt event process is still runnning
@@ -580,66 +842,174 @@ class Monitor(threading.Thread):
         self._running = True
         while self._running:
             with self._event_cond:
-                if self._event_buffer:
-                    event = self._event_buffer.pop(0)
-                    event.call()
-                else:
+                if not self._event_buffer:
                     self._event_cond.wait(0.2)
+                batch = self._event_buffer
+                self._event_buffer = deque()
+                self._event_stats.queue_depth = 0
+                self._handling = bool(batch)
+                self._event_cond.notify_all()
+
+            # events are handled outside the lock so that the event processor is never
+            # blocked by the handlers and listeners
+            for event in batch:
+                event.call()
+                self._event_stats.handled_event(event.event)
+            if batch:
+                logger.debug("handled batch of %s events, max_lag=%ss", len(batch),
+                             self._event_stats.max_lag)
+                with self._event_cond:
+                    self._handling = False
+                    self._event_cond.notify_all()
+        # release the events of the stages that did not finish, e.g., when the monitor is
+        # stopped in the middle of a stage
+        for stage in list(self._running_stages.values()):
+            stage.close()
+        logger.info("Event pipeline stats: %s", self.event_stats())
 
     def add_listener(self, listener):
         """
-        Register a monitor listener
+        Register a monitor listener. Listeners registered this way follow a single
+        orchestration at a time: the first one that starts while no other orchestration is
+        being followed.
         Args:
             listener (MonitorListener): the listener object
         """
         assert isinstance(listener, MonitorListener)
         self._monitor_listeners.append(listener)
 
+    def add_listener_factory(self, factory):
+        """
+        Register a monitor listener factory. The factory is called for each orchestration that
+        starts, and the listener it creates receives the events of that orchestration only.
+        This allows to follow concurrent orchestrations in separate outputs.
+        Args:
+            factory (function): function that receives the stage name and returns a
+                                MonitorListener object
+        """
+        self._listener_factories.append(factory)
+
+    def running_stages(self):
+        """
+        Returns:
+            list: the stages being executed, in the order they started
+        """
+        return list(self._running_stages.values())
+
     def _fire_event(self, event, *args):
         logger.debug("fire event: %s", event)
         for listener in self._monitor_listeners:
             getattr(listener, event)(*args)
 
+    def _stage_listeners(self, stage):
+        listeners = self._stage_listener_objs.get(stage.jid, [])
+        if stage.jid == self._followed_jid:
+            listeners = self._monitor_listeners + listeners
+        return listeners
+
+    def _fire_stage_event(self, stage, event, *args):
+        logger.debug("fire event: %s stage=%s jid=%s", event, stage.name, stage.jid)
+        for listener in self._stage_listeners(stage):
+            getattr(listener, event)(*args)
+
     def start_stage(self, event):
         """
-        Sets the current running stage
+        Starts tracking an orchestration
         Args:
             event (NewRunnerEvent): the DeepSea state.orch start event
         """
+        if event.orchestration_jid in self._running_stages:
+            # orchestration started by a running orchestration, track it as a step
+            self.start_step(event)
+            return
+
         stage_name = event.args[0]
+        listeners = [factory(stage_name) for factory in self._listener_factories]
+        follow = self._followed_jid is None
+        if follow:
+            self._followed_jid = event.jid
+
+        def fire(name, *args):
+            for listener in listeners:
+                getattr(listener, name)(*args)
+            if follow and stage_name not in self._stage_steps:
+                # stage run already notified the monitor listeners when parsing the stage
+                self._fire_event(name, *args)
+
+        fire('stage_started', stage_name)
+        fire('stage_parsing_started', stage_name)
         if stage_name in self._stage_steps:
             parsed_steps, out = self._stage_steps[stage_name]
+        elif stage_name in self._known_steps:
+            parsed_steps, out = self._known_steps[stage_name]
         else:
-            self._fire_event('stage_started', stage_name)
-            self._fire_event('stage_parsing_started', stage_name)
             try:
                 parsed_steps, out = SLSParser.parse_stage(
                     stage_name, not self._show_state_steps, True)
             except RenderingException as ex:
-                self._fire_event('stage_parsing_finished', None, None, ex)
+                fire('stage_parsing_finished', None, None, ex)
+                if follow:
+                    self._followed_jid = None
                 return
-        self._running_stage = Stage(stage_name, parsed_steps, self._show_dynamic_steps)
+            if self._recorder:
+                self._recorder.record_stage(stage_name, parsed_steps, out)
+        stage = Stage(stage_name, parsed_steps, self._show_dynamic_steps)
+        stage.start(event)
+        self._running_stages[stage.jid] = stage
+        self._stage_listener_objs[stage.jid] = listeners
 
-        self._fire_event('stage_parsing_finished', self._running_stage, out, None)
-
-        self._running_stage.start(event)
-        logger.info("Start stage: %s jid=%s", self._running_stage.name, self._running_stage.jid)
+        self._fire_stage_event(stage, 'stage_parsing_finished', stage, out, None)
+        logger.info("Start stage: %s jid=%s (%s running)", stage.name, stage.jid,
+                    len(self._running_stages))
 
     def end_stage(self, event):
         """
-        Sets the current running stage as finished
+        Sets an orchestration as finished
         Args:
             event (RetRunnerEvent): the DeepSea state.orch end event
         """
-        if not self._running_stage:
-            # not inside a running stage, igore step
+        stage = self._running_stages.get(event.jid)
+        if stage is None:
+            if event.jid in self._job_stages:
+                # orchestration started by a running orchestration
+                self.end_step(event)
             return
 
-        self._running_stage.finish(event)
-        tmp_stage = self._running_stage
-        self._running_stage = None
-        logger.info("End stage: %s jid=%s success=%s", tmp_stage.name, tmp_stage.jid, event.success)
-        self._fire_event('stage_finished', tmp_stage)
+        stage.finish(event)
+        logger.info("End stage: %s jid=%s success=%s", stage.name, stage.jid, event.success)
+        self._fire_stage_event(stage, 'stage_finished', stage)
+        del self._running_stages[stage.jid]
+        del self._stage_listener_objs[stage.jid]
+        for jid in [jid for jid, jstage in self._job_stages.items() if jstage is stage]:
+            del self._job_stages[jid]
+        if self._followed_jid == stage.jid:
+            self._followed_jid = None
+        stage.close()
+
+    def _route_start_step(self, event):
+        """
+        Finds the running orchestration of a new job/runner event, and starts the matching
+        step in it. The orchestration jid lineage is used when present in the event,
+        otherwise the event is matched against the next steps of each running orchestration,
+        and runtime generated steps are assigned to the last orchestration that started.
+        Returns:
+            tuple: (stage, (step, next step, dynamic step))
+        """
+        if event.orchestration_jid in self._running_stages:
+            stage = self._running_stages[event.orchestration_jid]
+            return stage, stage.start_step(event)
+
+        stages = list(self._running_stages.values())
+        if len(stages) == 1:
+            return stages[0], stages[0].start_step(event)
+
+        for stage in stages:
+            steps = stage.start_step(event, False)
+            if any(steps):
+                return stage, steps
+        if stages:
+            return stages[-1], stages[-1].start_step(event)
+        return None, (None, None, None)
 
     def start_step(self, event):
         """
@@ -647,12 +1017,11 @@ class Monitor(threading.Thread):
         Args:
             event (NewJobEvent | NewRunnerEvent): the salt start event
         """
-        if not self._running_stage:
-            # not inside a running stage, igore step
-            return
-        step, nstep, dstep = self._running_stage.start_step(event)
+        stage, (step, nstep, dstep) = self._route_start_step(event)
         if not step and not nstep and not dstep:
+            # not inside a running stage, igore step
             return
+        self._job_stages[event.jid] = stage
 
         if nstep:
             if isinstance(step, Stage.TargetedStep):
@@ -660,29 +1029,29 @@ class Monitor(threading.Thread):
                     # step not even started
                     step.skipped = True
                     logger.info("Skipping non started state step: [%s/%s] name=%s(%s)",
-                                step.order, self._running_stage.total_steps(), step.name,
+                                step.order, stage.total_steps(), step.name,
                                 step.args_str)
-                    self._fire_event('step_state_skipped', step)
+                    self._fire_stage_event(stage, 'step_state_skipped', step)
                 else:
                     logger.info("State step finished without 'ret' event: [%s/%s] name=%s(%s) "
                                 "on=%s",
                                 step.order,
-                                self._running_stage.total_steps(), step.name, step.args_str,
+                                stage.total_steps(), step.name, step.args_str,
                                 list(step.targets.keys()))
-                    self._fire_event('step_state_finished', step)
+                    self._fire_stage_event(stage, 'step_state_finished', step)
             else:
                 if not step.jid:
                     # step not even started
                     step.skipped = True
                     logger.info("Skipping non started runner step: [%s/%s] name=%s(%s)",
-                                step.order, self._running_stage.total_steps(), step.name,
+                                step.order, stage.total_steps(), step.name,
                                 step.args_str)
-                    self._fire_event('step_runner_skipped', step)
+                    self._fire_stage_event(stage, 'step_runner_skipped', step)
                 else:
                     logger.info("Runner step finished without 'ret' event:: [%s/%s] name=%s(%s)",
-                                step.order, self._running_stage.total_steps(), step.name,
+                                step.order, stage.total_steps(), step.name,
                                 step.args_str)
-                    self._fire_event('step_runner_finished', step)
+                    self._fire_stage_event(stage, 'step_runner_finished', step)
             step = nstep
 
         if dstep:
@@ -690,13 +1059,13 @@ class Monitor(threading.Thread):
 
         if isinstance(step, Stage.TargetedStep):
             logger.info("Started State step: [%s/%s] name=%s(%s) on=%s", step.order,
-                        self._running_stage.total_steps(), step.name, step.args_str,
+                        stage.total_steps(), step.name, step.args_str,
                         list(step.targets.keys()))
-            self._fire_event('step_state_started', step)
+            self._fire_stage_event(stage, 'step_state_started', step)
         else:
             logger.info("Started Runner step: [%s/%s] name=%s(%s)", step.order,
-                        self._running_stage.total_steps(), step.name, step.args_str)
-            self._fire_event('step_runner_started', step)
+                        stage.total_steps(), step.name, step.args_str)
+            self._fire_stage_event(stage, 'step_runner_started', step)
 
     def end_step(self, event):
         """
@@ -704,49 +1073,51 @@ class Monitor(threading.Thread):
         Args:
             event (RetJobEvent | RetRunnerEvent): the salt end event
         """
-        if not self._running_stage:
-            # not inside a running stage, igore step
+        stage = self._job_stages.get(event.jid)
+        if not stage:
+            # not a step of a running stage, igore step
             return
-        step = self._running_stage.finish_step(event)
+        step = stage.finish_step(event)
         if not step:
             return
         if isinstance(step, Stage.TargetedStep):
             logger.info("Finished State step: [%s/%s] name=%s(%s) in=%s success=%s", step.order,
-                        self._running_stage.total_steps(), step.name, step.args_str,
+                        stage.total_steps(), step.name, step.args_str,
                         event.minion, step.targets[event.minion]['success'])
             if not step.targets[event.minion]['success']:
                 logger.info("State step error:\n%s", PP.format_dict(event.raw_event))
-            self._fire_event('step_state_minion_finished', step, event.minion)
+            self._fire_stage_event(stage, 'step_state_minion_finished', step, event.minion)
             if step.finished:
-                self._fire_event('step_state_finished', step)
+                self._fire_stage_event(stage, 'step_state_finished', step)
         else:
             logger.info("Finished Runner step: [%s/%s] name=%s(%s) success=%s", step.order,
-                        self._running_stage.total_steps(), step.name, step.args_str,
+                        stage.total_steps(), step.name, step.args_str,
                         event.success)
             if not event.success:
                 logger.info("State step error:\n%s", PP.format_dict(event.raw_event))
-            self._fire_event('step_runner_finished', step)
+            self._fire_stage_event(stage, 'step_runner_finished', step)
 
-        skipped = self._running_stage.check_if_current_step_will_run()
+        skipped = stage.check_if_current_step_will_run()
         while skipped:
             if isinstance(skipped, Stage.TargetedStep):
                 logger.info("Skipping state step: [%s/%s] name=%s(%s)", skipped.order,
-                            self._running_stage.total_steps(), skipped.name, skipped.args_str)
-                self._fire_event('step_state_skipped', skipped)
+                            stage.total_steps(), skipped.name, skipped.args_str)
+                self._fire_stage_event(stage, 'step_state_skipped', skipped)
             else:
                 logger.info("Skipping runner step: [%s/%s] name=%s(%s)", skipped.order,
-                            self._running_stage.total_steps(), skipped.name, skipped.args_str)
-                self._fire_event('step_runner_skipped', skipped)
-            skipped = self._running_stage.check_if_current_step_will_run()
+                            stage.total_steps(), skipped.name, skipped.args_str)
+                self._fire_stage_event(stage, 'step_runner_skipped', skipped)
+            skipped = stage.check_if_current_step_will_run()
 
     def state_result_step(self, event):
         if not self._show_state_steps:
             return
-        if not self._running_stage:
-            # not inside a running stage, igore step
+        stage = self._job_stages.get(event.jid)
+        if not stage:
+            # not a step of a running stage, igore step
             return
-        step = self._running_stage.state_result_step(event)
+        step = stage.state_result_step(event)
         if not step:
             return
         logger.info("State Result: %s: %s result=%s", event.state_id, event.name, event.result)
-        self._fire_event('step_state_result', step, event)
+        self._fire_stage_event(stage, 'step_state_result', step, event)
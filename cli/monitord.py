@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+"""
+DeepSea monitor daemon
+This module is responsible for serving the progress of every DeepSea orchestration, tracked
+by a single Monitor, to any number of local clients through a Unix socket.
+
+Protocol: the client sends a single request line and the daemon replies with JSON lines.
+    snapshot   - the daemon replies with the current snapshot and closes the connection
+    subscribe  - the daemon replies with the current snapshot followed by every update, as
+                 emitted by the JSON-lines outputter, until the client disconnects
+"""
+from __future__ import absolute_import
+
+from collections import deque, OrderedDict
+import copy
+import datetime
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+
+from six.moves import queue
+
+from .monitors.json_outputter import JSONLinesPrinter
+
+
+# pylint: disable=C0103
+logger = logging.getLogger(__name__)
+
+
+def _dumps(record):
+    return json.dumps(record, separators=(',', ':'), sort_keys=True, default=str) + "\n"
+
+
+class DaemonListener(JSONLinesPrinter):
+    """
+    JSON-lines outputter that publishes its records through the monitor daemon
+    """
+    def __init__(self, daemon):
+        super(DaemonListener, self).__init__(None)
+        self.daemon = daemon
+
+    def write_record(self, record):
+        self.daemon.publish(record)
+
+
+class MonitorDaemon(object):
+    """
+    Serves snapshots and updates of the orchestrations tracked by a Monitor
+    """
+    # number of finished orchestrations kept in the snapshot
+    FINISHED_HISTORY = 10
+    # number of updates buffered per client, slower clients are disconnected
+    CLIENT_QUEUE_SIZE = 10000
+
+    class Client(threading.Thread):
+        def __init__(self, server, conn):
+            super(MonitorDaemon.Client, self).__init__()
+            self.server = server
+            self.conn = conn
+            self.daemon = True
+            self.updates = queue.Queue(MonitorDaemon.CLIENT_QUEUE_SIZE)
+
+        def push(self, line):
+            """
+            Queues an update to be sent to the client
+            Returns:
+                bool: False if the client is not keeping up
+            """
+            try:
+                self.updates.put_nowait(line)
+                return True
+            except queue.Full:
+                return False
+
+        def close(self):
+            try:
+                self.updates.put_nowait(None)
+            except queue.Full:
+                self.conn.close()
+
+        def run(self):
+            try:
+                while True:
+                    line = self.updates.get()
+                    if line is None:
+                        break
+                    self.conn.sendall(line.encode('utf-8'))
+            except socket.error as ex:
+                logger.debug("client disconnected: %s", ex)
+            finally:
+                self.server.remove_client(self)
+                self.conn.close()
+
+    def __init__(self, monitor, socket_path):
+        """
+        Args:
+            monitor (Monitor): the monitor, which must not be started yet
+            socket_path (str): the Unix socket path
+        """
+        self.socket_path = socket_path
+        self._lock = threading.Lock()
+        self._clients = []
+        # orchestration jid -> orchestration state
+        self._running = OrderedDict()
+        self._finished = deque(maxlen=self.FINISHED_HISTORY)
+        # orchestration jid -> step number -> minion id -> success of its latest return
+        self._finished_minions = {}
+        self._server = None
+        self._thread = None
+        self._stopping = False
+        monitor.add_listener_factory(lambda stage_name: DaemonListener(self))
+
+    def start(self):
+        """
+        Starts listening for clients
+        """
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+        self._server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        old_umask = os.umask(0o077)
+        try:
+            self._server.bind(self.socket_path)
+        finally:
+            os.umask(old_umask)
+        self._server.listen(16)
+        self._thread = threading.Thread(target=self._accept_loop)
+        self._thread.daemon = True
+        self._thread.start()
+        logger.info("Monitor daemon listening on %s", self.socket_path)
+
+    def stop(self):
+        """
+        Disconnects the clients and stops listening
+        """
+        self._stopping = True
+        if self._server:
+            try:
+                self._server.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+            self._server.close()
+            self._server = None
+        with self._lock:
+            clients = list(self._clients)
+        for client in clients:
+            client.close()
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def _accept_loop(self):
+        while not self._stopping:
+            try:
+                conn, _ = self._server.accept()
+            except (socket.error, AttributeError):
+                break
+            # the request is read by another thread, so that a slow client does not delay
+            # the others
+            handler = threading.Thread(target=self._handle_connection, args=(conn,))
+            handler.daemon = True
+            handler.start()
+
+    def _handle_connection(self, conn):
+        try:
+            self._handle_request(conn)
+        except socket.error as ex:
+            logger.debug("client request failed: %s", ex)
+            conn.close()
+        except ValueError as ex:
+            # UnicodeDecodeError is a ValueError
+            logger.debug("malformed client request: %s", ex)
+            try:
+                conn.sendall(_dumps({'event': 'error', 'error': "malformed request"})
+                             .encode('utf-8'))
+            except socket.error:
+                pass
+            conn.close()
+
+    @staticmethod
+    def _read_request(conn):
+        conn.settimeout(5)
+        data = b""
+        while b"\n" not in data and len(data) < 64:
+            chunk = conn.recv(64)
+            if not chunk:
+                break
+            data += chunk
+        conn.settimeout(None)
+        return data.split(b"\n")[0].strip().decode('utf-8')
+
+    def _handle_request(self, conn):
+        request = self._read_request(conn)
+        if request == 'snapshot':
+            conn.sendall(_dumps(self.snapshot()).encode('utf-8'))
+            conn.close()
+        elif request == 'subscribe':
+            client = MonitorDaemon.Client(self, conn)
+            with self._lock:
+                # registered under the lock so that no update is lost between the snapshot
+                # and the first update
+                client.push(_dumps(self._snapshot()))
+                self._clients.append(client)
+            client.start()
+        else:
+            conn.sendall(_dumps({'event': 'error',
+                                 'error': "unknown request: {}".format(request)})
+                         .encode('utf-8'))
+            conn.close()
+
+    def remove_client(self, client):
+        with self._lock:
+            if client in self._clients:
+                self._clients.remove(client)
+
+    def _snapshot(self):
+        running = []
+        for orch in self._running.values():
+            orch = copy.deepcopy(orch)
+            orch['steps'] = list(orch['steps'].values())
+            running.append(orch)
+        return {
+            'event': 'snapshot',
+            'ts': datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f"),
+            'running': running,
+            'finished': copy.deepcopy(list(self._finished)),
+        }
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: the state of the running and last finished orchestrations
+        """
+        with self._lock:
+            return self._snapshot()
+
+    def publish(self, record):
+        """
+        Applies a JSON-lines outputter record to the snapshot and sends it to the subscribed
+        clients
+        Args:
+            record (dict): the record
+        """
+        line = _dumps(record)
+        with self._lock:
+            self._apply(record)
+            for client in list(self._clients):
+                if not client.push(line):
+                    logger.warning("monitor daemon client is not keeping up, disconnecting")
+                    self._clients.remove(client)
+                    client.close()
+
+    def _apply(self, record):
+        event = record['event']
+        orch_jid = record.get('orch_jid')
+        if orch_jid is None:
+            return
+        if event == 'stage_parsing_finished':
+            self._running[orch_jid] = {
+                'orch_jid': orch_jid,
+                'stage': record['stage'],
+                'started': record['ts'],
+                'total_steps': record.get('total_steps'),
+                'current_step': None,
+                'steps': OrderedDict(),
+            }
+            self._finished_minions[orch_jid] = {}
+            return
+
+        orch = self._running.get(orch_jid)
+        if orch is None:
+            return
+        if event == 'stage_finished':
+            del self._running[orch_jid]
+            self._finished_minions.pop(orch_jid, None)
+            orch['success'] = record['success']
+            orch['finished'] = record['ts']
+            orch['steps'] = list(orch['steps'].values())
+            self._finished.append(orch)
+            return
+        if not event.startswith('step_') or record['step'] < 1:
+            return
+
+        step = orch['steps'].get(record['step'])
+        if step is None:
+            step = {'step': record['step'], 'name': record['name'],
+                    'type': 'state' if event.startswith('step_state') else 'runner',
+                    'status': 'running'}
+            orch['steps'][record['step']] = step
+            orch['current_step'] = record['step']
+
+        if event.endswith('_skipped'):
+            step['status'] = 'skipped'
+        elif event == 'step_state_started':
+            step['targets'] = len(record['targets'])
+            step['finished_targets'] = 0
+            step['failed_targets'] = 0
+            step['started'] = record['ts']
+            self._finished_minions.setdefault(orch_jid, {})[record['step']] = {}
+        elif event == 'step_runner_started':
+            step['started'] = record['ts']
+        elif event == 'step_state_minion_finished':
+            # a minion may return more than once, and step_state_started may have been missed
+            minions = self._finished_minions.setdefault(orch_jid, {}).setdefault(
+                record['step'], {})
+            step.setdefault('finished_targets', 0)
+            step.setdefault('failed_targets', 0)
+            if record['minion'] in minions:
+                # only the latest result counts, as in Stage.TargetedStep.finish
+                if not minions[record['minion']]:
+                    step['failed_targets'] -= 1
+            else:
+                step['finished_targets'] += 1
+            if not record['success']:
+                step['failed_targets'] += 1
+            minions[record['minion']] = record['success']
+        elif event in ['step_state_finished', 'step_runner_finished']:
+            step['status'] = 'ok' if record['success'] else 'failed'
+
+
+def attach(socket_path, snapshot_only=False, out=None):
+    """
+    Connects to the monitor daemon and writes the received JSON lines
+    Args:
+        socket_path (str): the Unix socket path of the daemon
+        snapshot_only (bool): only request the current snapshot
+        out (file): where to write the JSON lines, defaults to the standard output
+    """
+    if out is None:
+        out = sys.stdout
+    conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    conn.connect(socket_path)
+    try:
+        conn.sendall(b"snapshot\n" if snapshot_only else b"subscribe\n")
+        buf = b""
+        while True:
+            chunk = conn.recv(65536)
+            if not chunk:
+                break
+            buf += chunk
+            lines = buf.split(b"\n")
+            buf = lines.pop()
+            for line in lines:
+                out.write(line.decode('utf-8') + "\n")
+            out.flush()
+    finally:
+        conn.close()
@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""
+This module is responsible for outputting the DeepSea stage execution progress as a stream
+of JSON objects, one per line, to be consumed by other tools
+"""
+from __future__ import absolute_import
+
+import datetime
+import json
+import sys
+import threading
+
+from ..monitor import MonitorListener
+
+
+# pylint: disable=C0111
+
+
+def open_json_output(path):
+    """
+    Opens the JSON output destination
+    Args:
+        path (str): the file path, or "-" for the standard output
+    Returns:
+        file: the file object
+    """
+    if path == '-':
+        return sys.stdout
+    return open(path, 'w')
+
+
+class JSONLinesPrinter(MonitorListener):
+    """
+    This class writes a compact JSON object for each stage, step, and minion transition.
+    Every object has the "event" and "ts" keys, "ts" being the Salt event timestamp when
+    available, or the current UTC time otherwise.
+    """
+    def __init__(self, stream, lock=None):
+        """
+        Args:
+            stream (file): the file object where to write the JSON objects
+            lock (threading.Lock): lock shared by the printers writing to the same stream
+        """
+        self.stream = stream
+        self.stage_name = None
+        self.orch_jid = None
+        self._lock = lock if lock is not None else threading.Lock()
+
+    def close(self):
+        """
+        Closes the output stream unless it's the standard output
+        """
+        if self.stream is not sys.stdout:
+            self.stream.close()
+
+    def _emit(self, event, stamp=None, **fields):
+        fields['event'] = event
+        fields['ts'] = stamp if stamp else \
+            datetime.datetime.utcnow().strftime("%Y-%m-%dT%H:%M:%S.%f")
+        if self.stage_name is not None and 'stage' not in fields:
+            fields['stage'] = self.stage_name
+        if self.orch_jid is not None:
+            fields['orch_jid'] = self.orch_jid
+        self.write_record(fields)
+
+    def write_record(self, record):
+        """
+        Writes a record as a JSON line to the output stream
+        Args:
+            record (dict): the record
+        """
+        line = json.dumps(record, separators=(',', ':'), sort_keys=True, default=str)
+        with self._lock:
+            self.stream.write(line + "\n")
+            self.stream.flush()
+
+    @staticmethod
+    def _stamp(event):
+        return event.stamp if event else None
+
+    @staticmethod
+    def _step_fields(step):
+        fields = {'step': step.order, 'name': step.name}
+        if step.jid:
+            fields['jid'] = step.jid
+        if step.args_str:
+            fields['args'] = step.args_str
+        return fields
+
+    def stage_started(self, stage_name):
+        self.stage_name = stage_name
+        self._emit('stage_started')
+
+    def stage_parsing_started(self, stage_name):
+        self._emit('stage_parsing_started', stage=stage_name)
+
+    def stage_parsing_state(self, states, minion=None):
+        self._emit('stage_parsing_state', states=sorted(states), minion=minion)
+
+    def stage_parsing_finished(self, stage, output, exception):
+        if exception:
+            self._emit('stage_parsing_finished', success=False,
+                       error=exception.pretty_error_desc_str())
+            return
+        self.orch_jid = stage.jid
+        self._emit('stage_parsing_finished', success=True, total_steps=stage.total_steps(),
+                   output=output.strip())
+
+    def stage_finished(self, stage):
+        self._emit('stage_finished', stamp=self._stamp(stage.end_event), success=stage.success,
+                   steps=stage.current_step, total_steps=stage.total_steps(),
+                   start=self._stamp(stage.start_event))
+        self.stage_name = None
+        self.orch_jid = None
+
+    def step_runner_started(self, step):
+        self._emit('step_runner_started', stamp=self._stamp(step.start_event),
+                   **self._step_fields(step))
+
+    def step_runner_finished(self, step):
+        self._emit('step_runner_finished', stamp=self._stamp(step.end_event),
+                   success=step.success,
+                   **self._step_fields(step))
+
+    def step_runner_skipped(self, step):
+        self._emit('step_runner_skipped', **self._step_fields(step))
+
+    def step_state_started(self, step):
+        self._emit('step_state_started', stamp=self._stamp(step.start_event),
+                   targets=sorted(step.targets or []), **self._step_fields(step))
+
+    def step_state_minion_finished(self, step, minion):
+        target = step.targets[minion]
+        self._emit('step_state_minion_finished', stamp=target['event'].stamp, minion=minion,
+                   success=target['success'], **self._step_fields(step))
+
+    def step_state_result(self, step, event):
+        self._emit('step_state_result', stamp=event.stamp, minion=event.minion,
+                   state=event.state_id, state_name=event.name, success=event.result,
+                   **self._step_fields(step))
+
+    def step_state_finished(self, step):
+        self._emit('step_state_finished', success=step.success, **self._step_fields(step))
+
+    def step_state_skipped(self, step):
+        self._emit('step_state_skipped', **self._step_fields(step))
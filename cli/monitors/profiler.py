@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+This module is responsible for profiling the execution time of a DeepSea stage from the
+timestamps of the Salt events
+"""
+from __future__ import absolute_import
+from __future__ import division
+
+import datetime
+import json
+import logging
+
+from ..common import PrettyPrinter as PP
+from ..monitor import MonitorListener, Stage
+
+
+# pylint: disable=C0111
+logger = logging.getLogger(__name__)
+
+
+def _ts(event):
+    return datetime.datetime.strptime(event.stamp, "%Y-%m-%dT%H:%M:%S.%f")
+
+
+def _seconds(start_event, end_event):
+    return round((_ts(end_event) - _ts(start_event)).total_seconds(), 3)
+
+
+def _percentile(values, pct):
+    """
+    Nearest-rank percentile of a sorted list of values
+    """
+    idx = int(round((len(values) - 1) * pct / 100.0))
+    return values[idx]
+
+
+def _profile_step(step, top_minions):
+    res = {
+        'step': step.order,
+        'name': step.name,
+        'type': 'state' if isinstance(step, Stage.TargetedStep) else 'runner',
+        'skipped': step.skipped,
+        'success': step.success,
+        'wall_time': None,
+    }
+    if step.start_event is None:
+        return res
+
+    if not isinstance(step, Stage.TargetedStep):
+        if step.end_event is not None:
+            res['wall_time'] = _seconds(step.start_event, step.end_event)
+        return res
+
+    durations = sorted([(_seconds(step.start_event, data['event']), minion)
+                        for minion, data in step.targets.items() if data['finished']],
+                       reverse=True)
+    if durations:
+        times = sorted(d for d, _ in durations)
+        res['wall_time'] = times[-1]
+        res['minions'] = {
+            'count': len(times),
+            'p50': _percentile(times, 50),
+            'p95': _percentile(times, 95),
+            'max': times[-1],
+        }
+        res['slowest_minions'] = [{'minion': minion, 'time': duration}
+                                  for duration, minion in durations[:top_minions]]
+    return res
+
+
+def _critical_path(steps, step_reports):
+    """
+    Computes the longest chain of steps, weighted by their wall time, in the requisites
+    graph of the stage steps. Steps are in execution order, therefore requisites always
+    come before the steps that require them.
+    """
+    by_parsed_step = {}
+    best = {}
+    for step, report in zip(steps, step_reports):
+        weight = report['wall_time'] or 0
+        prev = None
+        for dep in step.step.on_success_deps + step.step.on_fail_deps:
+            dep_step = by_parsed_step.get(id(dep))
+            if dep_step is not None and (prev is None or best[dep_step][0] > best[prev][0]):
+                prev = dep_step
+        best[step] = (weight + (best[prev][0] if prev is not None else 0), prev)
+        by_parsed_step[id(step.step)] = step
+
+    if not best:
+        return {'time': 0, 'steps': []}
+
+    last = max(steps, key=lambda s: best[s][0])
+    total = best[last][0]
+    path = []
+    while last is not None:
+        path.append(last)
+        last = best[last][1]
+    path.reverse()
+    return {'time': round(total, 3), 'steps': [{'step': s.order, 'name': s.name} for s in path]}
+
+
+def profile_stage(stage, top_minions=3):
+    """
+    Builds the timing report of a finished stage
+    Args:
+        stage (Stage): the stage object
+        top_minions (int): the number of slowest minions reported per step
+    Returns:
+        dict: the timing report
+    """
+    steps = stage.steps()
+    step_reports = [_profile_step(step, top_minions) for step in steps]
+    report = {
+        'stage': stage.name,
+        'success': stage.success,
+        'wall_time': None,
+        'runner_time': round(sum(r['wall_time'] or 0 for r in step_reports
+                                 if r['type'] == 'runner'), 3),
+        'state_time': round(sum(r['wall_time'] or 0 for r in step_reports
+                                if r['type'] == 'state'), 3),
+        'steps': step_reports,
+        'dynamic_steps': len(stage.dynamic_steps()),
+        'critical_path': _critical_path(steps, step_reports),
+    }
+    if stage.start_event is not None and stage.end_event is not None:
+        report['wall_time'] = _seconds(stage.start_event, stage.end_event)
+    return report
+
+
+def print_report(report):
+    """
+    Prints the timing report to the terminal
+    """
+    def ftime(seconds):
+        return "-" if seconds is None else "{:.1f}s".format(seconds)
+
+    PP.println()
+    PP.pl_bold("Timing report of {}:".format(report['stage']))
+    PP.println("  total={} runners={} states={} dynamic steps={}"
+               .format(ftime(report['wall_time']), ftime(report['runner_time']),
+                       ftime(report['state_time']), report['dynamic_steps']))
+    PP.println()
+    PP.pl_bold("Steps:")
+    for step in report['steps']:
+        if step['skipped']:
+            status = "skipped"
+        else:
+            status = ftime(step['wall_time'])
+        PP.println("  [{}] {} ({}): {}".format(step['step'], step['name'], step['type'],
+                                               status))
+        if 'minions' in step:
+            minions = step['minions']
+            PP.println("      minions={} p50={} p95={} max={}"
+                       .format(minions['count'], ftime(minions['p50']),
+                               ftime(minions['p95']), ftime(minions['max'])))
+            PP.println("      slowest: {}".format(", ".join(
+                "{} ({})".format(m['minion'], ftime(m['time']))
+                for m in step['slowest_minions'])))
+    PP.println()
+    PP.pl_bold("Critical path ({}):".format(ftime(report['critical_path']['time'])))
+    for step in report['critical_path']['steps']:
+        PP.println("  [{}] {}".format(step['step'], step['name']))
+    PP.println()
+
+
+class StageProfiler(MonitorListener):
+    """
+    This class builds the timing report of a stage when it finishes, and prints it and/or
+    saves it as JSON
+    """
+    def __init__(self, print_output=True, report_file=None):
+        """
+        Args:
+            print_output (bool): print the report to the terminal
+            report_file (str): file path where to save the report as JSON
+        """
+        self.print_output = print_output
+        self.report_file = report_file
+        self.report = None
+
+    def stage_finished(self, stage):
+        try:
+            self.report = profile_stage(stage)
+        except Exception:  # pylint: disable=broad-except
+            logger.exception("failed to build the timing report of stage %s", stage.name)
+            return
+
+        if self.print_output:
+            print_report(self.report)
+        if self.report_file:
+            with open(self.report_file, 'w') as report_file:
+                json.dump(self.report, report_file, indent=2)
@@ -14,6 +14,7 @@ import threading
 import time
 
 from ..common import PrettyPrinter as PP, check_terminal_utf8_support
+from ..config import Config
 from ..monitor import MonitorListener
 from ..stage_parser import StateRenderingException
 
@@ -380,6 +381,8 @@ class StepListPrinter(MonitorListener):
             self.finished = False
             self.reprint = False
             self.substeps = OrderedDict()
+            # targets whose lines changed since the last print
+            self.dirty_targets = set()
             self.args = step.args_str
             if step.start_event:
                 self.start_ts = datetime.datetime.strptime(step.start_event.stamp,
@@ -429,6 +432,14 @@ class StepListPrinter(MonitorListener):
             """
             raise NotImplementedError()
 
+        def print_dirty_targets(self):
+            """
+            Re-prints the lines of the dirty targets in place
+            Returns:
+                bool: False if the whole step must be re-printed instead
+            """
+            return False
+
         @staticmethod
         def ftime(tr):
             if tr.seconds > 0:
@@ -494,6 +505,40 @@ class StepListPrinter(MonitorListener):
                 self.printer.print_step(substep, depth+1)
 
     class State(Step):
+        def __init__(self, printer, step):
+            super(SP.State, self).__init__(printer, step)
+            # number of lines printed for the targets in the last print
+            self.target_lines = 0
+            # target -> index of its first line among the target lines of the last print
+            self.target_starts = {}
+            # (offset, desc_width) of the last print
+            self.layout = None
+
+        def print_collapsed(self, offset, desc_width):
+            """
+            Prints the targets of the step as a single line of counters
+            """
+            total = self.step.total_targets
+            failed = self.step.failed_targets
+            running = total - self.step.finished_targets
+            desc = "{} minions".format(total)
+            counters = "running={} ok={} failed={}".format(running, total - running - failed,
+                                                           failed)
+            PP.print(" " * offset)
+            PP.print(SP.MINION(desc))
+            PP.print(SP.MINION("{} ".format("." * (desc_width - len(desc)))))
+            PP.print(SP.SUCCESS(counters) if not failed else SP.FAILURE(counters))
+            if running == 0:
+                stamp = max(data['event'].stamp for data in self.step.targets.values())
+                ts = datetime.datetime.strptime(stamp, "%Y-%m-%dT%H:%M:%S.%f")
+                PP.print(" ")
+                PP.print(SP.OK if failed == 0 else SP.FAIL)
+            else:
+                ts = datetime.datetime.utcnow()
+                PP.print(" ")
+                PP.print(SP.WAITING)
+            PP.println(" ({})".format(SP.Step.ftime(ts-self.start_ts)))
+
         def clean(self, desc_width):
             if self.args and len(self.step.name) + len(self.args) + 5 >= desc_width:
                 PP.print("\x1B[A\x1B[K" * len(SP.format_desc(self.args, desc_width)))
@@ -505,8 +550,7 @@ class StepListPrinter(MonitorListener):
                     if substep.reprint:
                         substep.clean(desc_width-5)
 
-                for target in self.step.targets.values():
-                    PP.print("\x1B[A\x1B[K" * (len(target['states'])+1))
+                PP.print("\x1B[A\x1B[K" * self.target_lines)
                 PP.print("\x1B[A\x1B[K")
 
         def print(self, offset, desc_width, depth):
@@ -553,34 +597,72 @@ class StepListPrinter(MonitorListener):
             for substep in self.substeps.values():
                 self.printer.print_step(substep, depth+1)
 
+            if self.printer.collapse_threshold and \
+                    len(self.step.targets) > self.printer.collapse_threshold:
+                self.print_collapsed(offset, desc_width)
+                self.target_lines = 1
+                return
+
+            self.target_lines = 0
+            self.target_starts = {}
             for target, data in self.step.targets.items():
-                PP.print(" " * offset)
-                PP.print(SP.MINION(target))
-                PP.print(SP.MINION("{} ".format("." * (desc_width - len(target)))))
-                if data['finished']:
-                    PP.print(SP.OK if data['success'] else SP.FAIL)
-                    ts = datetime.datetime.strptime(data['event'].stamp,
-                                                    "%Y-%m-%dT%H:%M:%S.%f")
-                    PP.println(" ({})".format(SP.Step.ftime(ts-self.start_ts)))
-                else:
-                    ts = datetime.datetime.utcnow()
-                    PP.print(SP.WAITING)
-                    PP.println(" ({})".format(SP.Step.ftime(ts-self.start_ts)))
+                self.target_starts[target] = self.target_lines
+                self.target_lines += len(data['states']) + 1
+                self.print_target(offset, desc_width, target, data)
+            self.layout = (offset, desc_width)
+
+        def print_dirty_targets(self):
+            if self.step.skipped or self.layout is None or \
+                    (self.printer.collapse_threshold and
+                     len(self.step.targets) > self.printer.collapse_threshold) or \
+                    not self.dirty_targets.issubset(self.target_starts):
+                return False
+            offset, desc_width = self.layout
+            # the cursor is on the line below the last target line
+            for target in sorted(self.dirty_targets, key=self.target_starts.get):
+                data = self.step.targets[target]
+                lines = len(data['states']) + 1
+                up = self.target_lines - self.target_starts[target]
+                PP.print("\r\x1B[{}A".format(up))
+                PP.print("\x1B[2K\x1B[B" * lines)
+                PP.print("\x1B[{}A".format(lines))
+                self.print_target(offset, desc_width, target, data)
+                if up > lines:
+                    PP.print("\x1B[{}B".format(up - lines))
+            self.dirty_targets.clear()
+            return True
+
+        def print_target(self, offset, desc_width, target, data):
+            """
+            Prints the line of a target followed by the lines of its states
+            """
+            PP.print(" " * offset)
+            PP.print(SP.MINION(target))
+            PP.print(SP.MINION("{} ".format("." * (desc_width - len(target)))))
+            if data['finished']:
+                PP.print(SP.OK if data['success'] else SP.FAIL)
+                ts = datetime.datetime.strptime(data['event'].stamp,
+                                                "%Y-%m-%dT%H:%M:%S.%f")
+                PP.println(" ({})".format(SP.Step.ftime(ts-self.start_ts)))
+            else:
+                ts = datetime.datetime.utcnow()
+                PP.print(SP.WAITING)
+                PP.println(" ({})".format(SP.Step.ftime(ts-self.start_ts)))
 
-                for state_res in data['states']:
-                    msg = state_res.step.pretty_string()
-                    PP.print(" " * offset)
-                    PP.print(SP.STATE_RES("  |_ {}".format(msg)))
-                    msg_rest = desc_width - (len(msg) + 3) - 2
-                    msg_rest = 0 if msg_rest < 0 else msg_rest
-                    PP.print(SP.STATE_RES("{} ".format("." * msg_rest)))
-                    if state_res.finished:
-                        if state_res.success:
-                            PP.println(u"{}".format(SP.OK))
-                        else:
-                            PP.println(u"{}".format(SP.FAIL))
+            for state_res in data['states']:
+                msg = state_res.step.pretty_string()
+                PP.print(" " * offset)
+                PP.print(SP.STATE_RES("  |_ {}".format(msg)))
+                msg_rest = desc_width - (len(msg) + 3) - 2
+                msg_rest = 0 if msg_rest < 0 else msg_rest
+                PP.print(SP.STATE_RES("{} ".format("." * msg_rest)))
+                if state_res.finished:
+                    if state_res.success:
+                        PP.println(u"{}".format(SP.OK))
                     else:
-                        PP.println(SP.WAITING)
+                        PP.println(u"{}".format(SP.FAIL))
+                else:
+                    PP.println(SP.WAITING)
 
     class PrinterThread(threading.Thread):
         def __init__(self, printer):
@@ -596,17 +678,36 @@ class StepListPrinter(MonitorListener):
         def run(self):
             self.running = True
             PP.print("\x1B[?25l")  # hides cursor
+            # the step is redrawn when it changed, or to refresh its time counters
+            refresh_interval = max(self.printer.frame_budget, 1.0)
             while self.running:
-                time.sleep(0.5)
+                time.sleep(min(self.printer.frame_budget, 0.1))
                 with self.printer.print_lock:
-                    if self.printer.step:
-                        self.printer.print_step(self.printer.step)
+                    if not self.printer.step:
+                        continue
+                    now = time.time()
+                    if now - self.printer.last_redraw < self.printer.frame_budget:
+                        continue
+                    if self.printer.dirty or \
+                            now - self.printer.last_full_redraw >= refresh_interval:
+                        self.printer.redraw()
+                    elif self.printer.step.dirty_targets:
+                        self.printer.redraw_targets()
 
             PP.print("\x1B[?25h")  # shows cursor
 
-    def __init__(self, clear_screen=True):
+    def __init__(self, clear_screen=True, frame_budget=None, collapse_threshold=None):
         super(StepListPrinter, self).__init__()
         self._clear_screen = clear_screen
+        self.frame_budget = Config.FRAME_BUDGET if frame_budget is None else frame_budget
+        self.collapse_threshold = Config.COLLAPSE_THRESHOLD if collapse_threshold is None \
+            else collapse_threshold
+        # True when the current step changed since the last redraw, beyond the lines of its
+        # dirty targets
+        self.dirty = False
+        # time of the last redraw, full or of the dirty targets only
+        self.last_redraw = 0
+        self.last_full_redraw = 0
         self.stage_name = None
         self.stage = None
         self.total_steps = None
@@ -617,6 +718,25 @@ class StepListPrinter(MonitorListener):
         self.init_output = None
         self.init_output_printed = False
 
+    def redraw(self):
+        """
+        Prints the current step, must be called while holding the print_lock
+        """
+        self.print_step(self.step)
+        self.step.dirty_targets.clear()
+        self.dirty = False
+        self.last_redraw = self.last_full_redraw = time.time()
+
+    def redraw_targets(self):
+        """
+        Prints the lines of the dirty targets of the current step, or the whole step if they
+        cannot be printed in place, must be called while holding the print_lock
+        """
+        if not self.step.print_dirty_targets():
+            self.redraw()
+            return
+        self.last_redraw = time.time()
+
     def stage_started(self, stage_name):
         if self._clear_screen:
             os.system('clear')
@@ -807,7 +927,7 @@ class StepListPrinter(MonitorListener):
                     PP.println()
                 elif step.order > 1:
                     PP.println()
-            self.print_step(self.step)
+            self.redraw()
 
     def step_runner_finished(self, step):
         if step.order > 0 and not step.success:
@@ -819,9 +939,10 @@ class StepListPrinter(MonitorListener):
                 # maybe it's a substep
                 if not self.step.finish_substep(step):
                     logger.error("substep jid=%s not found: event=\n%s", step.jid, step.end_event)
+                self.dirty = True
             elif self.step:
                 self.step.finished = True
-                self.print_step(self.step)
+                self.redraw()
                 self.step = None
 
     def step_runner_skipped(self, step):
@@ -845,7 +966,7 @@ class StepListPrinter(MonitorListener):
                     PP.println()
                 elif step.order > 1:
                     PP.println()
-            self.print_step(self.step)
+            self.redraw()
 
     def step_state_minion_finished(self, step, minion):
         if step.order > 0 and not step.targets[minion]['success']:
@@ -858,20 +979,25 @@ class StepListPrinter(MonitorListener):
                 # maybe it's a substep
                 if not self.step.finish_substep(step):
                     logger.error("substep jid=%s not found: event=\n%s", step.jid, step.end_event)
+                self.dirty = True
             elif self.step:
-                self.print_step(self.step)
+                self.step.dirty_targets.add(minion)
 
     def step_state_finished(self, step):
         with self.print_lock:
             if self.step and self.step.step.jid == step.jid:
                 self.step.finished = True
+                self.redraw()
                 self.step = None
 
     def step_state_result(self, step, event):
         with self.print_lock:
             assert self.step
             assert isinstance(self.step, StepListPrinter.State)
-            self.print_step(self.step)
+            if self.step.step.jid == step.jid:
+                self.step.dirty_targets.add(event.minion)
+            else:
+                self.dirty = True
 
     def step_state_skipped(self, step):
         # the step_state_started already handles skipped steps
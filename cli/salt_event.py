@@ -4,13 +4,14 @@ Salt Event Processor module
 """
 from __future__ import absolute_import
 
-import fnmatch
+import calendar
+import gzip
+import json
 import logging
 import threading
+import time
 
-import salt.config
-import salt.utils.event
-from tornado.ioloop import IOLoop
+from .stage_parser import SLSParser
 
 
 # pylint: disable=C0103
@@ -36,6 +37,27 @@ class SaltEvent(object):
             self.args = raw_event['data']['fun_args']
         else:
             self.args = None
+        self.orchestration_jid = SaltEvent._orchestration_jid(raw_event['data'], self.args)
+
+    ORCHESTRATION_JID_KEYS = ['__orchestration_jid__', 'orchestration_jid']
+
+    @classmethod
+    def _orchestration_jid(cls, data, args):
+        """
+        Searches for the jid of the orchestration that started this job. Salt passes it as
+        a keyword argument to the jobs started by the salt.state and salt.runner states.
+        Returns:
+            str: the orchestration jid or None if not found
+        """
+        for key in cls.ORCHESTRATION_JID_KEYS:
+            if data.get(key):
+                return data[key]
+        for arg in args or []:
+            if isinstance(arg, dict):
+                for key in cls.ORCHESTRATION_JID_KEYS:
+                    if arg.get(key):
+                        return arg[key]
+        return None
 
     def __str__(self):
         return "fun: {} args: {}".format(self.fun, self.args)
@@ -120,6 +142,16 @@ class EventListener(object):
     This class represents a listener object that listens to particular Salt events.
     """
 
+    def subscription(self):
+        """
+        Declares the events this listener is interested in. Events filtered out by the
+        subscription are dropped before any wrapper object is created.
+        Returns:
+            dict: map of event type (see SaltEventProcessor.EVENT_TYPES) -> list of function
+                  name substrings whose events are ignored, or None to receive all events
+        """
+        return None
+
     def handle_salt_event(self, event):
         """Handle generic salt event
         Args:
@@ -167,12 +199,36 @@ class SaltEventProcessor(threading.Thread):
     """
     This class implements an execution loop to listen for the Salt event BUS.
     """
-    def __init__(self):
+
+    # event type -> (wrapper class, listener handler)
+    EVENT_TYPES = {
+        'new_job': (NewJobEvent, 'handle_new_job_event'),
+        'ret_job': (RetJobEvent, 'handle_ret_job_event'),
+        'new_runner': (NewRunnerEvent, 'handle_new_runner_event'),
+        'ret_runner': (RetRunnerEvent, 'handle_ret_runner_event'),
+        'state_result': (StateResultEvent, 'handle_state_result_event'),
+    }
+
+    # (tag kind, tag action, has suffix) -> event type, for salt/<kind>/<jid>/<action>[/...] tags
+    _TAG_DISPATCH = {
+        ('job', 'new', False): 'new_job',
+        ('job', 'ret', True): 'ret_job',
+        ('run', 'new', False): 'new_runner',
+        ('run', 'ret', False): 'ret_runner',
+    }
+
+    def __init__(self, recorder=None):
         super(SaltEventProcessor, self).__init__()
         self.running = False
         self.listeners = []
         self.io_loop = None
         self.event = threading.Event()
+        self.recorder = recorder
+        self.processed_events = 0
+        self.dropped_events = 0
+        self._unpack = None
+        # event type -> list of (listener, ignored function name substrings)
+        self._subscribers = {}
 
     def add_listener(self, listener):
         """Adds an event listener to the listener list
@@ -180,6 +236,30 @@ class SaltEventProcessor(threading.Thread):
             listener (EventListener): the listener object
         """
         self.listeners.append(listener)
+        subscription = listener.subscription()
+        if subscription is None:
+            subscription = dict([(etype, []) for etype in self.EVENT_TYPES])
+        for etype, ignored_funs in subscription.items():
+            assert etype in self.EVENT_TYPES
+            self._subscribers.setdefault(etype, []).append((listener, list(ignored_funs)))
+
+    @classmethod
+    def event_type(cls, tag):
+        """
+        Computes the event type of an event tag
+        Args:
+            tag (str): the event tag
+        Returns:
+            str: the event type or None if it's not an event type handled by the processor
+        """
+        parts = tag.split('/', 4)
+        if len(parts) < 3 or parts[0] != 'salt':
+            return None
+        if parts[1] == 'state_result':
+            return 'state_result'
+        if len(parts) < 4:
+            return None
+        return cls._TAG_DISPATCH.get((parts[1], parts[3], len(parts) > 4))
 
     def is_running(self):
         """
@@ -196,7 +276,13 @@ class SaltEventProcessor(threading.Thread):
         """
         Starts the IOLoop of Salt Event Processor
         """
+        # Salt and Tornado are only imported when listening to the Salt event BUS
+        import salt.config
+        import salt.utils.event
+        from tornado.ioloop import IOLoop
+
         self.io_loop = IOLoop.current()
+        self._unpack = salt.utils.event.SaltEvent.unpack
         self.event.set()
 
         opts = salt.config.client_config('/etc/salt/master')
@@ -212,46 +298,204 @@ class SaltEventProcessor(threading.Thread):
         """
         self.running = False
         self.io_loop.stop()
+        logger.info("Salt events processed=%s dropped=%s", self.processed_events,
+                    self.dropped_events)
 
     def _handle_event_recv(self, raw):
         """
         Handles the asynchronous reception of raw events
         """
-        mtag, data = salt.utils.event.SaltEvent.unpack(raw)
+        mtag, data = self._unpack(raw)
+        if self.recorder:
+            self.recorder.record_event(mtag, data)
         self._process({'tag': mtag, 'data': data})
 
     def _process(self, event):
         """Processes a raw event
 
-        Creates the proper salt event class wrapper and notifies listeners
+        Creates the proper salt event class wrapper and notifies the listeners subscribed
+        to the event
 
         Args:
             event (dict): the raw event data
         """
+        etype = self.event_type(event['tag'])
+        subscribers = self._subscribers.get(etype) if etype else None
+        if not subscribers:
+            self.dropped_events += 1
+            return
+
+        fun = event['data'].get('fun')
+        if fun:
+            listeners = [listener for listener, ignored_funs in subscribers
+                         if not [ignored for ignored in ignored_funs if ignored in fun]]
+            if not listeners:
+                self.dropped_events += 1
+                return
+        else:
+            listeners = [listener for listener, _ in subscribers]
+
         logger.debug("Process event -> %s", event)
-        wrapper = None
-        if fnmatch.fnmatch(event['tag'], 'salt/job/*/new'):
-            wrapper = NewJobEvent(event)
-            for listener in self.listeners:
-                listener.handle_salt_event(wrapper)
-                listener.handle_new_job_event(wrapper)
-        elif fnmatch.fnmatch(event['tag'], 'salt/run/*/new'):
-            wrapper = NewRunnerEvent(event)
-            for listener in self.listeners:
-                listener.handle_salt_event(wrapper)
-                listener.handle_new_runner_event(wrapper)
-        elif fnmatch.fnmatch(event['tag'], 'salt/job/*/ret/*'):
-            wrapper = RetJobEvent(event)
-            for listener in self.listeners:
-                listener.handle_salt_event(wrapper)
-                listener.handle_ret_job_event(wrapper)
-        elif fnmatch.fnmatch(event['tag'], 'salt/run/*/ret'):
-            wrapper = RetRunnerEvent(event)
-            for listener in self.listeners:
-                listener.handle_salt_event(wrapper)
-                listener.handle_ret_runner_event(wrapper)
-        elif fnmatch.fnmatch(event['tag'], 'salt/state_result/*'):
-            wrapper = StateResultEvent(event)
-            for listener in self.listeners:
-                listener.handle_salt_event(wrapper)
-                listener.handle_state_result_event(wrapper)
+        self.processed_events += 1
+        wrapper_class, handler = self.EVENT_TYPES[etype]
+        wrapper = wrapper_class(event)
+        for listener in listeners:
+            listener.handle_salt_event(wrapper)
+            getattr(listener, handler)(wrapper)
+
+
+def _open_recording(path, mode):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't')
+    return open(path, mode)
+
+
+class EventRecorder(object):
+    """
+    Records the raw Salt event stream, and optionally the parsed stage steps, into an
+    append-only file with one compact JSON object per line. The file can be replayed with
+    EventReplayProcessor. Files ending in ".gz" are gzip compressed.
+    """
+    FORMAT_VERSION = 2
+
+    def __init__(self, path, include_steps=False):
+        """
+        Args:
+            path (str): the recording file path
+            include_steps (bool): whether to record the parsed stage steps
+        """
+        self.path = path
+        self.include_steps = include_steps
+        self._lock = threading.Lock()
+        self._file = _open_recording(path, 'a')
+        self._write({'format': 'deepsea-events', 'version': self.FORMAT_VERSION})
+
+    def _write(self, record):
+        line = json.dumps(record, separators=(',', ':'), default=str)
+        with self._lock:
+            if self._file:
+                self._file.write(line)
+                self._file.write("\n")
+
+    def record_event(self, tag, data):
+        """
+        Records a raw Salt event
+        Args:
+            tag (str): the event tag
+            data (dict): the event data
+        """
+        self._write({'t': tag, 's': data.get('_stamp'), 'd': data})
+
+    def record_stage(self, stage_name, steps, output):
+        """
+        Records the parsed steps of a stage
+        Args:
+            stage_name (str): the stage name
+            steps (list): the list of stage_parser.SaltStep objects
+            output (str): the stage parsing output
+        """
+        if not self.include_steps:
+            return
+        self._write({'stage': stage_name, 'steps': SLSParser.dump_steps(steps), 'out': output})
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+class EventReplayProcessor(SaltEventProcessor):
+    """
+    Event processor that replays a file recorded by EventRecorder instead of listening to
+    the Salt event BUS.
+    """
+    def __init__(self, path, speed=1.0):
+        """
+        Args:
+            path (str): the recording file path
+            speed (float): replay speed factor relative to the original event stamps,
+                           0 replays at maximum speed
+        """
+        super(EventReplayProcessor, self).__init__()
+        self.path = path
+        self.speed = speed
+
+    @staticmethod
+    def read_recording(path):
+        """
+        Generator that yields the records of a recording file
+        """
+        with _open_recording(path, 'r') as rfile:
+            for line in rfile:
+                line = line.strip()
+                if line:
+                    yield json.loads(line)
+
+    def recorded_stages(self):
+        """
+        Collects the stages started in the recording
+        Returns:
+            dict: map of stage name -> (parsed steps, parsing output). Stages whose steps were
+                  not recorded are mapped to an empty list of steps.
+        """
+        stages = {}
+        for record in self.read_recording(self.path):
+            if 'stage' in record:
+                if isinstance(record['steps'], list):
+                    steps = SLSParser.load_steps(record['steps'])
+                else:
+                    # version 1 recordings hold pickled steps, which are never loaded
+                    # because unpickling a crafted recording would run arbitrary code
+                    logger.warning("Ignoring the pickled steps of stage %s, recorded by an "
+                                   "older version", record['stage'])
+                    steps = []
+                stages[record['stage']] = (steps, record['out'])
+            elif 't' in record and self.event_type(record['t']) == 'new_runner' and \
+                    record['d'].get('fun') == 'runner.state.orch':
+                stage_name = record['d']['fun_args'][0]
+                if stage_name not in stages:
+                    stages[stage_name] = ([], "")
+        return stages
+
+    @staticmethod
+    def _stamp_ts(stamp):
+        try:
+            return calendar.timegm(time.strptime(stamp[:19], "%Y-%m-%dT%H:%M:%S")) + \
+                   float("0{}".format(stamp[19:]))
+        except (TypeError, ValueError):
+            return None
+
+    def _wait(self, delay):
+        end = time.time() + delay
+        while self.running:
+            rest = end - time.time()
+            if rest <= 0:
+                break
+            time.sleep(min(rest, 0.2))
+
+    def run(self):
+        """
+        Replays the recorded events
+        """
+        self.event.set()
+        logger.info("Replaying events from %s (speed=%s)", self.path, self.speed)
+        prev_ts = None
+        for record in self.read_recording(self.path):
+            if not self.running:
+                break
+            if 't' not in record:
+                continue
+            if self.speed > 0:
+                event_ts = self._stamp_ts(record['s'])
+                if event_ts is not None:
+                    if prev_ts is not None and event_ts > prev_ts:
+                        self._wait((event_ts - prev_ts) / self.speed)
+                    prev_ts = event_ts
+            self._process({'tag': record['t'], 'data': record['d']})
+        logger.info("Replay finished: processed=%s dropped=%s", self.processed_events,
+                    self.dropped_events)
+        self.running = False
+
+    def stop(self):
+        self.running = False
@@ -21,7 +21,10 @@ import sys
 
 from .common import clean_pyc_files
 from .monitor import Monitor
+from .monitors.json_outputter import JSONLinesPrinter, open_json_output
+from .monitors.profiler import StageProfiler
 from .monitors.terminal_outputter import SimplePrinter, StepListPrinter
+from .salt_event import EventRecorder
 from .stage_parser import RenderingException
 
 
@@ -63,7 +66,9 @@ class StageExecutor(threading.Thread):
         return self.proc is not None and self.retcode is None
 
 
-def run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output):
+def run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output,
+              record_file=None, record_steps=False, json_output=None, profile=False,
+              profile_file=None):
     """
     Runs a stage
     Args:
@@ -71,10 +76,39 @@ def run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output):
         hide_state_steps (bool): don't show state result steps
         hide_dynamic_steps (bool): don't show runtime generated steps
         simple_output (bool): use the minimal outputter
+        record_file (str): file path where to record the Salt events
+        record_steps (bool): also record the parsed stage steps
+        json_output (str): file path where to stream the JSON-lines output, "-" replaces the
+                           terminal output by the JSON-lines output
+        profile (bool): print the stage timing report when the stage finishes
+        profile_file (str): file path where to save the stage timing report as JSON
     """
-    mon = Monitor(not hide_state_steps, not hide_dynamic_steps)
-    printer = SimplePrinter() if simple_output else StepListPrinter(False)
-    mon.add_listener(printer)
+    recorder = EventRecorder(record_file, record_steps) if record_file else None
+    json_printer = JSONLinesPrinter(open_json_output(json_output)) if json_output else None
+    profiler = StageProfiler(profile, profile_file) if profile or profile_file else None
+    try:
+        return _run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output,
+                          recorder, json_printer, profiler)
+    finally:
+        if recorder:
+            recorder.close()
+        if json_printer:
+            json_printer.close()
+
+
+def _run_stage(stage_name, hide_state_steps, hide_dynamic_steps, simple_output, recorder,
+               json_printer, profiler):
+    mon = Monitor(not hide_state_steps, not hide_dynamic_steps, recorder=recorder)
+    if json_printer is None or json_printer.stream is not sys.stdout:
+        printer = SimplePrinter() if simple_output else StepListPrinter(False)
+        mon.add_listener(printer)
+    elif profiler:
+        # keep the standard output as a pure JSON-lines stream
+        profiler.print_output = False
+    if json_printer:
+        mon.add_listener(json_printer)
+    if profiler:
+        mon.add_listener(profiler)
     try:
         mon.parse_stage(stage_name)
     except RenderingException:
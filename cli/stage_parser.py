@@ -5,10 +5,19 @@ This module is responsible for the parsing of DeepSea stage files
 from __future__ import absolute_import
 from __future__ import print_function
 
+import atexit
+import hashlib
+import heapq
+import json
 import logging
 import os
+import pickle
 import pwd
+import re
+import shutil
+import tempfile
 import time
+import traceback
 import sys
 
 from collections import defaultdict
@@ -16,11 +25,10 @@ from io import BytesIO
 from io import StringIO
 from multiprocessing import Process, Queue
 
-import salt.client
-import salt.minion
-import salt.exceptions
+from six.moves import queue
 
 from .common import redirect_output
+from .config import Config
 
 
 # pylint: disable=C0103
@@ -81,10 +89,15 @@ class StageRenderingException(RenderingException):
 
 
 class SaltClient(object):
+    """
+    Salt clients are created, and Salt is imported, only when first needed
+    """
     _OPTS_ = None
     _CALLER_ = None
     _LOCAL_ = None
     _MASTER_ = None
+    _MASTER_OPTS_ = None
+    _DATA_CACHE_ = None
 
     @classmethod
     def _opts(cls):
@@ -92,6 +105,7 @@ class SaltClient(object):
         Initializes and retrieves the Salt opts structure
         """
         if cls._OPTS_ is None:
+            import salt.config
             cls._OPTS_ = salt.config.minion_config('/etc/salt/minion')
         return cls._OPTS_
 
@@ -101,6 +115,7 @@ class SaltClient(object):
         Initializes and retrieves the Salt caller client instance
         """
         if cls._CALLER_ is None:
+            import salt.client
             cls._CALLER_ = salt.client.Caller(mopts=cls._opts())
         return cls._CALLER_
 
@@ -110,17 +125,48 @@ class SaltClient(object):
         Initializes and retrieves the Salt local client instance
         """
         if cls._LOCAL_ is None:
+            import salt.client
             cls._LOCAL_ = salt.client.LocalClient()
         return cls._LOCAL_
 
+    @classmethod
+    def _master_opts(cls):
+        """
+        Initializes and retrieves the Salt master opts structure
+        """
+        if cls._MASTER_OPTS_ is None:
+            import salt.config
+            cls._MASTER_OPTS_ = salt.config.master_config('/etc/salt/master')
+            cls._MASTER_OPTS_['file_client'] = 'local'
+        return cls._MASTER_OPTS_
+
     @classmethod
     def master(cls):
         if cls._MASTER_ is None:
-            _opts = salt.config.master_config('/etc/salt/master')
-            _opts['file_client'] = 'local'
-            cls._MASTER_ = salt.minion.MasterMinion(_opts)
+            import salt.minion
+            cls._MASTER_ = salt.minion.MasterMinion(cls._master_opts())
         return cls._MASTER_
 
+    @classmethod
+    def reset_master(cls):
+        """
+        Drops the master opts, loader and data cache, they are initialized again
+        from the current master configuration when next needed
+        """
+        cls._MASTER_OPTS_ = None
+        cls._MASTER_ = None
+        cls._DATA_CACHE_ = None
+
+    @classmethod
+    def data_cache(cls):
+        """
+        Initializes and retrieves the master minion data cache
+        """
+        if cls._DATA_CACHE_ is None:
+            import salt.cache
+            cls._DATA_CACHE_ = salt.cache.factory(cls._master_opts())
+        return cls._DATA_CACHE_
+
 
 class SLSRenderer(object):
     """
@@ -204,43 +250,83 @@ class SLSRenderer(object):
         return res, out_str, err_str
 
     @classmethod
-    def _render_in_master(cls, state_name):
-        logger.info("Rendering state=%s on=master", state_name)
+    def render_in_minions(cls, states_to_render, workers):
+        """
+        Renders the states of several targets concurrently.
+        The rendering jobs are published asynchronously, with at most `workers` jobs in
+        flight, and their returns are collected afterwards.
+        Args:
+            states_to_render (dict): map of target -> list of state names
+            workers (int): maximum number of rendering jobs in flight
+        Returns:
+            dict: map of target -> rendering result
+        """
+        local = SaltClient.local()
+        was_listening = local.event.cpub
+        results = {}
+        pending = list(states_to_render.items())
+        in_flight = []
+        try:
+            while pending or in_flight:
+                while pending and len(in_flight) < workers:
+                    target, states = pending.pop(0)
+                    in_flight.append((target, states, cls._publish_render(states, target)))
+                target, states, pub_data = in_flight.pop(0)
+                results[target] = cls._collect_render(states, target, pub_data)
+        finally:
+            if not was_listening:
+                local.event.close_pub()
+        return results
 
-        def subproc_fun(queue):
-            """
-            Subprocess wrapper function. This function will be executed by a child process,
-            and run the stage parsing as the "salt" user.
-            """
-            # changing process user to "salt" so that any runner side-effects during SLS rendering
-            # are done with salt user as owner
-            try:
-                pw = pwd.getpwnam("salt")
-            except KeyError:
-                # salt user not found, fallback to root
-                pw = pwd.getpwnam("root")
-            os.setgid(pw.pw_gid)
-            os.setuid(pw.pw_uid)
+    @classmethod
+    def _publish_render(cls, state_name, target):
+        logger.info("Rendering (async) states=%s on=%s", state_name, target)
+        out = StringIO()
+        err = StringIO()
+        with redirect_output(out, err):
+            pub_data = SaltClient.local().run_job(target, 'deepsea.show_low_sls',
+                                                  state_name, tgt_type="compound",
+                                                  listen=True)
+        logger.debug("OUT:\n%s", out.getvalue())
+        logger.debug("ERR:\n%s", err.getvalue())
+        return pub_data
 
-            err = StringIO()
-            out = StringIO()
-            with redirect_output(out, err):
-                res = SaltClient.master().functions['state.show_low_sls'](
-                    state_name)
+    @classmethod
+    def _collect_render(cls, state_name, target, pub_data):
+        if not pub_data or not pub_data['minions']:
+            # let the synchronous path report the error
+            return cls._render_in_minion(state_name, target)[0]
+
+        local = SaltClient.local()
+        res = {}
+        out = StringIO()
+        err = StringIO()
+        with redirect_output(out, err):
+            for fn_ret in local.get_cli_event_returns(pub_data['jid'], pub_data['minions'],
+                                                      local.opts['timeout'], target,
+                                                      "compound"):
+                if fn_ret:
+                    for minion, data in fn_ret.items():
+                        res[minion] = data.get('ret', {})
+        logger.debug("Rendering result: %s", res)
 
-            queue.put(res)
-            queue.put(out.getvalue())
-            queue.put(err.getvalue())
-            out.close()
-            err.close()
+        for minion in pub_data['minions']:
+            states = res.get(minion)
+            if not isinstance(states, dict):
+                # missing return or deepsea module not available, the synchronous path
+                # takes care of syncing modules and reporting errors
+                logger.info("async rendering on %s returned: %s", minion, states)
+                return cls._render_in_minion(state_name, target)[0]
+            for state, steps in states.items():
+                if steps and isinstance(steps[0], str):
+                    raise StateRenderingException(minion, state, steps)
+        return res
 
-        queue = Queue()
-        p = Process(target=subproc_fun, args=[queue])
-        p.start()
-        p.join()
-        res = queue.get()
-        out = queue.get()
-        err = queue.get()
+    @classmethod
+    def _render_in_master(cls, state_name):
+        logger.info("Rendering state=%s on=master", state_name)
+
+        res, out, err = MasterRenderWorker.instance().render(state_name)
 
         logger.debug("Rendering result: %s", res)
         if res and isinstance(res[0], str):  # exception case
@@ -255,6 +341,369 @@ class SLSRenderer(object):
         return res, out, err
 
 
+class MasterRenderWorker(object):
+    """
+    Child process that renders SLS files in the master as the "salt" user.
+
+    The Salt loader (salt.minion.MasterMinion) is initialized once, when the worker
+    starts, and is reused by every render request sent through the worker queues.
+    The worker is stopped at the end of each stage parse, so that long-lived monitor
+    sessions pick up the changes of the master configuration, modules and pillar.
+    """
+    _INSTANCE_ = None
+
+    def __init__(self):
+        self._requests = Queue()
+        self._responses = Queue()
+        self._proc = Process(target=MasterRenderWorker._run,
+                             args=[self._requests, self._responses])
+        self._proc.daemon = True
+
+    @classmethod
+    def instance(cls):
+        """
+        Retrieves the running worker, starting a new one if needed
+        """
+        if cls._INSTANCE_ is None or not cls._INSTANCE_.is_alive():
+            if cls._INSTANCE_ is None:
+                atexit.register(cls.shutdown)
+            cls._INSTANCE_ = MasterRenderWorker()
+            cls._INSTANCE_.start()
+        return cls._INSTANCE_
+
+    @classmethod
+    def shutdown(cls):
+        """
+        Stops the running worker, if any
+        """
+        if cls._INSTANCE_ is not None:
+            cls._INSTANCE_.stop()
+            cls._INSTANCE_ = None
+
+    def start(self):
+        logger.info("Starting master render worker")
+        self._proc.start()
+
+    def stop(self):
+        if self._proc.is_alive():
+            logger.info("Stopping master render worker")
+            self._requests.put(None)
+            self._proc.join(5)
+            if self._proc.is_alive():
+                self._proc.terminate()
+
+    def is_alive(self):
+        return self._proc.is_alive()
+
+    def render(self, state_name):
+        """
+        Renders a state in the worker process
+        Returns:
+            (result, stdout, stderr) tuple
+        """
+        self._requests.put(state_name)
+        while True:
+            try:
+                return self._responses.get(timeout=1)
+            except queue.Empty:
+                if not self._proc.is_alive():
+                    raise StageRenderingException(
+                        state_name, ["master render worker exited unexpectedly (exitcode={})"
+                                     .format(self._proc.exitcode)])
+
+    @staticmethod
+    def _run(requests, responses):
+        """
+        Worker process main loop. This function will be executed by a child process,
+        and run the stage parsing as the "salt" user.
+        """
+        # changing process user to "salt" so that any runner side-effects during SLS rendering
+        # are done with salt user as owner
+        try:
+            pw = pwd.getpwnam("salt")
+        except KeyError:
+            # salt user not found, fallback to root
+            pw = pwd.getpwnam("root")
+        os.setgid(pw.pw_gid)
+        os.setuid(pw.pw_uid)
+
+        # the master opts and loader of the parent process may be stale
+        SaltClient.reset_master()
+        master = None
+        while True:
+            state_name = requests.get()
+            if state_name is None:
+                break
+
+            err = StringIO()
+            out = StringIO()
+            with redirect_output(out, err):
+                try:
+                    if master is None:
+                        master = SaltClient.master()
+                    res = master.functions['state.show_low_sls'](state_name)
+                # pylint: disable=broad-except
+                except Exception:
+                    res = [traceback.format_exc()]
+
+            responses.put((res, out.getvalue(), err.getvalue()))
+            out.close()
+            err.close()
+
+
+class StageCache(object):
+    """
+    Persistent on-disk cache of parsed stages
+
+    Each cache entry is stored in its own file inside Config.CACHE_DIR and
+    holds the parsed steps of a stage together with the fingerprints that were
+    valid at the time of parsing:
+      - the content hash of every SLS file (or state directory) involved in the
+        rendering of the stage, and of the files they pull in with Jinja imports
+        and includes
+      - the fingerprint of the master configuration, the set of accepted minions
+        and the grains and pillar cached for them by the master
+    An entry is only used if all the fingerprints are still valid.
+    """
+
+    VERSION = 2
+
+    # master configuration files, fingerprinted by their stats
+    CONFIG_PATHS = [
+        '/etc/salt/master',
+        '/etc/salt/master.d',
+    ]
+
+    MINIONS_PKI_DIR = '/etc/salt/pki/master/minions'
+
+    # Jinja statements that render other files of the state tree
+    JINJA_IMPORT_RE = re.compile(r'{%-?\s*(?:import|from|include)\s+["\']([^"\']+)["\']')
+
+    SALT_BASE_DIR = '/srv/salt'
+
+    @classmethod
+    def _entry_path(cls, stage_name, hide_state_steps, only_visible_steps):
+        return os.path.join(Config.CACHE_DIR, "{}.{}{}.cache".format(
+            stage_name, int(hide_state_steps), int(only_visible_steps)))
+
+    @staticmethod
+    def _hash_file(path, hasher):
+        with open(path, 'rb') as fd:
+            for chunk in iter(lambda: fd.read(65536), b''):
+                hasher.update(chunk)
+
+    @classmethod
+    def _sls_path(cls, sls):
+        """
+        Returns the file or directory path of an SLS name
+        """
+        path = os.path.join(cls.SALT_BASE_DIR, sls.replace('.', '/'))
+        if os.path.isdir(path):
+            return path
+        if os.path.isfile("{}.sls".format(path)):
+            return "{}.sls".format(path)
+        return None
+
+    @classmethod
+    def content_hash(cls, path):
+        """
+        Computes the content hash of a file, or of all files inside a directory
+        """
+        hasher = hashlib.sha1()
+        if os.path.isfile(path):
+            cls._hash_file(path, hasher)
+            return hasher.hexdigest()
+        if not os.path.isdir(path):
+            return None
+        for root, dirs, files in os.walk(path):
+            dirs.sort()
+            for fname in sorted(files):
+                fpath = os.path.join(root, fname)
+                hasher.update(os.path.relpath(fpath, path).encode('utf-8'))
+                cls._hash_file(fpath, hasher)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _env_files(env_path):
+        """
+        Lists the file env_path, or the files inside the directory env_path
+        """
+        if os.path.isfile(env_path):
+            yield env_path
+            return
+        for root, dirs, files in os.walk(env_path):
+            dirs.sort()
+            for fname in sorted(files):
+                yield os.path.join(root, fname)
+
+    @staticmethod
+    def _minion_data(minion):
+        """
+        Returns the grains and pillar of a minion as cached by the master, serialized
+        in a stable way
+        """
+        try:
+            data = SaltClient.data_cache().fetch('minions/{}'.format(minion), 'data')
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.warning("stage cache: failed to fetch the data of minion %s: %s", minion, ex)
+            return ''
+        if not isinstance(data, dict):
+            return ''
+        return json.dumps({'grains': data.get('grains'), 'pillar': data.get('pillar')},
+                          sort_keys=True, default=str)
+
+    @classmethod
+    def env_fingerprint(cls):
+        """
+        Computes the fingerprint of the master configuration, the accepted minions and
+        their cached grains and pillar.
+        The master rewrites its minion data cache on every pillar compilation, therefore
+        the cached data is fingerprinted by its content instead of its file stats.
+        """
+        hasher = hashlib.sha1()
+        for config_path in cls.CONFIG_PATHS:
+            for fpath in cls._env_files(config_path):
+                try:
+                    stat = os.stat(fpath)
+                except OSError:
+                    continue
+                hasher.update("{}:{}:{}".format(fpath, stat.st_size, stat.st_mtime)
+                              .encode('utf-8'))
+        try:
+            minions = sorted(os.listdir(cls.MINIONS_PKI_DIR))
+        except OSError:
+            minions = []
+        for minion in minions:
+            hasher.update("{}:{}".format(minion, cls._minion_data(minion)).encode('utf-8'))
+        return hasher.hexdigest()
+
+    @classmethod
+    def _involved_sls(cls, stage_name, steps):
+        """
+        Collects the names of the SLS files involved in the rendering of a stage
+        """
+        sls_set = set([stage_name])
+        for step in steps:
+            if '__sls__' in step.step_dict:
+                sls_set.add(step.step_dict['__sls__'])
+            if isinstance(step, SaltState):
+                sls_set.update(step.sls)
+                for s_steps in step.steps.values():
+                    sls_set.update(cls._involved_sls(stage_name, s_steps))
+        return sls_set
+
+    @classmethod
+    def _imported_files(cls, path):
+        """
+        Lists the files of the state tree pulled in by Jinja imports and includes of the
+        file path, or of the files inside the directory path
+        """
+        imported = set()
+        for fpath in cls._env_files(path):
+            try:
+                with open(fpath, 'r') as fd:
+                    content = fd.read()
+            except (IOError, OSError, UnicodeDecodeError):
+                continue
+            for name in cls.JINJA_IMPORT_RE.findall(content):
+                if name.startswith('salt://'):
+                    name = name[len('salt://'):]
+                if name.startswith('.'):
+                    ipath = os.path.normpath(os.path.join(os.path.dirname(fpath), name))
+                else:
+                    ipath = os.path.join(cls.SALT_BASE_DIR, name)
+                if os.path.isfile(ipath):
+                    imported.add(ipath)
+        return imported
+
+    @classmethod
+    def _files_fingerprint(cls, stage_name, steps):
+        files = {}
+        pending = [cls._sls_path(sls) for sls in cls._involved_sls(stage_name, steps)]
+        while pending:
+            path = pending.pop()
+            if not path or path in files:
+                continue
+            files[path] = cls.content_hash(path)
+            pending.extend(cls._imported_files(path))
+        return files
+
+    @classmethod
+    def load(cls, stage_name, hide_state_steps, only_visible_steps):
+        """
+        Loads a parsed stage from the cache
+        Returns:
+            (steps, out) tuple or None if there is no valid cache entry
+        """
+        path = cls._entry_path(stage_name, hide_state_steps, only_visible_steps)
+        if not os.path.exists(path):
+            logger.info("stage cache miss: stage=%s (no entry)", stage_name)
+            return None
+        try:
+            with open(path, 'rb') as fd:
+                entry = pickle.load(fd)
+        except Exception as ex:  # pylint: disable=broad-except
+            logger.warning("stage cache: failed to load entry %s: %s", path, ex)
+            return None
+
+        if entry.get('version') != cls.VERSION:
+            logger.info("stage cache miss: stage=%s (version mismatch)", stage_name)
+            return None
+        if entry['env'] != cls.env_fingerprint():
+            logger.info("stage cache miss: stage=%s (config/minions/grains/pillar changed)",
+                        stage_name)
+            return None
+        for fpath, fhash in entry['files'].items():
+            if cls.content_hash(fpath) != fhash:
+                logger.info("stage cache miss: stage=%s (%s changed)", stage_name, fpath)
+                return None
+
+        logger.info("stage cache hit: stage=%s", stage_name)
+        return entry['steps'], entry['out']
+
+    @classmethod
+    def store(cls, stage_name, hide_state_steps, only_visible_steps, steps, out):
+        """
+        Stores a parsed stage in the cache
+        """
+        entry = {
+            'version': cls.VERSION,
+            'env': cls.env_fingerprint(),
+            'files': cls._files_fingerprint(stage_name, steps),
+            'steps': steps,
+            'out': out,
+        }
+        path = cls._entry_path(stage_name, hide_state_steps, only_visible_steps)
+        try:
+            if not os.path.exists(Config.CACHE_DIR):
+                os.makedirs(Config.CACHE_DIR, 0o700)
+            fd, tmp_path = tempfile.mkstemp(dir=Config.CACHE_DIR)
+            with os.fdopen(fd, 'wb') as tmp_file:
+                pickle.dump(entry, tmp_file, pickle.HIGHEST_PROTOCOL)
+            os.rename(tmp_path, path)
+        except (OSError, IOError, pickle.PicklingError) as ex:
+            logger.warning("stage cache: failed to store entry %s: %s", path, ex)
+            return
+        logger.info("stage cache store: stage=%s files=%s", stage_name, len(entry['files']))
+
+    @classmethod
+    def clear(cls, stage_name=None):
+        """
+        Removes the cache entries of a stage, or all entries if stage_name is None
+        """
+        if not os.path.exists(Config.CACHE_DIR):
+            return
+        if stage_name is None:
+            logger.info("stage cache: clearing all entries")
+            shutil.rmtree(Config.CACHE_DIR)
+            return
+        logger.info("stage cache: clearing entries of stage=%s", stage_name)
+        for fname in os.listdir(Config.CACHE_DIR):
+            if fname.startswith("{}.".format(stage_name)) and fname.endswith(".cache") and \
+                    fname.count('.') == stage_name.count('.') + 2:
+                os.remove(os.path.join(Config.CACHE_DIR, fname))
+
+
 class SLSParser(object):
     """
     SLS files parser
@@ -286,9 +735,33 @@ class SLSParser(object):
         for l in listeners:
             l.stage_parsing_state(states, minion)
 
+    @classmethod
+    def clean_cache(cls, stage_name):
+        """
+        Invalidates the parsed stages cache
+        Args:
+            stage_name (str): the stage name, or None to invalidate all stages
+        """
+        StageCache.clear(stage_name)
+
     @classmethod
     def parse_stage(cls, stage_name, hide_state_steps, only_visible_steps,
                     monitor_listeners=None):
+        cached = StageCache.load(stage_name, hide_state_steps, only_visible_steps)
+        if cached is not None:
+            return cached
+
+        try:
+            steps, out = cls._parse_stage(stage_name, hide_state_steps, only_visible_steps,
+                                          monitor_listeners)
+        finally:
+            MasterRenderWorker.shutdown()
+        StageCache.store(stage_name, hide_state_steps, only_visible_steps, steps, out)
+        return steps, out
+
+    @classmethod
+    def _parse_stage(cls, stage_name, hide_state_steps, only_visible_steps,
+                     monitor_listeners=None):
         if monitor_listeners is None:
             monitor_listeners = []
 
@@ -317,9 +790,19 @@ class SLSParser(object):
         t0 = time.time()
         states_rendering = defaultdict(lambda: defaultdict(
             lambda: defaultdict(dict)))
+        if Config.RENDER_WORKERS > 1 and len(states_to_render) > 1:
+            for target, states in states_to_render.items():
+                SLSParser.notify_listener(monitor_listeners, states, target)
+            rendered = SLSRenderer.render_in_minions(
+                dict([(target, list(states)) for target, states in states_to_render.items()]),
+                Config.RENDER_WORKERS)
+        else:
+            rendered = {}
+            for target, states in states_to_render.items():
+                SLSParser.notify_listener(monitor_listeners, states, target)
+                rendered[target], _, _ = SLSRenderer.render(list(states), target)
         for target, states in states_to_render.items():
-            SLSParser.notify_listener(monitor_listeners, states, target)
-            res, _, _ = SLSRenderer.render(list(states), target)
+            res = rendered[target]
             for minion, state_res in res.items():
                 if isinstance(state_res, list):
                     assert len(states) == 1
@@ -347,23 +830,100 @@ class SLSParser(object):
         return steps, out
 
     @classmethod
-    def _search_step(cls, steps, state, sid):
+    def dump_steps(cls, steps):
         """
-        Searches a step that matches the module name and state id
+        Converts a list of parsed steps into plain JSON serializable dicts
         Args:
             steps (list): list of steps
-            mod_name (str): salt module name, can be None
-            sid (str): state id
+        Returns:
+            list: the list of dicts, requisites are stored as positions in the list
         """
+        position = dict([(id(step), idx) for idx, step in enumerate(steps)])
+        data = []
         for step in steps:
-            if state is None or step.state == state:
-                if step.get_arg('name') == sid or step.desc == sid:
-                    return step
+            step_data = {
+                'class': type(step).__name__,
+                'step': step.step_dict,
+                'on_success_deps': [position[id(dep)] for dep in step.on_success_deps],
+                'on_fail_deps': [position[id(dep)] for dep in step.on_fail_deps],
+            }
+            if isinstance(step, SaltTargettedStep):
+                step_data['target'] = step.target
+            if isinstance(step, SaltState):
+                step_data['target_expanded'] = step.target_expanded
+                step_data['steps'] = dict([(minion, cls.dump_steps(s_steps))
+                                           for minion, s_steps in step.steps.items()])
+            data.append(step_data)
+        return data
 
-        return None
+    @classmethod
+    def load_steps(cls, data):
+        """
+        Builds the list of parsed steps from the dicts returned by dump_steps
+        Args:
+            data (list): the list of dicts
+        Returns:
+            list: list of steps
+        """
+        classes = dict([(step_class.__name__, step_class) for step_class in
+                        [SaltState, SaltRunner, SaltStateFunction, SaltExecutionFunction]])
+        steps = []
+        for step_data in data:
+            step_class = classes[step_data['class']]
+            if issubclass(step_class, SaltTargettedStep):
+                step = step_class(step_data['step'], step_data['target'])
+            else:
+                step = step_class(step_data['step'])
+            if isinstance(step, SaltState):
+                step.target_expanded = step_data['target_expanded']
+                for minion, s_steps in step_data['steps'].items():
+                    step.steps[minion] = cls.load_steps(s_steps)
+            steps.append(step)
+        for step, step_data in zip(steps, data):
+            step.on_success_deps = [steps[idx] for idx in step_data['on_success_deps']]
+            step.on_fail_deps = [steps[idx] for idx in step_data['on_fail_deps']]
+        return steps
+
+    @classmethod
+    def _index_steps(cls, steps):
+        """
+        Builds the lookup index used to resolve requisites
+        Args:
+            steps (list): list of steps
+        Returns:
+            dict: map of (state, name/desc) -> step, and (None, name/desc) -> step for
+                  requisites that do not specify the state module. As in a sequential
+                  search, the first step in the list wins.
+        """
+        index = {}
+        for step in steps:
+            for key in (step.get_arg('name'), step.desc):
+                try:
+                    index.setdefault((step.state, key), step)
+                    index.setdefault((None, key), step)
+                except TypeError:
+                    # unhashable name argument, cannot be referenced by a requisite
+                    pass
+        return index
+
+    @classmethod
+    def _search_step(cls, index, state, sid):
+        """
+        Searches a step that matches the module name and state id
+        Args:
+            index (dict): the steps index built by _index_steps
+            state (str): salt module name, can be None
+            sid (str): state id
+        """
+        try:
+            return index.get((state, sid))
+        except TypeError:
+            return None
 
     @classmethod
     def _process_states_requisites(cls, stage_name, steps):
+        index = cls._index_steps(steps)
+
         def process_requisite_directive(step, directive):
             """
             Processes a requisite directive
@@ -381,7 +941,7 @@ class SLSParser(object):
 
             for mod, sid in reqs_t:
                 logger.debug("searching for state=%s desc/name=%s", mod, sid)
-                req_step = cls._search_step(steps, mod, sid)
+                req_step = cls._search_step(index, mod, sid)
                 logger.debug("found state dependency from: %s to: %s", step,
                              req_step)
                 assert req_step
@@ -402,27 +962,37 @@ class SLSParser(object):
 
     @classmethod
     def _reorder(cls, stage_name, steps):
-        def all_deps_available(p_nsteps, p_deps):
-            for p_dep in p_deps:
-                if p_dep not in p_nsteps:
-                    return False
-            return True
-
+        """
+        Sorts the steps so that every step comes after its dependencies.
+        Among the steps whose dependencies are satisfied, the one that comes first in the
+        original list is always picked first, so the original order is kept whenever possible.
+        """
+        position = dict([(id(step), idx) for idx, step in enumerate(steps)])
+        pending_deps = [0] * len(steps)
+        dependents = defaultdict(list)
+        for idx, step in enumerate(steps):
+            deps = set([id(dep) for dep in step.on_success_deps])
+            deps.update([id(dep) for dep in step.on_fail_deps])
+            for dep in deps:
+                # a dependency that is not part of this list of steps can never be satisfied
+                pending_deps[idx] += 1
+                if dep in position:
+                    dependents[position[dep]].append(idx)
+
+        ready = [idx for idx, count in enumerate(pending_deps) if count == 0]
+        heapq.heapify(ready)
         nsteps = []
-        prev_len = len(steps)
-        while steps:
-            for idx, step in enumerate(steps):
-                deps = list(step.on_success_deps)
-                deps.extend(step.on_fail_deps)
-                if all_deps_available(nsteps, deps):
-                    nsteps.append(step)
-                    steps.pop(idx)
-                    break
-
-            if len(steps) == prev_len:
-                raise StageRenderingException(stage_name,
-                                              ["Recursive requisite found"])
-            prev_len = len(steps)
+        while ready:
+            idx = heapq.heappop(ready)
+            nsteps.append(steps[idx])
+            for dependent in dependents[idx]:
+                pending_deps[dependent] -= 1
+                if pending_deps[dependent] == 0:
+                    heapq.heappush(ready, dependent)
+
+        if len(nsteps) != len(steps):
+            raise StageRenderingException(stage_name,
+                                          ["Recursive requisite found"])
 
         return nsteps
 
@@ -6,7 +6,7 @@ import shutil
 import unittest
 import yaml
 
-from ..stage_parser import SaltClient
+from ..stage_parser import SaltClient, SLSParser
 
 
 class SaltTestCase(unittest.TestCase):
@@ -27,6 +27,9 @@ class SaltTestCase(unittest.TestCase):
     def setUpClass(cls):
         cls.minions()  # initializes minion id
 
+        # start from an empty parsed stages cache
+        SLSParser.clean_cache(None)
+
         # add test runner
         if not os.path.exists("/srv/modules/runners"):
             os.makedirs("/srv/modules/runners")
@@ -79,7 +82,8 @@ def test(**kwargs):
                 sf.write(content)
                 sf.write("\n")
 
-        cls.STATE_FILES_INDEX.append(state_file)
+        if state_file not in cls.STATE_FILES_INDEX:
+            cls.STATE_FILES_INDEX.append(state_file)
 
     def tearDown(self):
         if self.CLEAN_STATE_FILES:
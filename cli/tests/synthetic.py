@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic DeepSea orchestrations and their Salt event streams.
+These do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+from collections import deque
+import datetime
+
+from ..salt_event import SaltEventProcessor
+from ..stage_parser import SaltState, SaltStateFunction
+
+
+class StubEventProcessor(SaltEventProcessor):
+    """
+    Event processor that feeds a list of raw events instead of listening to the Salt
+    event BUS
+    """
+    def __init__(self, events):
+        super(StubEventProcessor, self).__init__()
+        self.events = deque(events)
+
+    def run(self):
+        self.event.set()
+        while self.running and self.events:
+            # drop the reference to each event once processed, like the Salt event BUS
+            self._process(self.events.popleft())
+        self.running = False
+
+    def stop(self):
+        self.running = False
+
+
+def _stamp(base, offset_ms):
+    return (base + datetime.timedelta(milliseconds=offset_ms)).strftime("%Y-%m-%dT%H:%M:%S.%f")
+
+
+def synthetic_minions(num_targets):
+    return ["minion{}".format(idx) for idx in range(1, num_targets + 1)]
+
+
+def synthetic_steps(num_targets, num_steps, num_states, sls_prefix="synthetic"):
+    """
+    Generates the parsed steps of an orchestration with num_steps state steps, each one
+    targeting all minions and running num_states visible states in each minion
+    """
+    minions = synthetic_minions(num_targets)
+    steps = []
+    for step_idx in range(num_steps):
+        step = SaltState({
+            '__id__': 'state step {}'.format(step_idx),
+            'state': 'salt',
+            'fun': 'state',
+            'sls': '{}.state{}'.format(sls_prefix, step_idx),
+            'tgt': '*',
+        })
+        step.target_expanded = list(minions)
+        for minion in minions:
+            for state_idx in range(num_states):
+                step.steps[minion].append(SaltStateFunction({
+                    '__id__': 'state {}'.format(state_idx),
+                    'state': 'cmd',
+                    'fun': 'run',
+                    'name': 'cmd{}'.format(state_idx),
+                    'fire_event': True,
+                }, minion))
+        steps.append(step)
+    return steps
+
+
+def synthetic_events(stage_name, num_targets, num_steps, num_states, failed_minions=None,
+                     sls_prefix="synthetic", jid_base=0, lineage=False):
+    """
+    Generates the raw Salt events of the execution of the orchestration generated by
+    synthetic_steps
+    Args:
+        failed_minions (list): minions whose states fail
+        jid_base (int): distinguishes the jids of different orchestrations
+        lineage (bool): add the orchestration jid to the arguments of the jobs
+    Returns:
+        list: the list of raw events ({'tag': ..., 'data': ...} dicts)
+    """
+    if failed_minions is None:
+        failed_minions = []
+    minions = synthetic_minions(num_targets)
+    base = datetime.datetime(2018, 1, 1)
+    clock = [0]
+
+    def stamp():
+        clock[0] += 1
+        return _stamp(base, clock[0])
+
+    events = []
+    orch_jid = "2018010100{:03d}0000000".format(jid_base)
+    events.append({'tag': 'salt/run/{}/new'.format(orch_jid), 'data': {
+        'jid': orch_jid, '_stamp': stamp(), 'fun': 'runner.state.orch',
+        'fun_args': [stage_name]}})
+
+    for step_idx in range(num_steps):
+        jid = "2018010100{:03d}{:07d}".format(jid_base, step_idx + 1)
+        sls = '{}.state{}'.format(sls_prefix, step_idx)
+        args = [sls]
+        if lineage:
+            args.append({'__kwarg__': True, 'orchestration_jid': orch_jid})
+        events.append({'tag': 'salt/job/{}/new'.format(jid), 'data': {
+            'jid': jid, '_stamp': stamp(), 'fun': 'state.sls', 'arg': args,
+            'minions': list(minions)}})
+        for state_idx in range(num_states):
+            for minion in minions:
+                events.append({'tag': 'salt/state_result/{}/{}/cmd{}'.format(jid, minion,
+                                                                             state_idx),
+                               'data': {
+                                   'jid': jid, '_stamp': stamp(), 'id': minion,
+                                   'data': {'ret': {
+                                       '__id__': 'state {}'.format(state_idx),
+                                       'name': 'cmd{}'.format(state_idx),
+                                       'result': minion not in failed_minions}}}})
+        for minion in minions:
+            success = minion not in failed_minions
+            ret = {}
+            for state_idx in range(num_states):
+                ret['cmd_|-state {}_|-cmd{}_|-run'.format(state_idx, state_idx)] = {
+                    '__id__': 'state {}'.format(state_idx),
+                    'result': success,
+                    'comment': 'Command "cmd{}" run'.format(state_idx),
+                    'changes': {'stdout': 'output of cmd{}'.format(state_idx)},
+                }
+            events.append({'tag': 'salt/job/{}/ret/{}'.format(jid, minion), 'data': {
+                'jid': jid, '_stamp': stamp(), 'fun': 'state.sls', 'fun_args': [sls],
+                'id': minion, 'success': True, 'retcode': 0 if success else 2,
+                'return': ret}})
+
+    events.append({'tag': 'salt/run/{}/ret'.format(orch_jid), 'data': {
+        'jid': orch_jid, '_stamp': stamp(), 'fun': 'runner.state.orch',
+        'fun_args': [stage_name], 'success': not failed_minions,
+        'return': {'data': {}}}})
+    return events
@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+"""
+Concurrent orchestrations monitoring tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+from ..monitor import Monitor
+from .synthetic import StubEventProcessor, synthetic_steps, synthetic_events
+from .test_monitor import MonTestListener
+
+
+def _interleave(*event_lists):
+    events = []
+    for idx in range(max(len(e) for e in event_lists)):
+        for event_list in event_lists:
+            if idx < len(event_list):
+                events.append(event_list[idx])
+    return events
+
+
+class TestConcurrentStages(unittest.TestCase):
+
+    def _run(self, events, stages):
+        processor = StubEventProcessor(events)
+        monitor = Monitor(True, True, processor)
+        for stage_name, steps in stages.items():
+            monitor.set_stage_steps(stage_name, steps, "")
+        listener = MonTestListener()
+        monitor.add_listener(listener)
+        stage_listeners = {}
+
+        def factory(stage_name):
+            stage_listeners[stage_name] = MonTestListener()
+            return stage_listeners[stage_name]
+
+        monitor.add_listener_factory(factory)
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        monitor.stop(True)
+        self.assertEqual(monitor.running_stages(), [])
+        return listener, stage_listeners
+
+    def _check_stage(self, listener, stage_name, failed=False):
+        self.assertTrue(listener.finished)
+        self.assertEqual(listener.stage.name, stage_name)
+        self.assertEqual(listener.stage.success, not failed)
+        self.assertEqual(len(listener.steps), 2)
+        for step in listener.steps:
+            self.assertTrue(step['finished'])
+            self.assertEqual(len(step['minions']), 3)
+
+    def test_orchestration_jid_lineage(self):
+        # both orchestrations run the same states, only the lineage tells them apart
+        events = _interleave(
+            synthetic_events("stage.a", 3, 2, 1, jid_base=1, lineage=True),
+            synthetic_events("stage.b", 3, 2, 1, ["minion1"], jid_base=2, lineage=True))
+        listener, stage_listeners = self._run(events, {
+            "stage.a": synthetic_steps(3, 2, 1),
+            "stage.b": synthetic_steps(3, 2, 1),
+        })
+
+        self._check_stage(stage_listeners["stage.a"], "stage.a")
+        self._check_stage(stage_listeners["stage.b"], "stage.b", True)
+        # the monitor listener follows the first orchestration only
+        self._check_stage(listener, "stage.a")
+
+    def test_step_matching(self):
+        events = _interleave(
+            synthetic_events("stage.a", 3, 2, 1, sls_prefix="a", jid_base=1),
+            synthetic_events("stage.b", 3, 2, 1, sls_prefix="b", jid_base=2))
+        _, stage_listeners = self._run(events, {
+            "stage.a": synthetic_steps(3, 2, 1, "a"),
+            "stage.b": synthetic_steps(3, 2, 1, "b"),
+        })
+
+        self._check_stage(stage_listeners["stage.a"], "stage.a")
+        self._check_stage(stage_listeners["stage.b"], "stage.b")
+        self.assertEqual([s['step'].name for s in stage_listeners["stage.b"].steps],
+                         ["b.state0", "b.state1"])
+
+    def test_sequential_orchestrations(self):
+        events = synthetic_events("stage.a", 2, 2, 1, sls_prefix="a", jid_base=1) + \
+                 synthetic_events("stage.b", 2, 2, 1, sls_prefix="b", jid_base=2)
+        listener, _ = self._run(events, {
+            "stage.a": synthetic_steps(2, 2, 1, "a"),
+            "stage.b": synthetic_steps(2, 2, 1, "b"),
+        })
+
+        # the monitor listener follows the next orchestration once the first finishes
+        self.assertEqual(listener.stage.name, "stage.b")
+        self.assertTrue(listener.finished)
@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+Salt event recording and replay tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+import base64
+import json
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+
+from ..monitor import Monitor
+from ..salt_event import EventRecorder, EventReplayProcessor
+from ..stage_parser import SaltRunner
+from .synthetic import synthetic_steps, synthetic_events, synthetic_minions
+from .test_monitor import MonTestListener
+
+
+class TestEventReplay(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _record(self, path, include_steps, failed_minions=None):
+        recorder = EventRecorder(path, include_steps)
+        recorder.record_stage("test.synthetic", synthetic_steps(3, 2, 2), "init output")
+        for event in synthetic_events("test.synthetic", 3, 2, 2, failed_minions):
+            recorder.record_event(event['tag'], event['data'])
+        # events not handled by the monitor are recorded too
+        recorder.record_event("salt/auth", {'_stamp': None, 'id': 'minion1'})
+        recorder.close()
+
+    def _replay(self, path):
+        processor = EventReplayProcessor(path, 0)
+        monitor = Monitor(True, True, processor)
+        for stage_name, (steps, out) in processor.recorded_stages().items():
+            monitor.set_stage_steps(stage_name, steps, out)
+        listener = MonTestListener()
+        monitor.add_listener(listener)
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        monitor.stop(True)
+        return monitor, processor, listener
+
+    def test_record_replay(self):
+        path = os.path.join(self.tmp_dir, "events.jsonl")
+        self._record(path, True)
+
+        monitor, processor, listener = self._replay(path)
+
+        self.assertTrue(listener.parsed)
+        self.assertIsNone(listener.parsing_error)
+        self.assertEqual(listener.parsing_output, "init output")
+        self.assertTrue(listener.finished)
+        self.assertTrue(listener.stage.success)
+        self.assertEqual(len(listener.steps), 2)
+        for idx, step in enumerate(listener.steps):
+            self.assertEqual(step['step'].name, "synthetic.state{}".format(idx))
+            self.assertTrue(step['finished'])
+            self.assertTrue(step['step'].success)
+            for minion in synthetic_minions(3):
+                self.assertTrue(step['minions'][minion]['finished'])
+                self.assertEqual(len(step['minions'][minion]['states']), 2)
+
+        self.assertEqual(processor.dropped_events, 1)
+        self.assertEqual(monitor.event_stats()['handled'], processor.processed_events)
+
+    def test_replay_without_steps(self):
+        path = os.path.join(self.tmp_dir, "events.jsonl.gz")
+        self._record(path, False, ["minion2"])
+
+        _, _, listener = self._replay(path)
+
+        self.assertTrue(listener.finished)
+        self.assertFalse(listener.stage.success)
+        self.assertEqual(listener.stage.total_steps(), 0)
+
+    def test_recorded_steps_are_json(self):
+        path = os.path.join(self.tmp_dir, "events.jsonl")
+        steps = synthetic_steps(2, 2, 1)
+        runner = SaltRunner({'__id__': 'runner', 'state': 'salt', 'fun': 'runner',
+                             'name': 'test.ping'})
+        runner.on_success_deps.append(steps[1])
+        runner.on_fail_deps.append(steps[0])
+        steps.append(runner)
+        recorder = EventRecorder(path, True)
+        recorder.record_stage("test.synthetic", steps, "init output")
+        recorder.close()
+
+        with open(path) as rfile:
+            record = json.loads(rfile.read().splitlines()[1])
+        self.assertEqual(record['steps'][2]['class'], 'SaltRunner')
+
+        loaded, out = EventReplayProcessor(path, 0).recorded_stages()["test.synthetic"]
+        self.assertEqual(out, "init output")
+        self.assertEqual([str(step) for step in loaded], [str(step) for step in steps])
+        self.assertEqual(loaded[0].target_expanded, ["minion1", "minion2"])
+        self.assertEqual(loaded[0].steps["minion2"][0].pretty_string(), "cmd.run(cmd0)")
+        self.assertEqual(loaded[0].steps["minion2"][0].target, "minion2")
+        self.assertIs(loaded[2].on_success_deps[0], loaded[1])
+        self.assertIs(loaded[2].on_fail_deps[0], loaded[0])
+
+    def test_pickled_steps_not_loaded(self):
+        path = os.path.join(self.tmp_dir, "events.jsonl")
+        steps_data = base64.b64encode(pickle.dumps(synthetic_steps(2, 2, 1)))
+        with open(path, 'w') as rfile:
+            rfile.write(json.dumps({'format': 'deepsea-events', 'version': 1}) + "\n")
+            rfile.write(json.dumps({'stage': 'test.synthetic', 'out': '',
+                                    'steps': steps_data.decode('ascii')}) + "\n")
+
+        stages = EventReplayProcessor(path, 0).recorded_stages()
+        self.assertEqual(stages, {'test.synthetic': ([], '')})
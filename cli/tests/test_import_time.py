@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+"""
+Import time regression tests of the DeepSea CLI.
+Salt and Tornado are only imported when a command needs them, so that the startup of
+commands like "attach" or "--help" is not slowed down by them.
+"""
+from __future__ import absolute_import
+
+import os
+import subprocess
+import sys
+import unittest
+
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# cumulative import time budget of the cli.deepsea module, in microseconds
+IMPORT_TIME_BUDGET = 500000
+
+
+def _run_python(code, *options):
+    proc = subprocess.Popen([sys.executable] + list(options) + ['-c', code], cwd=REPO_ROOT,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    out, err = proc.communicate()
+    return proc.returncode, out.decode('utf-8'), err.decode('utf-8')
+
+
+def _cumulative_import_time(importtime_output, module):
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        fields = [f.strip() for f in line[len("import time:"):].split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+    return None
+
+
+class TestImportTime(unittest.TestCase):
+
+    def test_no_salt_nor_tornado_on_import(self):
+        code = ("import sys; import cli.deepsea; "
+                "print(','.join(sorted(m for m in sys.modules "
+                "if m.split('.')[0] in ('salt', 'tornado'))))")
+        ret, out, err = _run_python(code)
+        self.assertEqual(ret, 0, err)
+        self.assertEqual(out.strip(), "")
+
+    @unittest.skipIf(sys.version_info < (3, 7), "-X importtime requires python 3.7")
+    def test_import_time_budget(self):
+        ret, _, err = _run_python("import cli.deepsea", "-X", "importtime")
+        self.assertEqual(ret, 0, err)
+        import_time = _cumulative_import_time(err, "cli.deepsea")
+        self.assertIsNotNone(import_time)
+        self.assertLess(import_time, IMPORT_TIME_BUDGET,
+                        "cli.deepsea import time: {:.1f}ms\n{}".format(import_time / 1000.0,
+                                                                      err))
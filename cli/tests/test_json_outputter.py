@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+JSON-lines outputter tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+import json
+import unittest
+
+import six
+
+from ..monitor import Monitor
+from ..monitors.json_outputter import JSONLinesPrinter
+from .synthetic import StubEventProcessor, synthetic_steps, synthetic_events
+
+
+class TestJSONLinesPrinter(unittest.TestCase):
+
+    def _run(self, failed_minions=None):
+        stream = six.StringIO()
+        processor = StubEventProcessor(synthetic_events("test.synthetic", 2, 2, 1,
+                                                        failed_minions))
+        monitor = Monitor(True, True, processor)
+        monitor.set_stage_steps("test.synthetic", synthetic_steps(2, 2, 1), "init output")
+        monitor.add_listener(JSONLinesPrinter(stream))
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        monitor.stop(True)
+        return [json.loads(line) for line in stream.getvalue().splitlines()]
+
+    def test_transitions(self):
+        records = self._run()
+
+        self.assertEqual([r['event'] for r in records], [
+            'stage_started', 'stage_parsing_started', 'stage_parsing_finished',
+            'step_state_started', 'step_state_result', 'step_state_result',
+            'step_state_minion_finished', 'step_state_minion_finished', 'step_state_finished',
+            'step_state_started', 'step_state_result', 'step_state_result',
+            'step_state_minion_finished', 'step_state_minion_finished', 'step_state_finished',
+            'stage_finished'])
+        for record in records:
+            self.assertEqual(record['stage'], "test.synthetic")
+            self.assertIn('ts', record)
+
+        self.assertEqual(records[2]['total_steps'], 2)
+        self.assertEqual(records[3]['step'], 1)
+        self.assertEqual(records[3]['name'], "synthetic.state0")
+        self.assertEqual(records[3]['targets'], ["minion1", "minion2"])
+        self.assertEqual(records[4]['state'], "state 0")
+        self.assertEqual(records[6]['minion'], "minion1")
+        self.assertTrue(records[-1]['success'])
+        self.assertEqual(records[-1]['steps'], 2)
+
+    def test_failed_minion(self):
+        records = self._run(["minion2"])
+
+        minion_records = [r for r in records if r['event'] == 'step_state_minion_finished']
+        self.assertEqual([(r['minion'], r['success']) for r in minion_records],
+                         [("minion1", True), ("minion2", False)] * 2)
+        self.assertFalse(records[-1]['success'])
+
+    def test_parsing_state_set(self):
+        stream = six.StringIO()
+        printer = JSONLinesPrinter(stream)
+        printer.stage_started("test.synthetic")
+        # the stage parser reports the states being rendered as a set
+        printer.stage_parsing_state(set(["ceph.mon", "ceph.mgr"]), "minion1")
+
+        record = json.loads(stream.getvalue().splitlines()[-1])
+        self.assertEqual(record['event'], 'stage_parsing_state')
+        self.assertEqual(record['states'], ["ceph.mgr", "ceph.mon"])
+        self.assertEqual(record['minion'], "minion1")
@@ -0,0 +1,169 @@
+# -*- coding: utf-8 -*-
+"""
+Monitor throughput benchmark with synthetic clusters.
+These tests do not need a running Salt master, the Salt event processor is replaced
+by a stub that feeds synthetic events.
+
+Run with custom sizes:
+    $ python -m cli.tests.test_monitor_benchmark --targets 1000 --steps 5 --states 10
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import time
+import unittest
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+from ..common import redirect_output
+from ..monitor import Monitor
+from ..monitors.terminal_outputter import SimplePrinter, StepListPrinter
+from .synthetic import StubEventProcessor, synthetic_steps, synthetic_events
+
+
+class BenchmarkMonitor(Monitor):
+    """
+    Monitor that measures the handling latency of each event, i.e., the time from
+    being buffered until its handler and listeners return
+    """
+    class TimedEvent(object):
+        def __init__(self, event, latencies):
+            self.wrapped = event
+            self.event = event.event
+            self.latencies = latencies
+            self.buffered_ts = time.time()
+
+        def call(self):
+            self.wrapped.call()
+            self.latencies.append(time.time() - self.buffered_ts)
+
+    def __init__(self, *args, **kwargs):
+        super(BenchmarkMonitor, self).__init__(*args, **kwargs)
+        self.latencies = []
+
+    def append_event(self, event):
+        super(BenchmarkMonitor, self).append_event(
+            BenchmarkMonitor.TimedEvent(event, self.latencies))
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = int(round((len(values) - 1) * pct / 100.0))
+    return values[idx]
+
+
+def run_benchmark(num_targets, num_steps, num_states, listener_class, trace_memory=False,
+                  collapse_threshold=None):
+    """
+    Drives a synthetic orchestration through the Monitor and a listener
+    Returns:
+        dict: the benchmark results
+    """
+    if trace_memory:
+        tracemalloc.start()
+    stage_name = "bench.synthetic"
+    events = synthetic_events(stage_name, num_targets, num_steps, num_states)
+    num_events = len(events)
+    processor = StubEventProcessor(events)
+    del events
+    monitor = BenchmarkMonitor(True, True, processor)
+    monitor.set_stage_steps(stage_name, synthetic_steps(num_targets, num_steps, num_states),
+                            "")
+    if listener_class is StepListPrinter:
+        listener = StepListPrinter(False, collapse_threshold=collapse_threshold)
+    else:
+        listener = listener_class()
+    monitor.add_listener(listener)
+
+    with open(os.devnull, "w") as devnull:
+        with redirect_output(devnull, devnull):
+            t0 = time.time()
+            monitor.start()
+            processor.join()
+            monitor.wait_until_idle()
+            elapsed = time.time() - t0
+            monitor.stop(True)
+    peak_memory = None
+    retained_memory = None
+    if trace_memory:
+        retained_memory, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    handled = monitor.event_stats()['handled']
+    return {
+        'listener': listener_class.__name__,
+        'targets': num_targets,
+        'steps': num_steps,
+        'states': num_states,
+        'events': num_events,
+        'handled': handled,
+        'elapsed': elapsed,
+        'events_per_sec': handled / elapsed if elapsed > 0 else 0.0,
+        'p50_latency': _percentile(monitor.latencies, 50),
+        'p99_latency': _percentile(monitor.latencies, 99),
+        'peak_memory': peak_memory,
+        'retained_memory': retained_memory,
+        'monitor': monitor,
+        'listener_obj': listener,
+    }
+
+
+def format_result(res):
+    def fmem(size):
+        return "n/a" if size is None else "{:.1f}MiB".format(size / (1024.0 * 1024.0))
+    return ("{listener:15} targets={targets} steps={steps} states={states} events={events} "
+            "events/s={eps:.0f} p50={p50:.2f}ms p99={p99:.2f}ms peak_mem={peak} "
+            "retained_mem={retained}"
+            .format(listener=res['listener'], targets=res['targets'], steps=res['steps'],
+                    states=res['states'], events=res['events'], eps=res['events_per_sec'],
+                    p50=res['p50_latency'] * 1000, p99=res['p99_latency'] * 1000,
+                    peak=fmem(res['peak_memory']), retained=fmem(res['retained_memory'])))
+
+
+class TestMonitorBenchmark(unittest.TestCase):
+
+    def _check(self, res):
+        print("\n" + format_result(res))
+        stage = res['listener_obj'].stage if hasattr(res['listener_obj'], 'stage') else None
+        self.assertEqual(res['handled'], res['events'])
+        if stage is not None:
+            self.assertTrue(stage.success)
+            self.assertEqual(stage.current_step, res['steps'])
+
+    def test_benchmark_simple_printer(self):
+        self._check(run_benchmark(50, 3, 5, SimplePrinter))
+
+    def test_benchmark_step_list_printer(self):
+        self._check(run_benchmark(50, 3, 5, StepListPrinter, collapse_threshold=0))
+
+    def test_benchmark_step_list_printer_collapsed(self):
+        self._check(run_benchmark(200, 3, 5, StepListPrinter))
+
+    @unittest.skipIf(tracemalloc is None, "tracemalloc not available")
+    def test_benchmark_peak_memory(self):
+        res = run_benchmark(20, 2, 3, SimplePrinter, True)
+        self._check(res)
+        self.assertGreater(res['peak_memory'], 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSea monitor throughput benchmark")
+    parser.add_argument('--targets', type=int, default=100)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--states', type=int, default=10)
+    parser.add_argument('--memory', action='store_true', help="trace peak memory (slower)")
+    args = parser.parse_args()
+    for listener_class in [SimplePrinter, StepListPrinter]:
+        print(format_result(run_benchmark(args.targets, args.steps, args.states,
+                                          listener_class, args.memory)))
+
+
+if __name__ == "__main__":
+    main()
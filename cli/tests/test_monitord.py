@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+Monitor daemon tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import socket
+import tempfile
+import threading
+import time
+import unittest
+
+import six
+
+from ..monitor import Monitor
+from ..monitord import MonitorDaemon, attach
+from .synthetic import StubEventProcessor, synthetic_steps, synthetic_events
+
+
+class TestMonitorDaemon(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.socket_path = os.path.join(self.tmp_dir, "monitord.sock")
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    @staticmethod
+    def _records(out):
+        return [json.loads(line) for line in out.getvalue().splitlines()]
+
+    def test_snapshot_and_updates(self):
+        processor = StubEventProcessor(synthetic_events("test.synthetic", 2, 2, 1,
+                                                        ["minion2"]))
+        monitor = Monitor(True, True, processor)
+        monitor.set_stage_steps("test.synthetic", synthetic_steps(2, 2, 1), "")
+        daemon = MonitorDaemon(monitor, self.socket_path)
+        daemon.start()
+
+        out = six.StringIO()
+        client = threading.Thread(target=attach, args=(self.socket_path, False, out))
+        client.start()
+        for _ in range(50):
+            if out.getvalue():
+                # the snapshot was received, the client is subscribed
+                break
+            time.sleep(0.1)
+
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        monitor.stop(True)
+
+        snapshot_out = six.StringIO()
+        attach(self.socket_path, True, snapshot_out)
+        daemon.stop()
+        client.join(5)
+        self.assertFalse(client.is_alive())
+
+        records = self._records(out)
+        self.assertEqual(records[0]['event'], 'snapshot')
+        self.assertEqual(records[0]['running'], [])
+        self.assertEqual(records[-1]['event'], 'stage_finished')
+        self.assertEqual(len([r for r in records if r['event'] == 'step_state_finished']), 2)
+
+        snapshot = self._records(snapshot_out)
+        self.assertEqual(len(snapshot), 1)
+        self.assertEqual(snapshot[0]['running'], [])
+        orch = snapshot[0]['finished'][0]
+        self.assertEqual(orch['stage'], "test.synthetic")
+        self.assertFalse(orch['success'])
+        self.assertEqual([(s['step'], s['status'], s['finished_targets'], s['failed_targets'])
+                          for s in orch['steps']],
+                         [(1, 'failed', 2, 1), (2, 'failed', 2, 1)])
+        self.assertFalse(os.path.exists(self.socket_path))
+
+    def test_running_snapshot(self):
+        daemon = MonitorDaemon(Monitor(True, True, StubEventProcessor([])), self.socket_path)
+        daemon.publish({'event': 'stage_parsing_finished', 'orch_jid': '1', 'stage': 's',
+                        'ts': 't0', 'total_steps': 2})
+        daemon.publish({'event': 'step_state_started', 'orch_jid': '1', 'stage': 's',
+                        'ts': 't1', 'step': 1, 'name': 'a', 'targets': ['m1', 'm2']})
+        daemon.publish({'event': 'step_state_minion_finished', 'orch_jid': '1', 'stage': 's',
+                        'ts': 't2', 'step': 1, 'name': 'a', 'minion': 'm1', 'success': True})
+
+        snapshot = daemon.snapshot()
+        self.assertEqual(len(snapshot['running']), 1)
+        orch = snapshot['running'][0]
+        self.assertEqual(orch['current_step'], 1)
+        self.assertEqual(orch['steps'], [{'step': 1, 'name': 'a', 'type': 'state',
+                                          'status': 'running', 'targets': 2,
+                                          'finished_targets': 1, 'failed_targets': 0,
+                                          'started': 't1'}])
+
+    def test_repeated_minion_returns(self):
+        daemon = MonitorDaemon(Monitor(True, True, StubEventProcessor([])), self.socket_path)
+        daemon.publish({'event': 'stage_parsing_finished', 'orch_jid': '1', 'stage': 's',
+                        'ts': 't0', 'total_steps': 1})
+        # step_state_started was missed
+        for minion, success in [('m1', False), ('m1', False), ('m2', True)]:
+            daemon.publish({'event': 'step_state_minion_finished', 'orch_jid': '1',
+                            'stage': 's', 'ts': 't1', 'step': 1, 'name': 'a',
+                            'minion': minion, 'success': success})
+
+        step = daemon.snapshot()['running'][0]['steps'][0]
+        self.assertEqual((step['finished_targets'], step['failed_targets']), (2, 1))
+
+        # a retry that succeeded only counts as successful
+        daemon.publish({'event': 'step_state_minion_finished', 'orch_jid': '1', 'stage': 's',
+                        'ts': 't2', 'step': 1, 'name': 'a', 'minion': 'm1', 'success': True})
+        step = daemon.snapshot()['running'][0]['steps'][0]
+        self.assertEqual((step['finished_targets'], step['failed_targets']), (2, 0))
+
+        daemon.publish({'event': 'step_state_minion_finished', 'orch_jid': '1', 'stage': 's',
+                        'ts': 't3', 'step': 1, 'name': 'a', 'minion': 'm2', 'success': False})
+        step = daemon.snapshot()['running'][0]['steps'][0]
+        self.assertEqual((step['finished_targets'], step['failed_targets']), (2, 1))
+
+    def test_idle_client_does_not_block_snapshot(self):
+        daemon = MonitorDaemon(Monitor(True, True, StubEventProcessor([])), self.socket_path)
+        daemon.start()
+        idle = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        idle.connect(self.socket_path)
+        try:
+            out = six.StringIO()
+            start = time.time()
+            attach(self.socket_path, True, out)
+            self.assertLess(time.time() - start, 2)
+            self.assertEqual(self._records(out)[0]['event'], 'snapshot')
+        finally:
+            idle.close()
+            daemon.stop()
+
+    def test_malformed_request(self):
+        daemon = MonitorDaemon(Monitor(True, True, StubEventProcessor([])), self.socket_path)
+        daemon.start()
+        try:
+            conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            conn.connect(self.socket_path)
+            conn.sendall(b"\xff\xfe\n")
+            conn.settimeout(5)
+            data = b""
+            while True:
+                chunk = conn.recv(4096)
+                if not chunk:
+                    # the daemon closed the connection
+                    break
+                data += chunk
+            conn.close()
+            self.assertEqual(json.loads(data.decode('utf-8'))['event'], 'error')
+
+            out = six.StringIO()
+            attach(self.socket_path, True, out)
+            self.assertEqual(self._records(out)[0]['event'], 'snapshot')
+        finally:
+            daemon.stop()
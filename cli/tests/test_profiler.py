@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Stage profiler tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from ..monitor import Monitor
+from ..monitors.profiler import StageProfiler
+from .synthetic import StubEventProcessor, synthetic_steps, synthetic_events
+
+
+class TestStageProfiler(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def _run(self, steps, report_file=None):
+        processor = StubEventProcessor(synthetic_events("test.synthetic", 3, len(steps), 2))
+        monitor = Monitor(True, True, processor)
+        monitor.set_stage_steps("test.synthetic", steps, "")
+        profiler = StageProfiler(False, report_file)
+        monitor.add_listener(profiler)
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        monitor.stop(True)
+        return profiler.report
+
+    def test_report(self):
+        report = self._run(synthetic_steps(3, 2, 2))
+
+        self.assertEqual(report['stage'], "test.synthetic")
+        self.assertTrue(report['success'])
+        self.assertEqual(len(report['steps']), 2)
+        self.assertEqual(report['runner_time'], 0)
+        self.assertAlmostEqual(report['state_time'],
+                               sum(s['wall_time'] for s in report['steps']))
+        self.assertLessEqual(report['state_time'], report['wall_time'])
+
+        step = report['steps'][0]
+        self.assertEqual(step['type'], 'state')
+        self.assertEqual(step['minions']['count'], 3)
+        self.assertLessEqual(step['minions']['p50'], step['minions']['p95'])
+        self.assertEqual(step['minions']['max'], step['wall_time'])
+        # minions return in order, the last one is the slowest
+        self.assertEqual([m['minion'] for m in step['slowest_minions']],
+                         ["minion3", "minion2", "minion1"])
+
+    def test_critical_path(self):
+        steps = synthetic_steps(3, 3, 2)
+        steps[2].on_success_deps.append(steps[0])
+        report = self._run(steps)
+
+        self.assertEqual([s['step'] for s in report['critical_path']['steps']], [1, 3])
+        self.assertAlmostEqual(report['critical_path']['time'],
+                               report['steps'][0]['wall_time'] +
+                               report['steps'][2]['wall_time'])
+
+    def test_report_file(self):
+        path = os.path.join(self.tmp_dir, "profile.json")
+        report = self._run(synthetic_steps(2, 1, 1), path)
+
+        with open(path) as report_file:
+            self.assertEqual(json.load(report_file), json.loads(json.dumps(report)))
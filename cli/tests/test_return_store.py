@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Compact step events and on-disk return store tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+import unittest
+
+from ..monitor import Monitor, MonitorListener, ReturnStore, Stage, StepEvent
+from .synthetic import StubEventProcessor, synthetic_steps, synthetic_events
+
+
+class FailureListener(MonitorListener):
+    def __init__(self):
+        self.events = {}
+        self.returns = {}
+
+    def step_state_minion_finished(self, step, minion):
+        self.events[minion] = step.targets[minion]['event']
+
+    def stage_finished(self, stage):
+        for minion, event in self.events.items():
+            if not event.success or event.retcode:
+                self.returns[minion] = event.raw_event['data']['return']
+
+
+class TestReturnStore(unittest.TestCase):
+
+    def test_put_get(self):
+        store = ReturnStore()
+        store.put('a', {'data': {'return': 'x' * 1000}})
+        store.put('b', {'data': {'return': 'y'}})
+        store.put('a', {'data': {'return': 'z'}})
+        self.assertEqual(store.get('a'), {'data': {'return': 'z'}})
+        self.assertEqual(store.get('b'), {'data': {'return': 'y'}})
+        self.assertEqual(store.spilled(), 0)
+        store.close()
+
+    def test_spill_big_events(self):
+        store = ReturnStore()
+        big = {'data': {'return': 'x' * ReturnStore.SPILL_THRESHOLD}}
+        store.put('a', big)
+        store.put('b', {'data': {'return': 'y'}})
+        self.assertEqual(store.spilled(), 1)
+        self.assertEqual(store.get('a'), big)
+        self.assertEqual(store.get('b'), {'data': {'return': 'y'}})
+        store.put('a', {'data': {'return': 'z'}})
+        self.assertEqual(store.spilled(), 0)
+        self.assertEqual(store.get('a'), {'data': {'return': 'z'}})
+        store.close()
+
+    def test_slots(self):
+        self.assertFalse(hasattr(StepEvent.__new__(StepEvent), '__dict__'))
+        self.assertFalse(hasattr(Stage.Step(None, 'step', 1), '__dict__'))
+        self.assertFalse(hasattr(Stage.TargetedStep(None, 'step', 1), '__dict__'))
+
+    def test_failure_summary(self):
+        processor = StubEventProcessor(synthetic_events("test.synthetic", 2, 1, 2,
+                                                        ["minion2"]))
+        monitor = Monitor(True, True, processor)
+        monitor.set_stage_steps("test.synthetic", synthetic_steps(2, 1, 2), "")
+        listener = FailureListener()
+        monitor.add_listener(listener)
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        monitor.stop(True)
+
+        event = listener.events['minion2']
+        self.assertIsInstance(event, StepEvent)
+        self.assertEqual(event.minion, 'minion2')
+        self.assertEqual(event.retcode, 2)
+        self.assertEqual(sorted(event.failed_states), ['state 0', 'state 1'])
+        self.assertEqual(listener.events['minion1'].failed_states, [])
+        self.assertEqual(list(listener.returns), ['minion2'])
+        self.assertEqual(len(listener.returns['minion2']), 2)
+
+    def test_released_when_monitor_stopped(self):
+        # the orchestration never finishes
+        processor = StubEventProcessor(synthetic_events("test.synthetic", 2, 1, 2)[:-1])
+        monitor = Monitor(True, True, processor)
+        monitor.set_stage_steps("test.synthetic", synthetic_steps(2, 1, 2), "")
+        listener = FailureListener()
+        monitor.add_listener(listener)
+        monitor.start()
+        processor.join()
+        monitor.wait_until_idle()
+        self.assertEqual(listener.events['minion1'].raw_event['data']['id'], 'minion1')
+        monitor.stop(True)
+
+        self.assertEqual(len(monitor.running_stages()), 1)
+        with self.assertRaises(KeyError):
+            listener.events['minion1'].raw_event
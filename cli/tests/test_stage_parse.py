@@ -1,10 +1,16 @@
 # -*- coding: utf-8 -*-
 from __future__ import absolute_import
 
+import os
+import shutil
+import tempfile
+import unittest
+
 from .helper import SaltTestCase
 from ..stage_parser import SLSParser, SaltRunner, SaltExecutionFunction, \
                            StageRenderingException, SaltState, \
-                           SaltStateFunction, StateRenderingException
+                           SaltStateFunction, StateRenderingException, StageCache, \
+                           SaltClient
 
 
 class TestStageParser(SaltTestCase):
@@ -480,3 +486,114 @@ error state:
         self.assertIsInstance(ctx.exception.pretty_error_desc_str(), str)
         self.assertIn("No minions matched the target",
                       ctx.exception.pretty_error_desc_str())
+
+    def test_parse_stage_cache(self):
+        self.write_state_file("test.test-orch105", {
+            'test state': {
+                'salt.state': [{
+                    'sls': 'test.test-state105',
+                    'tgt': '*'
+                }]
+            }
+        })
+
+        self.write_state_file("test.test-state105", {
+            'state cmd {{ grains["id"] }}': {
+                'cmd.run': [{
+                    'name': 'ls -l /srv'
+                }]
+            }
+        })
+
+        SLSParser.clean_cache("test.test-orch105")
+        self.assertIsNone(StageCache.load("test.test-orch105", False, False))
+
+        steps, _ = SLSParser.parse_stage("test.test-orch105", False, False)
+        cached = StageCache.load("test.test-orch105", False, False)
+        self.assertIsNotNone(cached)
+        self.assertEqual(len(cached[0]), len(steps))
+        self.assertEqual(cached[0][0].sls, ["test.test-state105"])
+        self.assertEqual(set(cached[0][0].target), set(self.minions()))
+
+        # changing an involved state file invalidates the cache entry
+        self.write_state_file("test.test-state105", {
+            'state cmd {{ grains["id"] }}': {
+                'cmd.run': [{
+                    'name': 'ls -l /srv/salt'
+                }]
+            }
+        }, overwrite=True)
+        self.assertIsNone(StageCache.load("test.test-orch105", False, False))
+
+        steps, _ = SLSParser.parse_stage("test.test-orch105", False, False)
+        for s_steps in steps[0].steps.values():
+            self.assertEqual(s_steps[0].pretty_string(), "cmd.run(ls -l /srv/salt)")
+
+        # so does changing a file that is not named in __sls__, like a Jinja import
+        self.write_state_file("test.test-macros105", "{% macro cmd() %}ls{% endmacro %}")
+        self.write_state_file("test.test-state105",
+                              "{% from 'test/test-macros105.sls' import cmd %}", append=True)
+        SLSParser.parse_stage("test.test-orch105", False, False)
+        self.assertIsNotNone(StageCache.load("test.test-orch105", False, False))
+        self.write_state_file("test.test-macros105", "{% macro cmd() %}ls -l{% endmacro %}",
+                              overwrite=True)
+        self.assertIsNone(StageCache.load("test.test-orch105", False, False))
+
+        SLSParser.clean_cache("test.test-orch105")
+        self.assertIsNone(StageCache.load("test.test-orch105", False, False))
+
+
+class TestStageCacheFingerprint(unittest.TestCase):
+    """
+    These tests do not need a running Salt master
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.pki_dir = os.path.join(self.tmp_dir, 'minions')
+        os.makedirs(self.pki_dir)
+        for minion in ['minion1', 'minion2']:
+            open(os.path.join(self.pki_dir, minion), 'w').close()
+        self.data = {
+            'minion1': {'grains': {'os': 'SUSE'}, 'pillar': {'roles': ['mon']}},
+            'minion2': {'grains': {'os': 'SUSE'}, 'pillar': {'roles': ['mgr']}},
+        }
+        self.orig = (StageCache.CONFIG_PATHS, StageCache.MINIONS_PKI_DIR,
+                     SaltClient._DATA_CACHE_)
+        StageCache.CONFIG_PATHS = [os.path.join(self.tmp_dir, 'master')]
+        StageCache.MINIONS_PKI_DIR = self.pki_dir
+        SaltClient._DATA_CACHE_ = self
+
+    def tearDown(self):
+        StageCache.CONFIG_PATHS, StageCache.MINIONS_PKI_DIR, SaltClient._DATA_CACHE_ = \
+            self.orig
+        shutil.rmtree(self.tmp_dir)
+
+    def fetch(self, bank, key):
+        """
+        Minion data cache fetch, as in salt.cache.Cache
+        """
+        self.assertEqual(key, 'data')
+        return self.data[bank.split('/')[1]]
+
+    def test_env_fingerprint_ignores_cache_rewrites(self):
+        fingerprint = StageCache.env_fingerprint()
+        # the master rewrites the minion data cache with the same content
+        self.data['minion1'] = {'pillar': {'roles': ['mon']}, 'grains': {'os': 'SUSE'},
+                                'mine': {'network.ip_addrs': ['10.0.0.1']}}
+        self.assertEqual(StageCache.env_fingerprint(), fingerprint)
+
+    def test_env_fingerprint_changes(self):
+        fingerprint = StageCache.env_fingerprint()
+        self.data['minion2']['grains']['os'] = 'Ubuntu'
+        self.assertNotEqual(StageCache.env_fingerprint(), fingerprint)
+
+        fingerprint = StageCache.env_fingerprint()
+        open(os.path.join(self.pki_dir, 'minion3'), 'w').close()
+        self.data['minion3'] = {}
+        self.assertNotEqual(StageCache.env_fingerprint(), fingerprint)
+
+        fingerprint = StageCache.env_fingerprint()
+        with open(os.path.join(self.tmp_dir, 'master'), 'w') as fd:
+            fd.write("pillar_cache: True\n")
+        self.assertNotEqual(StageCache.env_fingerprint(), fingerprint)
@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the stage parser requisite resolution and step ordering.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import random
+import time
+import unittest
+
+from ..stage_parser import SLSParser, SaltRunner, SaltStateFunction, \
+                           StageRenderingException
+
+
+def _synthetic_stage(num_steps, max_deps=3, seed=42):
+    """
+    Generates a list of steps where each step requires up to max_deps random
+    previous steps. The list is returned shuffled so that the steps need to be
+    reordered.
+    """
+    rnd = random.Random(seed)
+    step_dicts = []
+    for idx in range(num_steps):
+        step_dict = {
+            '__id__': 'step {}'.format(idx),
+            'state': 'salt' if idx % 2 else 'cmd',
+            'fun': 'runner' if idx % 2 else 'run',
+            'name': 'name-{}'.format(idx),
+        }
+        if idx > 0:
+            reqs = []
+            for dep in set(rnd.randrange(idx) for _ in range(rnd.randint(0, max_deps))):
+                if dep % 3 == 0:
+                    reqs.append('step {}'.format(dep))
+                else:
+                    reqs.append({'salt' if dep % 2 else 'cmd': 'name-{}'.format(dep)})
+            if reqs:
+                step_dict['onfail' if idx % 7 == 0 else 'require'] = reqs
+        step_dicts.append(step_dict)
+    rnd.shuffle(step_dicts)
+
+    steps = []
+    for step_dict in step_dicts:
+        if step_dict['state'] == 'salt':
+            steps.append(SaltRunner(step_dict))
+        else:
+            steps.append(SaltStateFunction(step_dict, 'minion1'))
+    return steps
+
+
+def _legacy_reorder(steps):
+    """
+    Reference implementation of the previous scan-and-pop ordering algorithm
+    """
+    steps = list(steps)
+    nsteps = []
+    while steps:
+        for idx, step in enumerate(steps):
+            deps = list(step.on_success_deps) + list(step.on_fail_deps)
+            if all(dep in nsteps for dep in deps):
+                nsteps.append(steps.pop(idx))
+                break
+        else:
+            raise StageRenderingException("legacy", ["Recursive requisite found"])
+    return nsteps
+
+
+class TestStageParserBenchmark(unittest.TestCase):
+
+    def test_reorder_same_order_as_legacy(self):
+        steps = _synthetic_stage(300)
+        SLSParser._process_states_requisites("bench", steps)
+        self.assertEqual([s.desc for s in SLSParser._reorder("bench", list(steps))],
+                         [s.desc for s in _legacy_reorder(steps)])
+
+    def test_reorder_recursive_requisite(self):
+        steps = _synthetic_stage(10)
+        steps[0].on_success_deps.append(steps[1])
+        steps[1].on_success_deps.append(steps[0])
+        with self.assertRaises(StageRenderingException) as ctx:
+            SLSParser._reorder("bench", steps)
+        self.assertEqual(ctx.exception.error_list, ["Recursive requisite found"])
+
+    def test_benchmark_10k_steps(self):
+        steps = _synthetic_stage(10000)
+
+        t0 = time.time()
+        SLSParser._process_states_requisites("bench", steps)
+        t1 = time.time()
+        ordered = SLSParser._reorder("bench", steps)
+        t2 = time.time()
+
+        print("\n10k steps: requisites={:.3f}s reorder={:.3f}s".format(t1 - t0, t2 - t1))
+
+        self.assertEqual(len(ordered), 10000)
+        placed = set()
+        for step in ordered:
+            for dep in step.on_success_deps + step.on_fail_deps:
+                self.assertIn(id(dep), placed)
+            placed.add(id(step))
+        self.assertLess(t2 - t0, 10)
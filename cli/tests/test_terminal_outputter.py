@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+"""
+Step list printer tests.
+These tests do not need a running Salt master.
+"""
+from __future__ import absolute_import
+
+from collections import namedtuple
+import unittest
+
+import six
+
+from ..common import redirect_output
+from ..monitor import Stage
+from ..monitors.terminal_outputter import StepListPrinter
+from .synthetic import synthetic_minions, synthetic_steps
+
+
+Event = namedtuple('Event', ['jid', 'args', 'targets', 'stamp'])
+Return = namedtuple('Return', ['minion', 'success', 'retcode', 'stamp'])
+
+
+class TestStepListPrinter(unittest.TestCase):
+
+    def setUp(self):
+        self.minions = synthetic_minions(3)
+        stage = Stage("test.synthetic", synthetic_steps(3, 1, 2), False)
+        self.step = stage.steps()[0]
+        self.step.start(Event("1", [], self.minions, "2018-01-01T00:00:00.000000"))
+
+    def _printer(self, collapse_threshold=0):
+        printer = StepListPrinter(False, frame_budget=0, collapse_threshold=collapse_threshold)
+        printer.total_steps = 1
+        printer.step = StepListPrinter.State(printer, self.step)
+        return printer
+
+    @staticmethod
+    def _output(func):
+        out = six.StringIO()
+        with redirect_output(out, out):
+            func()
+        return out.getvalue()
+
+    def _finish(self, minion):
+        self.step.finish(Return(minion, True, 0, "2018-01-01T00:00:01.000000"))
+
+    def test_redraw_dirty_target_only(self):
+        printer = self._printer()
+        full = self._output(printer.redraw)
+        self.assertTrue(all(minion in full for minion in self.minions))
+
+        self._finish("minion2")
+        printer.step.dirty_targets.add("minion2")
+        partial = self._output(printer.redraw_targets)
+
+        # each target prints one line and one line per state, minion2 lines start 6 lines
+        # above the cursor and are followed by the 3 lines of minion3
+        self.assertTrue(partial.startswith("\r\x1B[6A"))
+        self.assertTrue(partial.endswith("\x1B[3B"))
+        self.assertIn("minion2", partial)
+        self.assertNotIn("minion1", partial)
+        self.assertNotIn("minion3", partial)
+        self.assertEqual(partial.count("\n"), 3)
+        self.assertFalse(printer.step.dirty_targets)
+
+    def test_redraw_collapsed_step(self):
+        printer = self._printer(collapse_threshold=2)
+        self._output(printer.redraw)
+
+        self._finish("minion2")
+        printer.step.dirty_targets.add("minion2")
+        output = self._output(printer.redraw_targets)
+
+        self.assertIn("3 minions", output)
+        self.assertIn("running=2 ok=1 failed=0", output)
@@ -93,6 +93,15 @@ Here is an example of such a configuration, which should speak by itself:
           opts:custom:opt:
             value: /path/to/stack0.cfg
 
+Profiling
+~~~~~~~~~
+
+Setting ``pillar_stack_profile: True`` in the master config makes PillarStack
+log, for every pillar compilation, the time spent rendering, parsing and
+merging the stack files, and the number of templates not found. When
+``pillar_stack_profile_file`` is also set, the per-file timings of every
+compilation are appended to that file as a JSON line.
+
 PillarStack configuration files
 -------------------------------
 
@@ -364,26 +373,281 @@ You can also select a custom merging strategy using a ``__`` object in a list:
 
 from __future__ import absolute_import
 import os
+import copy
+import hashlib
+import json
 import logging
+import stat
+import sys
+import threading
+import time
+import types
+from collections import OrderedDict
+from contextlib import contextmanager
 from functools import partial
 
 import yaml
 from jinja2 import FileSystemLoader, Environment, TemplateNotFound
+from jinja2.loaders import split_template_path
 import six
 
 
 log = logging.getLogger(__name__)
 strategies = ('overwrite', 'merge-first', 'merge-last', 'remove')
 
+# Maximum number of compiled templates and parsed YAML documents kept in the
+# process-wide caches shared by the pillar compilations of every minion
+TEMPLATE_CACHE_SIZE = 1000
+YAML_CACHE_SIZE = 4000
+# Maximum number of merged stacks of layer prefixes shared by several minions,
+# and of layer prefixes remembered to detect which ones are shared
+LAYER_CACHE_SIZE = 500
+SEEN_PREFIXES_SIZE = 20000
+
+
+class _LRUCache(object):
+    '''
+    Thread-safe bounded mapping which evicts the least recently used entries
+    and counts its hits and misses
+    '''
+    def __init__(self, name, maxsize):
+        self.name = name
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        '''
+        Returns the value of key, None if it is not cached
+        '''
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return None
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        '''
+        Caches value under key and evicts the least recently used entries
+        '''
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        '''
+        Empties the cache and resets its counters
+        '''
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def stats(self):
+        '''
+        Returns a log line with the size and hit rate of the cache
+        '''
+        lookups = self.hits + self.misses
+        return '{0} cache: size={1}/{2} hits={3} misses={4} hit rate={5:.1%}'.format(
+            self.name, len(self._data), self.maxsize, self.hits, self.misses,
+            float(self.hits) / lookups if lookups else 0.0)
+
+
+def _process_caches():
+    '''
+    Salt executes the ext_pillar modules again whenever a loader loads them,
+    which happens for every pillar compilation. The caches are registered in
+    sys.modules so that they are kept by the following executions.
+    '''
+    caches = sys.modules.get(_CACHES_MODULE)
+    if caches is None:
+        caches = types.ModuleType(_CACHES_MODULE)
+        caches.template = _LRUCache('template', TEMPLATE_CACHE_SIZE)
+        caches.yaml = _LRUCache('yaml', YAML_CACHE_SIZE)
+        caches.layer = _LRUCache('layer', LAYER_CACHE_SIZE)
+        caches.seen_prefixes = _LRUCache('seen prefix', SEEN_PREFIXES_SIZE)
+        sys.modules[_CACHES_MODULE] = caches
+    return caches
+
+
+_CACHES_MODULE = 'deepsea_pillar_stack_caches'
+_caches = _process_caches()
+_template_cache = _caches.template
+_yaml_cache = _caches.yaml
+_layer_cache = _caches.layer
+_seen_prefixes = _caches.seen_prefixes
+
+
+def clear_caches():
+    '''
+    Empties the process-wide template and YAML caches
+    '''
+    _template_cache.clear()
+    _yaml_cache.clear()
+    _layer_cache.clear()
+    _seen_prefixes.clear()
+
+
+class _CachingFileSystemLoader(FileSystemLoader):
+    '''
+    FileSystemLoader which keeps the compiled code of the templates in the
+    process-wide template cache, keyed by file path and modification time, so
+    that each template is only compiled once for all the minions
+    '''
+    def _stat(self, template):
+        '''
+        Returns the path and stat result of the template, Nones if not found
+        '''
+        pieces = split_template_path(template)
+        for searchpath in self.searchpath:
+            filename = os.path.join(searchpath, *pieces)
+            try:
+                status = os.stat(filename)
+            except OSError:
+                continue
+            if stat.S_ISREG(status.st_mode):
+                return filename, status
+        return None, None
+
+    def load(self, environment, name, globals=None):
+        '''
+        Loads the template, compiling its source only if it is not cached
+        '''
+        if globals is None:
+            globals = {}
+        filename, status = self._stat(name)
+        if filename is None:
+            # raises TemplateNotFound
+            self.get_source(environment, name)
+        key = (filename, status.st_mtime, status.st_size)
+        code = _template_cache.get(key)
+        if code is None:
+            source, filename, _ = self.get_source(environment, name)
+            code = environment.compile(source, name, filename)
+            _template_cache.put(key, code)
+
+        def uptodate():
+            try:
+                return os.path.getmtime(filename) == status.st_mtime
+            except OSError:
+                return False
+        return environment.template_class.from_code(environment, code, globals,
+                                                    uptodate)
+
+
+class _StackProfile(object):
+    '''
+    Time spent rendering, parsing and merging every stack file of a minion
+    pillar compilation
+    '''
+    _lock = threading.Lock()
+
+    def __init__(self, minion_id):
+        self.minion_id = minion_id
+        self.files = []
+        self.missing = 0
+        self.start = time.time()
+
+    def stack_file(self, cfg, path):
+        '''
+        Returns the timings of a stack file, to be filled in by _timed
+        '''
+        timings = {'cfg': cfg, 'path': path, 'render': 0.0, 'parse': 0.0,
+                   'merge': 0.0, 'cached': False}
+        self.files.append(timings)
+        return timings
+
+    def report(self, stats_file=None):
+        '''
+        Logs the totals and appends the per-file timings to stats_file
+        '''
+        total = time.time() - self.start
+        sums = dict((phase, sum(f[phase] for f in self.files))
+                    for phase in ('render', 'parse', 'merge'))
+        slowest = None
+        if self.files:
+            slowest = max(self.files,
+                          key=lambda f: f['render'] + f['parse'] + f['merge'])
+            slowest = '{0} ({1:.3f}s)'.format(
+                slowest['path'],
+                slowest['render'] + slowest['parse'] + slowest['merge'])
+        log.info('Pillar stack profile of {0}: total={1:.3f}s render={2:.3f}s '
+                 'parse={3:.3f}s merge={4:.3f}s files={5} missing templates={6} '
+                 'slowest={7}'.format(
+                     self.minion_id, total, sums['render'], sums['parse'],
+                     sums['merge'], len(self.files), self.missing, slowest))
+        if not stats_file:
+            return
+        record = {'minion': self.minion_id, 'start': self.start, 'total': total,
+                  'missing': self.missing, 'files': self.files}
+        record.update(sums)
+        line = json.dumps(record, sort_keys=True) + '\n'
+        try:
+            with self._lock:
+                with open(stats_file, 'a') as stats:
+                    stats.write(line)
+        except (IOError, OSError) as error:
+            log.warning('Cannot write pillar stack profile to "{0}": {1}'.format(
+                stats_file, error))
+
+
+@contextmanager
+def _timed(timings, phase):
+    '''
+    Adds the time spent in the block to the phase of timings
+    '''
+    if timings is None:
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        timings[phase] += time.time() - start
+
+
+def _load_yaml(content):
+    '''
+    Parses a rendered stack file and strips its merging strategy markers,
+    documents rendered identically for several minions are only parsed once.
+    The returned objects are shared and must not be modified.
+
+    Returns a ``(obj, strategies)`` tuple, see ``_strip_strategies``.
+    '''
+    key = hashlib.sha1(content.encode('utf-8')).hexdigest()
+    parsed = _yaml_cache.get(key)
+    if parsed is None:
+        obj = yaml.safe_load(content)
+        parsed = (obj, _strip_strategies(obj) if isinstance(obj, dict) else None)
+        _yaml_cache.put(key, parsed)
+    return parsed
+
 
 def ext_pillar(minion_id, pillar, *args, **kwargs):
-    import salt.utils
+    try:
+        from salt.utils.data import traverse_dict_and_list
+    except ImportError:
+        from salt.utils import traverse_dict_and_list
     stack = {}
+    profile = None
+    if __opts__.get('pillar_stack_profile'):
+        profile = _StackProfile(minion_id)
     stack_config_files = list(args)
     traverse = {
-        'pillar': partial(salt.utils.traverse_dict_and_list, pillar),
-        'grains': partial(salt.utils.traverse_dict_and_list, __grains__),
-        'opts': partial(salt.utils.traverse_dict_and_list, __opts__),
+        'pillar': partial(traverse_dict_and_list, pillar),
+        'grains': partial(traverse_dict_and_list, __grains__),
+        'opts': partial(traverse_dict_and_list, __opts__),
         }
     for matcher, matchs in six.iteritems(kwargs):
         t, matcher = matcher.split(':', 1)
@@ -399,14 +663,19 @@ def ext_pillar(minion_id, pillar, *args, **kwargs):
             log.warning('Ignoring pillar stack cfg "{0}": '
                      'file does not exist'.format(cfg))
             continue
-        stack = _process_stack_cfg(cfg, stack, minion_id, pillar)
+        stack = _process_stack_cfg(cfg, stack, minion_id, pillar, profile)
+    if profile is not None:
+        profile.report(__opts__.get('pillar_stack_profile_file'))
+    log.debug(_template_cache.stats())
+    log.debug(_yaml_cache.stats())
+    log.debug(_layer_cache.stats())
     return stack
 
 
-def _process_stack_cfg(cfg, stack, minion_id, pillar):
+def _process_stack_cfg(cfg, stack, minion_id, pillar, profile=None):
     log.debug('Config: {0}'.format(cfg))
     basedir, filename = os.path.split(cfg)
-    jenv = Environment(loader=FileSystemLoader(basedir))
+    jenv = Environment(loader=_CachingFileSystemLoader(basedir))
     jenv.globals.update({
         "__opts__": __opts__,
         "__salt__": __salt__,
@@ -414,19 +683,56 @@ def _process_stack_cfg(cfg, stack, minion_id, pillar):
         "minion_id": minion_id,
         "pillar": pillar,
         })
-    for path in _parse_stack_cfg(jenv.get_template(filename).render(stack=stack)):
+    # The merged stack of every layer prefix is identified by the hash of the
+    # rendered layers. Prefixes shared by several minions, typically the
+    # global, cluster and role layers, are only merged once. Merging never
+    # modifies its arguments, so the cached stacks are shared as they are.
+    # Layers merged into a non-empty stack are not memoized. The templates get
+    # a copy of the stack, a template modifying it would corrupt the caches.
+    prefix = '' if not stack else None
+    timings = profile.stack_file(cfg, filename) if profile is not None else None
+    with _timed(timings, 'render'):
+        paths = _parse_stack_cfg(jenv.get_template(filename).render(
+            stack=_copy_tree(stack)))
+    for path in paths:
+        timings = None
+        if profile is not None and path.strip():
+            timings = profile.stack_file(cfg, path)
         try:
             log.debug('YAML: basedir={0}, path={1}'.format(basedir, path))
-            obj = yaml.safe_load(jenv.get_template(path).render(stack=stack))
+            with _timed(timings, 'render'):
+                content = jenv.get_template(path).render(stack=_copy_tree(stack))
+            if prefix is not None:
+                prefix = hashlib.sha1(u'{0}\0{1}\0{2}'.format(
+                    prefix, path, content).encode('utf-8')).hexdigest()
+                cached = _layer_cache.get(prefix)
+                if cached is not None:
+                    stack = cached
+                    if timings is not None:
+                        timings['cached'] = True
+                    continue
+            with _timed(timings, 'parse'):
+                obj, obj_strategies = _load_yaml(content)
             log.debug('obj: {0}'.format(obj))
             
             if not isinstance(obj, dict):
                 log.info('Ignoring pillar stack template "{0}": Can\'t parse '
                          'as a valid yaml dictionary'.format(path))
                 continue
-            stack = _merge_dict(stack, obj)
+            with _timed(timings, 'merge'):
+                stack = _merge_dict(stack, obj, obj_strategies)
             log.debug('stack: {0}'.format(stack))
+            if prefix is not None:
+                # a prefix is only memoized the second time it is merged, so
+                # that the minion specific prefixes don't evict shared ones
+                if _seen_prefixes.get(prefix):
+                    _layer_cache.put(prefix, stack)
+                else:
+                    _seen_prefixes.put(prefix, True)
         except TemplateNotFound as e:
+            if timings is not None:
+                profile.missing += 1
+                profile.files.pop()
             if hasattr(e, 'name') and e.name != path:
                 log.info('Jinja include file "{0}" not found '
                          'from root dir "{1}", which was included '
@@ -436,67 +742,123 @@ def _process_stack_cfg(cfg, stack, minion_id, pillar):
                 log.info('Ignoring pillar stack template "{0}": can\'t find from '
                          'root dir "{1}"'.format(path, basedir))
             continue
-    return stack
+    # the merged stack shares its subtrees with the caches
+    return _copy_tree(stack)
+
 
+_IMMUTABLE_TYPES = six.string_types + six.integer_types + (float, bool, type(None))
 
-def _cleanup(obj):
-    if obj:
-        if isinstance(obj, dict):
-            obj.pop('__', None)
-            for k, v in six.iteritems(obj):
-                obj[k] = _cleanup(v)
-        elif isinstance(obj, list) and isinstance(obj[0], dict) \
-                and '__' in obj[0]:
+
+def _copy_tree(obj):
+    '''
+    Copies the dicts and lists of obj, sharing its immutable values
+    '''
+    if isinstance(obj, dict):
+        return dict((k, _copy_tree(v)) for k, v in six.iteritems(obj))
+    elif isinstance(obj, list):
+        return [_copy_tree(item) for item in obj]
+    elif isinstance(obj, _IMMUTABLE_TYPES):
+        return obj
+    return copy.deepcopy(obj)
+
+
+def _strip_strategies(obj):
+    '''
+    Removes, in place, the ``__`` merging strategy markers of a parsed dict and
+    of its dict and list values. Like the markers, the list items are left
+    untouched.
+
+    Returns the strategies tree, ``None`` if there is no marker in ``obj``,
+    otherwise a ``(strategy, children)`` tuple, where ``children`` maps the keys
+    of ``obj`` to the strategies tree of their value.
+    '''
+    if isinstance(obj, dict):
+        strategy = obj.pop('__', None) if '__' in obj else 'merge-last'
+        children = {}
+        for key, value in six.iteritems(obj):
+            child = _strip_strategies(value)
+            if child is not None:
+                children[key] = child
+        if strategy == 'merge-last' and not children:
+            return None
+        return (strategy, children)
+    elif isinstance(obj, list):
+        if obj and isinstance(obj[0], dict) and '__' in obj[0]:
+            strategy = obj[0]['__']
             del obj[0]
-    return obj
+            return (strategy, None)
+    return None
 
 
-def _merge_dict(stack, obj):
-    strategy = obj.pop('__', 'merge-last')
+def _check_strategy(strategy):
+    '''
+    Raises an exception if strategy is not a known merging strategy
+    '''
     if strategy not in strategies:
         raise Exception('Unknown strategy "{0}", should be one of {1}'.format(
             strategy, strategies))
-    if strategy == 'overwrite':
-        return _cleanup(obj)
-    else:
-        for k, v in six.iteritems(obj):
-            if strategy == 'remove':
-                stack.pop(k, None)
-                continue
-            if k in stack:
-                if strategy == 'merge-first':
-                    # merge-first is same as merge-last but the other way round
-                    # so let's switch stack[k] and v
-                    stack_k = stack[k]
-                    stack[k] = _cleanup(v)
-                    v = stack_k
-                if type(stack[k]) != type(v):
-                    log.debug('Force overwrite, types differ: '
-                              '\'{0}\' != \'{1}\''.format(stack[k], v))
-                    stack[k] = _cleanup(v)
-                elif isinstance(v, dict):
-                    stack[k] = _merge_dict(stack[k], v)
-                elif isinstance(v, list):
-                    stack[k] = _merge_list(stack[k], v)
-                else:
-                    stack[k] = v
-            else:
-                stack[k] = _cleanup(v)
-        return stack
 
 
-def _merge_list(stack, obj):
-    strategy = 'merge-last'
-    if obj and isinstance(obj[0], dict) and '__' in obj[0]:
-        strategy = obj[0]['__']
-        del obj[0]
-    if strategy not in strategies:
-        raise Exception('Unknown strategy "{0}", should be one of {1}'.format(
-            strategy, strategies))
+def _merge_dict(stack, obj, obj_strategies=None):
+    '''
+    Merges ``obj`` into ``stack`` without modifying them, the returned dict
+    shares the unchanged subtrees of both.
+    '''
+    strategy, children = obj_strategies or ('merge-last', None)
+    _check_strategy(strategy)
+    if strategy == 'overwrite':
+        return obj
+    merged = dict(stack)
+    if strategy == 'remove':
+        for k in obj:
+            merged.pop(k, None)
+        return merged
+    for k, v in six.iteritems(obj):
+        if k not in merged:
+            merged[k] = v
+            continue
+        child = children.get(k) if children else None
+        stack_k = merged[k]
+        if strategy == 'merge-first':
+            # merge-first is same as merge-last but the other way round
+            # so let's switch stack[k] and v
+            stack_k, v, child = v, stack_k, None
+        if type(stack_k) != type(v):
+            log.debug('Force overwrite, types differ: '
+                      '\'{0}\' != \'{1}\''.format(stack_k, v))
+            merged[k] = v
+        elif isinstance(v, dict):
+            merged[k] = _merge_dict(stack_k, v, child)
+        elif isinstance(v, list):
+            merged[k] = _merge_list(stack_k, v, child)
+        else:
+            merged[k] = v
+    return merged
+
+
+def _merge_list(stack, obj, obj_strategies=None):
+    '''
+    Merges ``obj`` into ``stack`` without modifying them
+    '''
+    strategy = obj_strategies[0] if obj_strategies else 'merge-last'
+    _check_strategy(strategy)
     if strategy == 'overwrite':
         return obj
     elif strategy == 'remove':
-        return [item for item in stack if item not in obj]
+        hashable = set()
+        unhashable = []
+        for item in obj:
+            try:
+                hashable.add(item)
+            except TypeError:
+                unhashable.append(item)
+
+        def removed(item):
+            try:
+                return item in hashable
+            except TypeError:
+                return item in unhashable
+        return [item for item in stack if not removed(item)]
     elif strategy == 'merge-first':
         return obj + stack
     else:
@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+# pylint: disable=modernize-parse-error
+#
+# The salt-api calls functions with keywords that are not needed
+# pylint: disable=unused-argument
+"""
+Compiles the pillar of the DeepSea minions on the master, a few minions at a
+time, and stores the results in Salt's pillar cache and in the minion data
+cache of the master.
+
+After push.proposal, the first pillar refresh, state or orchestration triggers
+an on-demand pillar compilation for every minion at once, which overloads the
+master.  The master only serves pillars from its pillar cache when it is
+enabled in /etc/salt/master:
+
+    pillar_cache: True
+    pillar_cache_backend: disk
+
+Warming the cache in a bounded number of worker processes then spreads the
+load.  Without pillar_cache, the warm-up would only compile every pillar once
+more, so it does nothing unless force=True is given, which only refreshes the
+cached pillars used for targeting.
+"""
+
+from __future__ import absolute_import
+from __future__ import print_function
+from __future__ import division
+import logging
+import os
+import time
+from multiprocessing import Process, Queue
+from six.moves.queue import Empty
+import yaml
+# pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin
+import salt.cache
+import salt.pillar
+import salt.utils.minions
+
+log = logging.getLogger(__name__)
+
+DEEPSEA_MINIONS = '/srv/pillar/ceph/deepsea_minions.sls'
+
+
+def help_():
+    """
+    Usage
+    """
+    usage = ('salt-run pillarcache.warm:\n'
+             'salt-run pillarcache.warm target=target workers=8:\n'
+             'salt-run pillarcache.warm force=True:\n\n'
+             '    Compiles the pillar of the deepsea_minions, or of the targeted\n'
+             '    minions, and stores it in the pillar cache and the minion data\n'
+             '    cache.  Does nothing unless pillar_cache is enabled in the master\n'
+             '    configuration, or force=True is given.\n'
+             '\n\n')
+    print(usage)
+    return ""
+
+
+def _deepsea_minions():
+    """
+    Returns the deepsea_minions target without refreshing the pillar of every
+    minion, which is what warming the cache avoids
+    """
+    if not os.path.exists(DEEPSEA_MINIONS):
+        return None
+    with open(DEEPSEA_MINIONS, 'r') as sls:
+        content = yaml.safe_load(sls)
+    if isinstance(content, dict):
+        return content.get('deepsea_minions')
+    return None
+
+
+def _targeted(target):
+    """
+    Resolves the compound target with the cached grains and pillar
+    """
+    minions = salt.utils.minions.CkMinions(__opts__).check_minions(
+        target, tgt_type='compound')
+    if isinstance(minions, dict):
+        minions = minions['minions']
+    return sorted(minions)
+
+
+def _clear_pillar_cache(compiler, minion):
+    """
+    Removes the cached pillar of a minion from Salt's pillar cache, whose API
+    differs between Salt releases
+    """
+    if hasattr(compiler, 'clear_pillar'):
+        compiler.clear_pillar()
+    elif minion in compiler.cache:
+        del compiler.cache[minion]
+
+
+def _compile(minion, saltenv, pillarenv):
+    """
+    Compiles the pillar of a minion and stores it in the pillar cache, if
+    enabled, and in the minion data cache
+    """
+    start = time.time()
+    _, grains, _ = salt.utils.minions.get_minion_data(minion, __opts__)
+    if not grains:
+        return {'minion': minion, 'time': time.time() - start,
+                'errors': ['no cached grains']}
+    if __opts__.get('pillar_cache'):
+        # the pillar cache compiles and stores the pillar on a cache miss
+        compiler = salt.pillar.PillarCache(__opts__, grains, minion, saltenv,
+                                           pillarenv=pillarenv)
+        _clear_pillar_cache(compiler, minion)
+    else:
+        compiler = salt.pillar.Pillar(__opts__, grains, minion, saltenv,
+                                      pillarenv=pillarenv)
+    pillar = compiler.compile_pillar()
+    errors = pillar.get('_errors', [])
+    if errors and __opts__.get('pillar_cache'):
+        # let the master compile it again on demand
+        _clear_pillar_cache(compiler, minion)
+    if not errors and __opts__.get('minion_data_cache', True):
+        salt.cache.factory(__opts__).store('minions/{}'.format(minion), 'data',
+                                           {'grains': grains, 'pillar': pillar})
+    return {'minion': minion, 'time': time.time() - start, 'errors': errors}
+
+
+def _worker(minions, results, saltenv, pillarenv):
+    """
+    Compiles the pillars of the queued minions until it gets None
+    """
+    while True:
+        minion = minions.get()
+        if minion is None:
+            break
+        try:
+            results.put(_compile(minion, saltenv, pillarenv))
+        # pylint: disable=broad-except
+        except Exception as error:
+            log.exception("failed to compile the pillar of {}".format(minion))
+            results.put({'minion': minion, 'time': 0.0, 'errors': [str(error)]})
+
+
+def _collect(results, workers, count):
+    """
+    Returns the results posted by the workers, and stops waiting when every
+    worker has exited, even if a worker died without posting its results
+    """
+    collected = []
+    exited = False
+    while len(collected) < count:
+        try:
+            collected.append(results.get(timeout=1))
+            exited = False
+        except Empty:
+            if any(worker.is_alive() for worker in workers):
+                continue
+            if exited:
+                break
+            # the last results of the exited workers may still be in transit
+            exited = True
+    return collected
+
+
+def warm(**kwargs):
+    """
+    Compiles the pillar of every targeted minion in a pool of worker processes
+    and stores it in the pillar cache and the minion data cache.  Returns the
+    compilation time of every minion and the errors, which do not fail the
+    result.
+    """
+    settings = {
+                 'target': None,
+                 'workers': 8,
+                 'saltenv': 'base',
+                 'pillarenv': None,
+                 'force': False,
+               }
+    settings.update(kwargs)
+
+    if not __opts__.get('pillar_cache') and not settings['force']:
+        log.info("pillar_cache is disabled, the master does not serve warmed pillars")
+        return {'result': True,
+                'comment': "pillar_cache is disabled, nothing to warm"}
+
+    target = settings['target'] or _deepsea_minions()
+    if not target:
+        log.error("deepsea_minions is not set")
+        return {'result': False, 'comment': "deepsea_minions is not set"}
+    if not __opts__.get('minion_data_cache', True):
+        log.warning("minion_data_cache is disabled, compiled pillars are not stored")
+
+    minions = _targeted(target)
+    start = time.time()
+    queue = Queue()
+    results = Queue()
+    for minion in minions:
+        queue.put(minion)
+    workers = []
+    try:
+        for _ in range(max(1, min(int(settings['workers']), len(minions)))):
+            worker = Process(target=_worker,
+                             args=(queue, results, settings['saltenv'], settings['pillarenv']))
+            worker.start()
+            workers.append(worker)
+    except (AssertionError, OSError):
+        # daemonic processes are not allowed to have children
+        log.warning("Cannot start {} workers, compiling serially".format(settings['workers']))
+    for _ in workers:
+        queue.put(None)
+    if not workers:
+        queue.put(None)
+        _worker(queue, results, settings['saltenv'], settings['pillarenv'])
+
+    timings = {}
+    errors = {}
+    for result in _collect(results, workers, len(minions)):
+        timings[result['minion']] = round(result['time'], 3)
+        if result['errors']:
+            errors[result['minion']] = result['errors']
+            log.error("pillar of {} failed: {}".format(result['minion'], result['errors']))
+    for minion in minions:
+        if minion not in timings:
+            errors[minion] = ['worker exited without compiling the pillar']
+            log.error("pillar of {} was not compiled, its worker exited".format(minion))
+    for worker in workers:
+        worker.join()
+
+    # The warm-up is optional, a minion whose pillar fails to compile must not
+    # fail the stage running it
+    times = sorted(timings.values())
+    return {
+        'result': True,
+        'minions': len(minions),
+        'compiled': len(minions) - len(errors),
+        'errors': errors,
+        'elapsed': round(time.time() - start, 3),
+        'p50': times[len(times) // 2] if times else 0.0,
+        'max': times[-1] if times else 0.0,
+        'timings': timings,
+    }
+
+
+__func_alias__ = {
+                 'help_': 'help',
+                 }
@@ -51,26 +51,34 @@ from __future__ import absolute_import
 from __future__ import print_function
 import os
 import errno
+import fnmatch
 import glob
+import hashlib
 import logging
+import multiprocessing
 import re
 import shutil
+import stat
 import sys
 import yaml
 sys.path.append('/srv/modules/pillar')
 # pylint: disable=import-error,3rd-party-module-not-gated,redefined-builtin,wrong-import-position
 import salt.ext.six as six
-from stack import _merge_dict
+from stack import _merge_dict, _strip_strategies
 
 
 log = logging.getLogger(__name__)
 
+# below this number of files, the proposals are parsed and dumped serially
+PARALLEL_THRESHOLD = 200
+
 
 def help_():
     """
     Usage
     """
-    usage = ('salt-run push.proposal:\n\n'
+    usage = ('salt-run push.proposal:\n'
+             'salt-run push.proposal workers=4:\n\n'
              '    Reads the policy.cfg and generates the Salt configuration\n'
              '\n\n'
              'salt-run push.convert:\n\n'
@@ -80,18 +88,22 @@ def help_():
     return ""
 
 
-def proposal(filename="/srv/pillar/ceph/proposals/policy.cfg", dryrun=False):
+def proposal(filename="/srv/pillar/ceph/proposals/policy.cfg", dryrun=False, workers=None):
     """
     Read the passed filename, organize the files with common subdirectories
-    and output the merged contents into the pillar.
+    and output the merged contents into the pillar.  Only the files whose
+    contents changed are rewritten.  Returns the changed and removed files,
+    and the number of unchanged files.
+
+    The proposal files are parsed and the results dumped by a pool of
+    worker processes, one per CPU by default.
     """
     if not os.path.isfile(filename):
         log.warning("{} is missing - nothing to push".format(filename))
         return True
     pillar_data = PillarData(dryrun)
     common = pillar_data.organize(filename)
-    pillar_data.output(common)
-    return True
+    return pillar_data.output(common, workers)
 
 
 def organize(filename="/srv/pillar/ceph/proposals/policy.cfg"):
@@ -160,21 +172,36 @@ class PillarData(object):
         self.dryrun = dryrun
 
         # Keep yaml human readable/editable
-        self.friendly_dumper = yaml.SafeDumper
-        self.friendly_dumper.ignore_aliases = lambda self, data: True
+        self.friendly_dumper = _FriendlyDumper
 
-    def output(self, common):
+    def output(self, common, workers=None):
         """
         Write the merged YAML files to the correct locations,
         /srv/pillar/ceph/cluster and /srv/pillar/ceph/stack/default.
-        """
-
-        self._clean()
 
-        for pathname in common.keys():
-            merged = _merge(pathname, common)
+        Files are only rewritten when their contents change, so that the
+        pillar caches and file modification times of the others stay valid.
+        Every proposal file is parsed once, even when several pathnames or
+        policy lines include it.
+        """
+        sources = []
+        for pathname in common:
+            sources.extend(common[pathname])
+        sources = sorted(set(sources))
+        contents = dict(zip(sources, _map(_load, sources, workers)))
+        pathnames = sorted(common)
+        merged_contents = [_merge(pathname, common, contents) for pathname in pathnames]
+        dumped_contents = _map(_dump, merged_contents, workers)
+
+        summary = {'changed': [], 'unchanged': 0, 'removed': []}
+        filenames = set()
+        for pathname, merged, dumped in zip(pathnames, merged_contents, dumped_contents):
             filename = self.pillar_dir + "/" + pathname
-            self._default(filename, merged)
+            filenames.add(filename)
+            if self._default(filename, dumped):
+                summary['changed'].append(filename)
+            else:
+                summary['unchanged'] += 1
 
             if pathname.startswith("cluster"):
                 # Use the entire list of minions under cluster to populate
@@ -192,6 +219,10 @@ class PillarData(object):
                 custom = self.pillar_dir + "/" + default_path
                 self._custom(custom)
 
+        summary['removed'] = self._clean(filenames)
+        summary['changed'].sort()
+        return summary
+
     def convert(self, common):
         """
         Process all hardware profiles
@@ -210,28 +241,41 @@ class PillarData(object):
                                   Dumper=self.friendly_dumper,
                                   default_flow_style=False))
 
-    def _clean(self):
+    def _clean(self, filenames):
         """
-        Remove the stack/default tree to remove any leftover files from a
-        previous removal
+        Remove the files of the stack/default tree that are not part of the
+        output anymore, such as leftover files from a previous removal, and
+        the directories left empty
         """
+        removed = []
         stack_default = "{}/stack/default".format(self.pillar_dir)
-        if os.path.isdir(stack_default):
-            shutil.rmtree(stack_default)
-
-    def _default(self, filename, merged):
+        for path_dir, _, files in os.walk(stack_default, topdown=False):
+            for name in files:
+                filename = os.path.join(path_dir, name)
+                if filename not in filenames:
+                    log.info("Removing {}".format(filename))
+                    removed.append(filename)
+                    if not self.dryrun:
+                        os.remove(filename)
+            if not self.dryrun and path_dir != stack_default and not os.listdir(path_dir):
+                os.rmdir(path_dir)
+        return sorted(removed)
+
+    def _default(self, filename, content):
         """
-        Output the merged contents to the default tree
+        Output the dumped merged contents to the default tree, unless the
+        file already has the same contents.  Returns whether the file changed.
         """
         path_dir = os.path.dirname(filename)
         if not os.path.isdir(path_dir):
             _create_dirs(path_dir, self.pillar_dir)
+        if _file_digest(filename) == hashlib.sha256(content).hexdigest():
+            log.debug("Unchanged {}".format(filename))
+            return False
         log.info("Writing {}".format(filename))
         if not self.dryrun:
-            with open(filename, "w") as yml:
-                yml.write(yaml.dump(merged,
-                          Dumper=self.friendly_dumper,
-                          default_flow_style=False))
+            _atomic_write(filename, content)
+        return True
 
     def _custom(self, custom):
         """
@@ -259,6 +303,7 @@ class PillarData(object):
         Associate all filenames with their common subdirectory.
         """
         common = {}
+        index = _DirectoryIndex()
         with open(policy_filename, "r") as policy:
             for line in policy:
                 log.debug(line)
@@ -269,7 +314,7 @@ class PillarData(object):
                     log.debug("Ignoring '{}'".format(line))
                     continue
                 try:
-                    proposal_files = _parse(self.proposals_dir + "/" + line)
+                    proposal_files = _parse(self.proposals_dir + "/" + line, index)
                 except ValueError:
                     log.exception('''
                     ERROR: Mailformed {}: {}
@@ -280,10 +325,11 @@ class PillarData(object):
                 log.debug(line)
                 log.debug(proposal_files)
                 for proposal_file in proposal_files:
-                    if os.stat(proposal_file).st_size == 0:
+                    status = index.stat(proposal_file)
+                    if status.st_size == 0:
                         log.warning("Skipping empty file {}".format(proposal_file))
                         continue
-                    if os.path.isfile(proposal_file):
+                    if stat.S_ISREG(status.st_mode):
                         pathname = _shift_dir(proposal_file.replace(
                                               self.proposals_dir, ""))
                         if pathname not in common:
@@ -301,6 +347,147 @@ class PillarData(object):
         return common
 
 
+class _FriendlyDumper(yaml.SafeDumper):
+    """
+    Never write anchors and aliases, to keep the yaml human readable/editable
+    """
+    # pylint: disable=unused-argument
+    def ignore_aliases(self, data):
+        return True
+
+
+class _DirectoryIndex(object):
+    """
+    Lists the directories of the proposals tree and stats the files once
+    while the policy.cfg is organized, instead of once for every policy line
+    """
+
+    def __init__(self):
+        self.listings = {}
+        self.status = {}
+
+    def _listdir(self, path):
+        """
+        Return the sorted names of the directory, None if it is not one
+        """
+        if path not in self.listings:
+            try:
+                self.listings[path] = sorted(os.listdir(path))
+            except OSError:
+                self.listings[path] = None
+        return self.listings[path]
+
+    def glob(self, pattern):
+        """
+        Return the sorted paths matching the pattern, like glob.glob
+        """
+        parts = pattern.split('/')
+        if parts[0] or '' in parts[1:] or '.' in parts or '..' in parts:
+            return sorted(glob.glob(pattern))
+        paths = ['']
+        for idx, part in enumerate(parts[1:], 1):
+            if not glob.has_magic(part) and idx < len(parts) - 1:
+                # checked by the listing of the next directory
+                paths = [path + '/' + part for path in paths]
+                continue
+            matched = []
+            for path in paths:
+                names = self._listdir(path or '/')
+                if names is None:
+                    continue
+                if glob.has_magic(part):
+                    names = fnmatch.filter(names, part)
+                    if not part.startswith('.'):
+                        names = [name for name in names if not name.startswith('.')]
+                elif part in names:
+                    names = [part]
+                else:
+                    names = []
+                matched.extend(path + '/' + name for name in names)
+            paths = matched
+        return paths
+
+    def stat(self, path):
+        """
+        Return the cached os.stat of the path
+        """
+        if path not in self.status:
+            self.status[path] = os.stat(path)
+        return self.status[path]
+
+
+def _map(func, items, workers=None):
+    """
+    Return the results of func for every item, computed in a pool of worker
+    processes unless there are too few items to pay for starting it
+    """
+    if workers is None:
+        workers = multiprocessing.cpu_count()
+    workers = min(int(workers), len(items))
+    if workers < 2 or len(items) < PARALLEL_THRESHOLD:
+        return [func(item) for item in items]
+    try:
+        pool = multiprocessing.Pool(workers)
+    except (AssertionError, OSError):
+        # daemonic processes are not allowed to have children
+        log.warning("Cannot start {} workers, running serially".format(workers))
+        return [func(item) for item in items]
+    try:
+        return pool.map(func, items, chunksize=max(1, len(items) // (workers * 4)))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def _load(filename):
+    """
+    Parse a proposal file and strip its merging strategy markers
+    """
+    with open(filename, "r") as content:
+        content = yaml.safe_load(content)
+    return content, _strip_strategies(content)
+
+
+def _dump(merged):
+    """
+    Dump the merged contents of an output file
+    """
+    content = yaml.dump(merged, Dumper=_FriendlyDumper, default_flow_style=False)
+    if isinstance(content, six.text_type):
+        content = content.encode('utf-8')
+    return content
+
+
+def _file_digest(filename):
+    """
+    Return the SHA-256 digest of the file contents, None if it does not exist
+    """
+    try:
+        with open(filename, "rb") as existing:
+            return hashlib.sha256(existing.read()).hexdigest()
+    except IOError as err:
+        if err.errno == errno.ENOENT:
+            return None
+        raise
+
+
+def _atomic_write(filename, content):
+    """
+    Write to a temporary file renamed over the destination, so that readers
+    never see a partially written file
+    """
+    path_dir, name = os.path.split(filename)
+    tmp_filename = "{}/.{}.{}.tmp".format(path_dir, name, os.getpid())
+    try:
+        with open(tmp_filename, "wb") as tmp:
+            tmp.write(content)
+        os.rename(tmp_filename, filename)
+    except (IOError, OSError):
+        if os.path.exists(tmp_filename):
+            os.remove(tmp_filename)
+        raise
+
+
 def _migrate(yml, filename):
     """
     Migrate the original data structure to the ceph namespace data
@@ -372,26 +559,29 @@ def _examples(custom, yml):
         yml.write(text)
 
 
-def _merge(pathname, common):
+def _merge(pathname, common, contents=None):
     """
-    Merge the files via stack.py
+    Merge the files via stack.py, the parsed files are taken from contents
+    when present.  The merged contents share objects with them.
     """
     merged = {}
     for filename in common[pathname]:
-        with open(filename, "r") as content:
-            content = yaml.safe_load(content)
-            # pylint: disable=protected-access
-            merged = _merge_dict(merged, content)
+        if contents is not None and filename in contents:
+            content, strategies = contents[filename]
+        else:
+            content, strategies = _load(filename)
+        merged = _merge_dict(merged, content, strategies)
     return merged
 
 
-def _parse(line):
+def _parse(line, index=None):
     """
     Return globbed files constrained by optional slices or regexes.
     """
+    glob_ = index.glob if index is not None else glob.glob
     if " " in line:
         parts = re.split(r'\s+', line)
-        files = sorted(glob.glob(parts[0]))
+        files = sorted(glob_(parts[0]))
         for optional in parts[1:]:
             filter_type, value = optional.split('=')
             if filter_type == "re":
@@ -404,7 +594,7 @@ def _parse(line):
                 log.warning("keyword {} unsupported".format(filter_type))
 
     else:
-        files = glob.glob(line)
+        files = glob_(line)
     return files
 
 
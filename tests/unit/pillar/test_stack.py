@@ -0,0 +1,340 @@
+import copy
+import json
+import os
+import random
+import sys
+import pytest
+from mock import patch
+from six.moves import reload_module
+sys.path.insert(0, 'srv/modules/pillar')
+import stack
+
+
+STACK_CFG = """
+global.yml
+{{ pillar.get('cluster') }}/cluster.yml
+{% for role in pillar.get('roles', []) %}
+{{ pillar.get('cluster') }}/roles/{{ role }}.yml
+{% endfor %}
+{{ pillar.get('cluster') }}/minions/{{ minion_id }}.yml
+missing.yml
+"""
+
+
+@pytest.fixture
+def stack_dir(tmpdir):
+    tmpdir.join('stack.cfg').write(STACK_CFG)
+    tmpdir.join('global.yml').write('time_server: ntp\nlist:\n  - a\n')
+    tmpdir.mkdir('ceph').join('cluster.yml').write('fsid: 1234\n'
+                                                   'mine: {{ minion_id }}\n')
+    tmpdir.join('ceph').mkdir('roles').join('mon.yml').write('list:\n  - mon\n')
+    minions = tmpdir.join('ceph').mkdir('minions')
+    for minion in ['node1', 'node2']:
+        minions.join('{}.yml'.format(minion)).write('public_address: {}\n'.format(minion))
+    stack.__opts__ = {}
+    stack.__salt__ = {}
+    stack.__grains__ = {}
+    stack.clear_caches()
+    yield tmpdir
+    stack.clear_caches()
+
+
+class TestStackCache():
+
+    def _compile(self, stack_dir, minion):
+        pillar = {'cluster': 'ceph', 'roles': ['mon']}
+        return stack._process_stack_cfg(str(stack_dir.join('stack.cfg')), {}, minion, pillar)
+
+    def test_compile(self, stack_dir):
+        result = self._compile(stack_dir, 'node1')
+        assert result == {'time_server': 'ntp', 'list': ['a', 'mon'], 'fsid': 1234,
+                          'mine': 'node1', 'public_address': 'node1'}
+
+    def test_templates_compiled_once(self, stack_dir):
+        self._compile(stack_dir, 'node1')
+        misses = stack._template_cache.misses
+        result = self._compile(stack_dir, 'node2')
+        # only the minion file of node2 is compiled
+        assert stack._template_cache.misses == misses + 1
+        assert result['mine'] == 'node2'
+        assert result['public_address'] == 'node2'
+
+    def test_template_modified(self, stack_dir):
+        self._compile(stack_dir, 'node1')
+        global_yml = stack_dir.join('global.yml')
+        global_yml.write('time_server: other_ntp_server\n')
+        os.utime(str(global_yml), (0, 0))
+        result = self._compile(stack_dir, 'node1')
+        assert result['time_server'] == 'other_ntp_server'
+
+    def test_identical_yaml_parsed_once(self, stack_dir):
+        with patch('yaml.safe_load', wraps=stack.yaml.safe_load) as safe_load:
+            self._compile(stack_dir, 'node1')
+            first = safe_load.call_count
+            self._compile(stack_dir, 'node2')
+            # cluster.yml and the minion file render differently, global.yml and
+            # the role file are only parsed once, the stack.cfg is always parsed
+            assert safe_load.call_count - first == 3
+
+    def test_cached_yaml_not_mutated_by_merge(self, stack_dir):
+        first = self._compile(stack_dir, 'node1')
+        first['list'].append('changed')
+        second = self._compile(stack_dir, 'node1')
+        assert second['list'] == ['a', 'mon']
+
+    def test_lru_eviction(self):
+        cache = stack._LRUCache('test', 2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        assert cache.get('a') == 1
+        cache.put('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        assert cache.get('c') == 3
+        assert len(cache) == 2
+        assert cache.hits == 3
+        assert cache.misses == 1
+        assert 'hit rate=75.0%' in cache.stats()
+
+
+class TestStackLayerCache():
+
+    def _compile(self, stack_dir, minion, roles=('mon',)):
+        pillar = {'cluster': 'ceph', 'roles': list(roles)}
+        return stack._process_stack_cfg(str(stack_dir.join('stack.cfg')), {}, minion, pillar)
+
+    def test_shared_prefix_merged_once(self, stack_dir):
+        stack_dir.join('ceph', 'cluster.yml').write('fsid: 1234\n')
+        self._compile(stack_dir, 'node1')
+        self._compile(stack_dir, 'node2')
+        hits = stack._layer_cache.hits
+        with patch.object(stack, '_merge_dict', wraps=stack._merge_dict) as merge_dict:
+            result = self._compile(stack_dir, 'node3')
+            # global, cluster and role layers come from the cache
+            assert merge_dict.call_count == 0
+        assert stack._layer_cache.hits == hits + 3
+        assert result == {'time_server': 'ntp', 'list': ['a', 'mon'], 'fsid': 1234}
+
+    def test_same_result_as_uncached(self, stack_dir):
+        expected = {}
+        for minion, roles in [('node1', ['mon']), ('node2', ['mon']), ('node1', []),
+                              ('node2', ['mon', 'mon']), ('node1', ['mon'])]:
+            stack.clear_caches()
+            expected[(minion, tuple(roles))] = self._compile(stack_dir, minion, roles)
+        stack.clear_caches()
+        for _ in range(3):
+            for (minion, roles), result in expected.items():
+                assert self._compile(stack_dir, minion, roles) == result
+
+    def test_cached_layers_not_mutated(self, stack_dir):
+        stack_dir.join('ceph', 'cluster.yml').write('fsid: 1234\n')
+        for minion in ['node1', 'node2', 'node3']:
+            result = self._compile(stack_dir, minion)
+            result['list'].append(minion)
+            result['time_server'] = minion
+        result = self._compile(stack_dir, 'node1')
+        assert result == {'time_server': 'ntp', 'list': ['a', 'mon'], 'fsid': 1234,
+                          'public_address': 'node1'}
+
+    def test_not_memoized_on_non_empty_stack(self, stack_dir):
+        pillar = {'cluster': 'ceph', 'roles': ['mon']}
+        for minion in ['node1', 'node2', 'node1']:
+            result = stack._process_stack_cfg(str(stack_dir.join('stack.cfg')),
+                                              {'list': ['x']}, minion, pillar)
+            assert result['list'] == ['x', 'a', 'mon']
+        assert len(stack._layer_cache) == 0
+
+    def test_cached_layers_not_mutated_by_template(self, stack_dir):
+        stack_dir.join('ceph', 'cluster.yml').write('fsid: 1234\n')
+        stack_dir.join('ceph', 'minions', 'node1.yml').write(
+            '{% set _ = stack["list"].append("node1") %}'
+            '{% set _ = stack.update({"time_server": "node1"}) %}'
+            'public_address: node1\n')
+        for minion in ['node2', 'node3', 'node1']:
+            self._compile(stack_dir, minion)
+        result = self._compile(stack_dir, 'node2')
+        assert result == {'time_server': 'ntp', 'list': ['a', 'mon'], 'fsid': 1234,
+                          'public_address': 'node2'}
+
+
+# Reference implementation of the merging strategies, as merged in place before
+# the copy-on-write merge engine
+def _reference_cleanup(obj):
+    if obj:
+        if isinstance(obj, dict):
+            obj.pop('__', None)
+            for k, v in obj.items():
+                obj[k] = _reference_cleanup(v)
+        elif isinstance(obj, list) and isinstance(obj[0], dict) \
+                and '__' in obj[0]:
+            del obj[0]
+    return obj
+
+
+def _reference_merge_dict(stack, obj):
+    strategy = obj.pop('__', 'merge-last')
+    if strategy not in stack_module_strategies:
+        raise Exception('Unknown strategy')
+    if strategy == 'overwrite':
+        return _reference_cleanup(obj)
+    else:
+        for k, v in obj.items():
+            if strategy == 'remove':
+                stack.pop(k, None)
+                continue
+            if k in stack:
+                if strategy == 'merge-first':
+                    stack_k = stack[k]
+                    stack[k] = _reference_cleanup(v)
+                    v = stack_k
+                if type(stack[k]) != type(v):
+                    stack[k] = _reference_cleanup(v)
+                elif isinstance(v, dict):
+                    stack[k] = _reference_merge_dict(stack[k], v)
+                elif isinstance(v, list):
+                    stack[k] = _reference_merge_list(stack[k], v)
+                else:
+                    stack[k] = v
+            else:
+                stack[k] = _reference_cleanup(v)
+        return stack
+
+
+def _reference_merge_list(stack, obj):
+    strategy = 'merge-last'
+    if obj and isinstance(obj[0], dict) and '__' in obj[0]:
+        strategy = obj[0]['__']
+        del obj[0]
+    if strategy not in stack_module_strategies:
+        raise Exception('Unknown strategy')
+    if strategy == 'overwrite':
+        return obj
+    elif strategy == 'remove':
+        return [item for item in stack if item not in obj]
+    elif strategy == 'merge-first':
+        return obj + stack
+    else:
+        return stack + obj
+
+
+stack_module_strategies = stack.strategies
+KEYS = ['a', 'b', 'c', 'd', 'e']
+SCALARS = [0, 1, True, False, 1.0, 'x', 'y', None]
+
+
+def _random_strategy(rnd):
+    if rnd.random() < 0.01:
+        return 'unknown'
+    return rnd.choice(stack.strategies)
+
+
+def _random_value(rnd, depth, markers=True):
+    kind = rnd.random()
+    if depth > 3 or kind < 0.4:
+        return rnd.choice(SCALARS)
+    elif kind < 0.75:
+        return _random_dict(rnd, depth + 1, markers)
+    # the first item is never a strategy marker itself, as the reference
+    # implementation strips the markers of the list again at every merge
+    items = [_random_value(rnd, depth + 2, markers and i > 0)
+             for i in range(rnd.randint(0, 4))]
+    if markers and rnd.random() < 0.3:
+        items.insert(0, {'__': _random_strategy(rnd)})
+    return items
+
+
+def _random_dict(rnd, depth=0, markers=True):
+    obj = {}
+    if markers and rnd.random() < 0.3:
+        obj['__'] = _random_strategy(rnd)
+    for key in rnd.sample(KEYS, rnd.randint(0, len(KEYS))):
+        obj[key] = _random_value(rnd, depth, markers)
+    return obj
+
+
+def _merge_layers(layers):
+    merged = {}
+    for layer in copy.deepcopy(layers):
+        merged = stack._merge_dict(merged, layer, stack._strip_strategies(layer))
+    return stack._copy_tree(merged)
+
+
+def _reference_merge_layers(layers):
+    merged = {}
+    for layer in copy.deepcopy(layers):
+        merged = _reference_merge_dict(merged, layer)
+    return merged
+
+
+class TestStackMergeEquivalence():
+
+    @pytest.mark.parametrize('seed', range(1000))
+    def test_same_result_as_reference(self, seed):
+        rnd = random.Random(seed)
+        layers = [_random_dict(rnd) for _ in range(rnd.randint(1, 6))]
+        try:
+            expected = _reference_merge_layers(layers)
+        except Exception:
+            with pytest.raises(Exception):
+                _merge_layers(layers)
+            return
+        result = _merge_layers(layers)
+        assert result == expected
+        assert repr(result) == repr(expected)
+
+    @pytest.mark.parametrize('seed', range(100))
+    def test_arguments_not_modified(self, seed):
+        rnd = random.Random(seed)
+        base = _reference_cleanup(_random_dict(rnd))
+        layer = _random_dict(rnd)
+        obj = copy.deepcopy(layer)
+        obj_strategies = stack._strip_strategies(obj)
+        base_copy = copy.deepcopy(base)
+        obj_copy = copy.deepcopy(obj)
+        try:
+            stack._merge_dict(base, obj, obj_strategies)
+        except Exception:
+            pass
+        assert base == base_copy
+        assert obj == obj_copy
+
+    def test_remove_unhashable_items(self):
+        merged = stack._merge_list([1, 'a', {'b': 1}, [2], 3, {'b': 2}],
+                                   [{'b': 1}, 3, [2], 'z'], ('remove', None))
+        assert merged == [1, 'a', {'b': 2}]
+
+
+class TestStackProfile():
+
+    def test_profile(self, stack_dir):
+        stats_file = stack_dir.join('stats.json')
+        stack.__opts__ = {'pillar_stack_profile': True,
+                          'pillar_stack_profile_file': str(stats_file)}
+        pillar = {'cluster': 'ceph', 'roles': ['mon']}
+        for minion in ['node1', 'node2', 'node3']:
+            stack.ext_pillar(minion, pillar, str(stack_dir.join('stack.cfg')))
+        records = [json.loads(line) for line in stats_file.readlines()]
+        assert [r['minion'] for r in records] == ['node1', 'node2', 'node3']
+        files = records[0]['files']
+        assert [f['path'] for f in files] == ['stack.cfg', 'global.yml', 'ceph/cluster.yml',
+                                              'ceph/roles/mon.yml', 'ceph/minions/node1.yml']
+        for f in files:
+            assert f['render'] >= 0 and f['parse'] >= 0 and f['merge'] >= 0
+        # missing.yml, and the minion file of node3
+        assert records[0]['missing'] == 1
+        assert records[2]['missing'] == 2
+        assert records[0]['total'] >= records[0]['render']
+
+    def test_profile_disabled(self, stack_dir):
+        with patch.object(stack._StackProfile, 'report') as report:
+            stack.ext_pillar('node1', {}, str(stack_dir.join('stack.cfg')))
+            assert not report.called
+
+
+def test_caches_kept_by_module_reload():
+    template_cache = stack._template_cache
+    stack._yaml_cache.put('key', ({}, None))
+    reloaded = reload_module(stack)
+    assert reloaded._template_cache is template_cache
+    assert reloaded._yaml_cache.get('key') == ({}, None)
+    stack.clear_caches()
@@ -0,0 +1,243 @@
+"""
+Pillar stack benchmark with a synthetic /srv/pillar/ceph/stack tree.
+The stack ext_pillar is called for every minion, like on a pillar refresh of
+the whole cluster, with stubbed __opts__, __salt__ and __grains__.
+
+Run with custom sizes:
+    $ python -m tests.unit.pillar.test_stack_benchmark --minions 1000 --roles 6 --osds 24
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+import pytest
+import yaml
+
+sys.path.insert(0, 'srv/modules/pillar')
+import stack
+
+
+STACK_CFG = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', '..',
+                         'srv', 'pillar', 'ceph', 'stack', 'stack.cfg')
+CLUSTER = 'ceph'
+ROLES = ['storage', 'mon', 'mgr', 'mds', 'rgw', 'igw', 'ganesha', 'openattic',
+         'prometheus', 'grafana']
+
+
+def _write_yaml(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as yml:
+        yaml.safe_dump(content, yml, default_flow_style=False)
+
+
+def _minion_name(idx):
+    return 'node{:05d}.ceph'.format(idx)
+
+
+def _minion_roles(idx, num_roles):
+    """
+    Every minion is a storage node, one in four also has one of the other roles
+    """
+    roles = ['storage']
+    if num_roles > 1 and idx % 4 == 0:
+        roles.append(ROLES[1 + (idx // 4) % (num_roles - 1)])
+    return roles
+
+
+def _osds(num_osds):
+    osds = {}
+    for osd in range(num_osds):
+        device = '/dev/disk/by-id/scsi-SATA_HGST_HUH721010AL_{:08d}'.format(osd)
+        osds[device] = {
+            'format': 'bluestore',
+            'encryption': '',
+            'db': '/dev/disk/by-id/nvme-INTEL_SSDPE2MD400G4_{:04d}'.format(osd // 6),
+            'db_size': '50G',
+            'wal': '/dev/disk/by-id/nvme-INTEL_SSDPE2MD400G4_{:04d}'.format(osd // 6),
+            'wal_size': '2G',
+        }
+    return osds
+
+
+def create_stack_tree(basedir, num_minions, num_roles, num_osds, custom_minions=0.1):
+    """
+    Creates the stack tree of a synthetic cluster
+    Returns:
+        list: the (minion id, pillar) of every minion
+    """
+    shutil.copy(STACK_CFG, os.path.join(basedir, 'stack.cfg'))
+    default = os.path.join(basedir, 'default')
+    _write_yaml(os.path.join(default, 'global.yml'), {
+        'time_server': 'admin.ceph',
+        'time_service': 'ntp',
+        'time_init': 'ntp',
+        'monitoring': {'prometheus': {'relabel_config': {}, 'rule_files': []}},
+    })
+    _write_yaml(os.path.join(default, CLUSTER, 'cluster.yml'), {
+        'fsid': 'bbc3a0a5-2d34-4c1d-9a8c-46fe8e8fd1d0',
+        'public_network': '172.16.1.0/24',
+        'cluster_network': '172.16.2.0/24',
+        'available_roles': ROLES[:num_roles],
+        'rgw_configurations': ['rgw'],
+        'ceph_conf': {'global': {'mon_allow_pool_delete': True}},
+    })
+    for role in ROLES[:num_roles]:
+        _write_yaml(os.path.join(default, CLUSTER, 'roles', '{}.yml'.format(role)), {
+            '{}_init'.format(role): 'default',
+            'ceph_conf': {role: {'debug_{}'.format(role): '1/5'}},
+        })
+    _write_yaml(os.path.join(basedir, 'global.yml'), {
+        'ceph_conf': {'global': {'osd_pool_default_size': 3}},
+    })
+    _write_yaml(os.path.join(basedir, CLUSTER, 'cluster.yml'), {
+        'rgw_configurations': [{'__': 'overwrite'}, 'rgw-ssl'],
+    })
+
+    minions = []
+    osds = _osds(num_osds)
+    for idx in range(num_minions):
+        minion = _minion_name(idx)
+        _write_yaml(os.path.join(default, CLUSTER, 'minions', '{}.yml'.format(minion)), {
+            'public_address': '172.16.1.{}'.format(idx % 250 + 2),
+            'cluster_address': '172.16.2.{}'.format(idx % 250 + 2),
+            'ceph': {'storage': {'osds': osds}},
+        })
+        if idx < num_minions * custom_minions:
+            _write_yaml(os.path.join(basedir, CLUSTER, 'minions', '{}.yml'.format(minion)), {
+                'ceph': {'storage': {'osds': {'__': 'remove', sorted(osds)[0]: None}}},
+            })
+        minions.append((minion, {'cluster': CLUSTER, 'roles': _minion_roles(idx, num_roles)}))
+    return minions
+
+
+def _percentile(values, pct):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    idx = int(round((len(values) - 1) * pct / 100.0))
+    return values[idx]
+
+
+def run_benchmark(num_minions, num_roles, num_osds, cold=False, trace_memory=False):
+    """
+    Compiles the stack pillar of every minion of a synthetic cluster
+    Args:
+        cold (bool): clear the process-wide caches before every minion
+        trace_memory (bool): trace the memory allocations (slower)
+    Returns:
+        dict: the benchmark results
+    """
+    basedir = tempfile.mkdtemp()
+    try:
+        minions = create_stack_tree(basedir, num_minions, num_roles, num_osds)
+        stack.__opts__ = {'id': 'admin.ceph'}
+        stack.__salt__ = {}
+        stack.__grains__ = {}
+        stack.clear_caches()
+        cfg = os.path.join(basedir, 'stack.cfg')
+
+        if trace_memory:
+            tracemalloc.start()
+        latencies = []
+        results = {}
+        t0 = time.time()
+        for minion, pillar in minions:
+            if cold:
+                stack.clear_caches()
+            t1 = time.time()
+            results[minion] = stack.ext_pillar(minion, pillar, cfg)
+            latencies.append(time.time() - t1)
+        elapsed = time.time() - t0
+        peak_memory = None
+        retained_memory = None
+        if trace_memory:
+            retained_memory, peak_memory = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+    finally:
+        shutil.rmtree(basedir)
+        stack.clear_caches()
+
+    return {
+        'minions': num_minions,
+        'roles': num_roles,
+        'osds': num_osds,
+        'cold': cold,
+        'elapsed': elapsed,
+        'minions_per_sec': num_minions / elapsed if elapsed > 0 else 0.0,
+        'p50_latency': _percentile(latencies, 50),
+        'p99_latency': _percentile(latencies, 99),
+        'max_latency': max(latencies) if latencies else 0.0,
+        'peak_memory': peak_memory,
+        'retained_memory': retained_memory,
+        'results': results,
+    }
+
+
+def format_result(res):
+    def fmem(size):
+        return "n/a" if size is None else "{:.1f}MiB".format(size / (1024.0 * 1024.0))
+    return ("{cache:5} minions={minions} roles={roles} osds={osds} total={elapsed:.2f}s "
+            "minions/s={mps:.0f} p50={p50:.2f}ms p99={p99:.2f}ms max={max:.2f}ms "
+            "peak_mem={peak} retained_mem={retained}"
+            .format(cache='cold' if res['cold'] else 'warm', minions=res['minions'],
+                    roles=res['roles'], osds=res['osds'], elapsed=res['elapsed'],
+                    mps=res['minions_per_sec'], p50=res['p50_latency'] * 1000,
+                    p99=res['p99_latency'] * 1000, max=res['max_latency'] * 1000,
+                    peak=fmem(res['peak_memory']), retained=fmem(res['retained_memory'])))
+
+
+class TestStackBenchmark():
+
+    def _check(self, res):
+        print("\n" + format_result(res))
+        assert len(res['results']) == res['minions']
+        for idx in range(res['minions']):
+            pillar = res['results'][_minion_name(idx)]
+            assert pillar['fsid'] == 'bbc3a0a5-2d34-4c1d-9a8c-46fe8e8fd1d0'
+            assert pillar['rgw_configurations'] == ['rgw-ssl']
+            assert pillar['ceph_conf']['global'] == {'mon_allow_pool_delete': True,
+                                                     'osd_pool_default_size': 3}
+            osds = pillar['ceph']['storage']['osds']
+            # the customized minions have one OSD less
+            assert len(osds) in [res['osds'], res['osds'] - 1]
+
+    def test_benchmark_warm(self):
+        self._check(run_benchmark(50, 4, 12))
+
+    def test_benchmark_cold(self):
+        self._check(run_benchmark(20, 4, 12, cold=True))
+
+    @pytest.mark.skipif(tracemalloc is None, reason="tracemalloc not available")
+    def test_benchmark_memory(self):
+        res = run_benchmark(10, 2, 4, trace_memory=True)
+        self._check(res)
+        assert res['peak_memory'] > 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSea pillar stack benchmark")
+    parser.add_argument('--minions', type=int, default=500)
+    parser.add_argument('--roles', type=int, default=6, choices=range(1, len(ROLES) + 1))
+    parser.add_argument('--osds', type=int, default=24, help="OSDs per minion")
+    parser.add_argument('--cold', action='store_true',
+                        help="clear the caches before every minion")
+    parser.add_argument('--memory', action='store_true', help="trace allocations (slower)")
+    args = parser.parse_args()
+    print(format_result(run_benchmark(args.minions, args.roles, args.osds, args.cold,
+                                      args.memory)))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+from mock import patch, MagicMock
+from srv.modules.runners import pillarcache
+
+
+GRAINS = {'id': 'node1', 'deepsea': True}
+
+
+def _minion_data(minion, opts):
+    if minion == 'nograins':
+        return minion, None, None
+    return minion, dict(GRAINS, id=minion), None
+
+
+class TestPillarCache():
+
+    def setup_method(self):
+        pillarcache.__opts__ = {'minion_data_cache': True, 'pillar_cache': False}
+
+    @patch('salt.cache.factory')
+    @patch('salt.pillar.Pillar')
+    @patch('salt.utils.minions.get_minion_data', new=_minion_data)
+    def test_compile(self, pillar, cache_factory):
+        pillar.return_value.compile_pillar.return_value = {'roles': ['mon']}
+        result = pillarcache._compile('node1', 'base', None)
+        assert result['minion'] == 'node1'
+        assert result['errors'] == []
+        pillar.assert_called_with(pillarcache.__opts__, dict(GRAINS, id='node1'), 'node1',
+                                  'base', pillarenv=None)
+        cache_factory.return_value.store.assert_called_with(
+            'minions/node1', 'data', {'grains': dict(GRAINS, id='node1'),
+                                      'pillar': {'roles': ['mon']}})
+
+    @patch('salt.cache.factory')
+    @patch('salt.pillar.PillarCache')
+    @patch('salt.utils.minions.get_minion_data', new=_minion_data)
+    def test_compile_pillar_cache(self, pillar_cache, cache_factory):
+        pillarcache.__opts__['pillar_cache'] = True
+        compiler = pillar_cache.return_value
+        compiler.compile_pillar.return_value = {'roles': ['mon']}
+        result = pillarcache._compile('node1', 'base', None)
+        assert result['errors'] == []
+        pillar_cache.assert_called_with(pillarcache.__opts__, dict(GRAINS, id='node1'), 'node1',
+                                        'base', pillarenv=None)
+        # the stale entry is removed, so that the pillar is compiled and stored
+        assert compiler.clear_pillar.call_count == 1
+
+    @patch('salt.cache.factory')
+    @patch('salt.pillar.Pillar')
+    @patch('salt.utils.minions.get_minion_data', new=_minion_data)
+    def test_compile_errors_not_stored(self, pillar, cache_factory):
+        pillar.return_value.compile_pillar.return_value = {'_errors': ['render error']}
+        result = pillarcache._compile('node1', 'base', None)
+        assert result['errors'] == ['render error']
+        assert not cache_factory.return_value.store.called
+
+    @patch('salt.cache.factory')
+    @patch('salt.pillar.Pillar')
+    @patch('salt.utils.minions.get_minion_data', new=_minion_data)
+    def test_compile_no_grains(self, pillar, cache_factory):
+        result = pillarcache._compile('nograins', 'base', None)
+        assert result['errors'] == ['no cached grains']
+        assert not pillar.called
+
+    @patch('salt.cache.factory')
+    @patch('salt.pillar.Pillar')
+    @patch('salt.utils.minions.get_minion_data', new=_minion_data)
+    @patch('salt.utils.minions.CkMinions')
+    def test_warm(self, ckminions, pillar, cache_factory):
+        minions = ['node{}'.format(i) for i in range(10)] + ['nograins']
+        ckminions.return_value.check_minions.return_value = {'minions': minions}
+        pillar.return_value.compile_pillar.return_value = {'roles': ['storage']}
+        result = pillarcache.warm(target='G@deepsea:*', workers=3, force=True)
+        ckminions.return_value.check_minions.assert_called_with('G@deepsea:*',
+                                                                tgt_type='compound')
+        assert result['minions'] == 11
+        assert result['compiled'] == 10
+        assert result['errors'] == {'nograins': ['no cached grains']}
+        assert sorted(result['timings']) == sorted(minions)
+        assert result['result']
+
+    @patch('srv.modules.runners.pillarcache.Process')
+    @patch('salt.cache.factory')
+    @patch('salt.pillar.Pillar')
+    @patch('salt.utils.minions.get_minion_data', new=_minion_data)
+    @patch('salt.utils.minions.CkMinions')
+    def test_warm_daemonic(self, ckminions, pillar, cache_factory, process):
+        process.return_value.start.side_effect = AssertionError(
+            'daemonic processes are not allowed to have children')
+        ckminions.return_value.check_minions.return_value = ['node1', 'nograins']
+        pillar.return_value.compile_pillar.return_value = {'roles': ['storage']}
+        result = pillarcache.warm(target='G@deepsea:*', workers=3, force=True)
+        assert result['compiled'] == 1
+        assert result['errors'] == {'nograins': ['no cached grains']}
+        assert result['result']
+
+    @patch('srv.modules.runners.pillarcache.Process')
+    @patch('salt.utils.minions.CkMinions')
+    def test_warm_dead_workers(self, ckminions, process):
+        process.return_value.is_alive.return_value = False
+        ckminions.return_value.check_minions.return_value = ['node1', 'node2']
+        result = pillarcache.warm(target='G@deepsea:*', workers=2, force=True)
+        assert result['compiled'] == 0
+        assert sorted(result['errors']) == ['node1', 'node2']
+
+    @patch('salt.utils.minions.CkMinions')
+    def test_warm_pillar_cache_disabled(self, ckminions):
+        result = pillarcache.warm(target='G@deepsea:*')
+        assert result['result']
+        assert not ckminions.called
+
+    @patch('srv.modules.runners.pillarcache._deepsea_minions', return_value=None)
+    def test_warm_no_deepsea_minions(self, deepsea_minions):
+        result = pillarcache.warm(force=True)
+        assert not result['result']
@@ -1,7 +1,10 @@
 from pyfakefs import fake_filesystem as fake_fs
 from pyfakefs import fake_filesystem_glob as fake_glob
 from mock import patch, mock_open, MagicMock
+import glob
+import stat
 import sys
+import yaml
 sys.path.insert(0, 'srv/modules/pillar')
 from srv.modules.runners import push
 
@@ -73,12 +76,13 @@ class TestPush():
         assert len(parsed) == len(nodes)
 
     @patch('glob.glob', new=f_glob.glob)
+    @patch('os.listdir', new=f_os.listdir)
     @patch('os.path.isfile', new=f_os.path.isfile)
     @patch('builtins.open', new=f_open)
     @patch('os.stat')
     def test_organize(self, mock_stat):
         # make sure all out faked files have content
-        mock_stat.return_value = MagicMock(st_size=1)
+        mock_stat.return_value = MagicMock(st_size=1, st_mode=stat.S_IFREG)
         p_d = push.PillarData(False)
 
         organized = p_d.organize('policy.cfg')
@@ -119,4 +123,91 @@ class TestPush():
         result = push.organize('policy.cfg')
         assert result == {}
 
-
+    @patch('builtins.open', new=f_open)
+    def test_merge_strategies(self):
+        fs.CreateFile('merge/a.yml', contents='roles:\n- mon\nfsid: a\n')
+        fs.CreateFile('merge/b.yml', contents='roles:\n- __: overwrite\n- mgr\nfsid: b\n')
+        merged = push._merge('a', {'a': ['merge/a.yml', 'merge/b.yml']})
+        assert merged == {'roles': ['mgr'], 'fsid': 'b'}
+
+    def _pillar_data(self, tmpdir, dryrun=False):
+        tmpdir.join('proposals', 'a.yml').write('fsid: a\n', ensure=True)
+        tmpdir.join('proposals', 'b.yml').write('fsid: b\n', ensure=True)
+        p_d = push.PillarData(dryrun)
+        p_d.pillar_dir = str(tmpdir)
+        return p_d
+
+    def test_output_unchanged(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        common = {'stack/default/ceph/cluster.yml': [str(tmpdir.join('proposals', 'a.yml'))]}
+        filename = str(tmpdir.join('stack', 'default', 'ceph', 'cluster.yml'))
+
+        summary = p_d.output(common)
+        assert summary == {'changed': [filename], 'unchanged': 0, 'removed': []}
+        mtime = tmpdir.join('stack', 'default', 'ceph', 'cluster.yml').mtime()
+
+        summary = p_d.output(common)
+        assert summary == {'changed': [], 'unchanged': 1, 'removed': []}
+        assert tmpdir.join('stack', 'default', 'ceph', 'cluster.yml').mtime() == mtime
+
+        common = {'stack/default/ceph/cluster.yml': [str(tmpdir.join('proposals', 'b.yml'))]}
+        summary = p_d.output(common)
+        assert summary == {'changed': [filename], 'unchanged': 0, 'removed': []}
+        assert tmpdir.join('stack', 'default', 'ceph', 'cluster.yml').read() == 'fsid: b\n'
+        assert [f.basename for f in tmpdir.join('stack', 'default', 'ceph').listdir()] == \
+            ['cluster.yml']
+
+    def test_output_removes_orphans(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        proposal = str(tmpdir.join('proposals', 'a.yml'))
+        p_d.output({'stack/default/ceph/cluster.yml': [proposal],
+                    'stack/default/ceph/minions/mon1.yml': [proposal]})
+
+        summary = p_d.output({'stack/default/ceph/cluster.yml': [proposal]})
+        orphan = str(tmpdir.join('stack', 'default', 'ceph', 'minions', 'mon1.yml'))
+        assert summary == {'changed': [], 'unchanged': 1, 'removed': [orphan]}
+        assert not tmpdir.join('stack', 'default', 'ceph', 'minions').check()
+        # the customization files are never removed
+        assert tmpdir.join('stack', 'ceph', 'minions', 'mon1.yml').check()
+
+    def test_output_dryrun(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        proposal = str(tmpdir.join('proposals', 'a.yml'))
+        p_d.output({'stack/default/ceph/minions/mon1.yml': [proposal]})
+
+        p_d.dryrun = True
+        summary = p_d.output({'stack/default/ceph/cluster.yml': [proposal]})
+        assert summary['changed'] == [str(tmpdir.join('stack', 'default', 'ceph', 'cluster.yml'))]
+        assert summary['removed'] == [str(tmpdir.join('stack', 'default', 'ceph', 'minions',
+                                                      'mon1.yml'))]
+        assert not tmpdir.join('stack', 'default', 'ceph', 'cluster.yml').check()
+        assert tmpdir.join('stack', 'default', 'ceph', 'minions', 'mon1.yml').check()
+
+    def test_directory_index_glob(self, tmpdir):
+        for path in ['role-mon/cluster/mon1.sls', 'role-mon/cluster/mon2.sls',
+                     'role-mon/cluster/.hidden.sls', 'role-mgr/cluster/mon1.sls',
+                     'role-mon/stack/default/ceph/minions/mon1.yml', 'config/global.yml']:
+            tmpdir.join(path).write('a: 1\n', ensure=True)
+        index = push._DirectoryIndex()
+        for pattern in ['role-mon/cluster/*.sls', 'role-*/cluster/mon1.sls',
+                        'role-mon/cluster/.*', 'role-mon/*', 'role-mon/cluster/mon[1,2].sls',
+                        'role-mon/stack/default/ceph/minions/*yml', 'config/global.yml',
+                        'config/missing.yml', 'missing/*.sls', 'role-*/*/*']:
+            pattern = '{}/{}'.format(tmpdir, pattern)
+            assert index.glob(pattern) == sorted(glob.glob(pattern))
+
+    def test_output_parallel(self, tmpdir):
+        p_d = self._pillar_data(tmpdir)
+        common = {}
+        for idx in range(8):
+            proposal = tmpdir.join('proposals', 'minions', 'mon{}.yml'.format(idx))
+            proposal.write('roles:\n- mon\nosds:\n  /dev/sd{}: {{}}\n'.format(idx), ensure=True)
+            common['stack/default/ceph/minions/mon{}.yml'.format(idx)] = [
+                str(tmpdir.join('proposals', 'a.yml')), str(proposal)]
+        with patch.object(push, 'PARALLEL_THRESHOLD', 0):
+            summary = p_d.output(common, workers=2)
+        assert len(summary['changed']) == 8
+        assert yaml.safe_load(tmpdir.join('stack', 'default', 'ceph', 'minions',
+                                          'mon3.yml').read()) == \
+            {'fsid': 'a', 'roles': ['mon'], 'osds': {'/dev/sd3': {}}}
+        assert p_d.output(common, workers=1) == {'changed': [], 'unchanged': 8, 'removed': []}
@@ -0,0 +1,187 @@
+"""
+push.proposal benchmark with a synthetic /srv/pillar/ceph/proposals tree,
+laid out like the one written by populate.proposals.
+The policy.cfg is organized and the pillar written twice: the first run writes
+every file, the second one finds them unchanged.
+
+Run with custom sizes:
+    $ python -m tests.unit.runners.test_push_benchmark --minions 2000 --workers 8
+"""
+from __future__ import absolute_import
+from __future__ import print_function
+
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+import yaml
+
+sys.path.insert(0, 'srv/modules/pillar')
+from srv.modules.runners import push
+
+
+CLUSTER = 'ceph'
+ROLES = ['master', 'mon', 'mgr', 'mds', 'rgw', 'igw']
+
+
+def _write_yaml(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as yml:
+        yaml.safe_dump(content, yml, default_flow_style=False)
+
+
+def _minion_name(idx):
+    return 'node{:05d}.ceph'.format(idx)
+
+
+def create_proposals_tree(basedir, num_minions, num_osds):
+    """
+    Creates the proposals tree and policy.cfg of a synthetic cluster, every
+    minion is a storage node and the first ones get the other roles
+    Returns:
+        str: the policy.cfg filename
+    """
+    _write_yaml(os.path.join(basedir, 'config', 'stack', 'default', 'global.yml'), {
+        'time_server': 'admin.ceph',
+        'time_service': 'ntp',
+    })
+    _write_yaml(os.path.join(basedir, 'config', 'stack', 'default', CLUSTER, 'cluster.yml'), {
+        'fsid': 'bbc3a0a5-2d34-4c1d-9a8c-46fe8e8fd1d0',
+        'public_network': '172.16.1.0/24',
+        'cluster_network': '172.16.2.0/24',
+        'available_roles': ROLES + ['storage'],
+    })
+    for idx in range(num_minions):
+        minion = _minion_name(idx)
+        _write_yaml(os.path.join(basedir, 'cluster-{}'.format(CLUSTER), 'cluster',
+                                 '{}.sls'.format(minion)), {'cluster': CLUSTER})
+        for role in ROLES:
+            _write_yaml(os.path.join(basedir, 'role-{}'.format(role), 'cluster',
+                                     '{}.sls'.format(minion)), {'roles': [role]})
+        _write_yaml(os.path.join(basedir, 'role-mon', 'stack', 'default', CLUSTER, 'minions',
+                                 '{}.yml'.format(minion)),
+                    {'public_address': '172.16.1.{}'.format(idx % 250 + 2)})
+        _write_yaml(os.path.join(basedir, 'profile-default', 'cluster',
+                                 '{}.sls'.format(minion)), {'roles': ['storage']})
+        osds = {}
+        for osd in range(num_osds):
+            osds['/dev/disk/by-id/scsi-SATA_HGST_{:05d}_{:04d}'.format(idx, osd)] = {
+                'format': 'bluestore',
+                'db': '/dev/disk/by-id/nvme-INTEL_{:05d}_{:02d}'.format(idx, osd // 6),
+                'wal': '/dev/disk/by-id/nvme-INTEL_{:05d}_{:02d}'.format(idx, osd // 6),
+            }
+        _write_yaml(os.path.join(basedir, 'profile-default', 'stack', 'default', CLUSTER,
+                                 'minions', '{}.yml'.format(minion)),
+                    {'ceph': {'storage': {'osds': osds}}})
+
+    policy_cfg = os.path.join(basedir, 'policy.cfg')
+    with open(policy_cfg, 'w') as policy:
+        policy.write("cluster-{}/cluster/*.sls\n".format(CLUSTER))
+        policy.write("profile-default/cluster/*.sls\n")
+        policy.write("profile-default/stack/default/{}/minions/*.yml\n".format(CLUSTER))
+        policy.write("config/stack/default/global.yml\n")
+        policy.write("config/stack/default/{}/cluster.yml\n".format(CLUSTER))
+        policy.write("role-master/cluster/*.sls slice=[0:1]\n")
+        policy.write("role-mon/cluster/*.sls slice=[1:4]\n")
+        policy.write("role-mon/stack/default/{}/minions/*.yml slice=[1:4]\n".format(CLUSTER))
+        policy.write("role-mgr/cluster/*.sls slice=[1:4]\n")
+        policy.write(r"role-mds/cluster/*.sls re=.*node0000[4-5]\.ceph\.sls$" + "\n")
+        policy.write("role-rgw/cluster/*.sls slice=[6:8]\n")
+        policy.write("role-igw/cluster/*.sls slice=[8:10]\n")
+    return policy_cfg
+
+
+def run_benchmark(num_minions, num_osds, workers=None):
+    """
+    Pushes the proposals of a synthetic cluster twice
+    Args:
+        workers (int): the number of worker processes, one per CPU by default
+    Returns:
+        dict: the benchmark results
+    """
+    basedir = tempfile.mkdtemp()
+    try:
+        proposals_dir = os.path.join(basedir, 'proposals')
+        policy_cfg = create_proposals_tree(proposals_dir, num_minions, num_osds)
+        pillar_data = push.PillarData()
+        pillar_data.proposals_dir = proposals_dir
+        pillar_data.pillar_dir = basedir
+
+        t0 = time.time()
+        common = pillar_data.organize(policy_cfg)
+        organize_time = time.time() - t0
+
+        t0 = time.time()
+        first = pillar_data.output(common, workers)
+        first_time = time.time() - t0
+
+        t0 = time.time()
+        second = pillar_data.output(pillar_data.organize(policy_cfg), workers)
+        second_time = time.time() - t0
+
+        with open(os.path.join(basedir, 'stack', 'default', CLUSTER, 'minions',
+                               '{}.yml'.format(_minion_name(1)))) as yml:
+            sample = yaml.safe_load(yml)
+    finally:
+        shutil.rmtree(basedir)
+
+    return {
+        'minions': num_minions,
+        'osds': num_osds,
+        'workers': workers,
+        'files': sum(len(files) for files in common.values()),
+        'outputs': len(common),
+        'organize_time': organize_time,
+        'first_time': first_time,
+        'second_time': second_time,
+        'first': first,
+        'second': second,
+        'sample': sample,
+    }
+
+
+def format_result(res):
+    return ("minions={minions} osds={osds} workers={workers} files={files} "
+            "outputs={outputs} organize={organize:.2f}s first={first:.2f}s "
+            "({changed} changed) second={second:.2f}s ({unchanged} unchanged)"
+            .format(minions=res['minions'], osds=res['osds'],
+                    workers=res['workers'] or 'cpus', files=res['files'],
+                    outputs=res['outputs'], organize=res['organize_time'],
+                    first=res['first_time'], changed=len(res['first']['changed']),
+                    second=res['second_time'], unchanged=res['second']['unchanged']))
+
+
+class TestPushBenchmark():
+
+    def _check(self, res):
+        print("\n" + format_result(res))
+        # cluster sls and stack yml for every minion, global.yml and cluster.yml
+        assert res['outputs'] == 2 * res['minions'] + 2
+        assert len(res['first']['changed']) == res['outputs']
+        assert res['second'] == {'changed': [], 'unchanged': res['outputs'], 'removed': []}
+        assert res['sample']['public_address'] == '172.16.1.3'
+        assert len(res['sample']['ceph']['storage']['osds']) == res['osds']
+
+    def test_benchmark_serial(self):
+        self._check(run_benchmark(50, 12, workers=1))
+
+    def test_benchmark_parallel(self):
+        self._check(run_benchmark(150, 12, workers=2))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="DeepSea push.proposal benchmark")
+    parser.add_argument('--minions', type=int, default=2000)
+    parser.add_argument('--osds', type=int, default=24, help="OSDs per minion")
+    parser.add_argument('--workers', type=int, default=None,
+                        help="worker processes, one per CPU by default")
+    args = parser.parse_args()
+    print(format_result(run_benchmark(args.minions, args.osds, args.workers)))
+
+
+if __name__ == "__main__":
+    main()